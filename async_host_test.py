@@ -0,0 +1,115 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests concurrent startup of hosts, and AsyncExpectHost driving many hosts
+from one event loop. Uses ordinary shell processes as hosts, so does not
+require RIOT.
+"""
+
+import asyncio
+import gc
+import os
+import pexpect
+import pytest
+import time
+
+from conftest import AsyncExpectHost, ExpectHost, start_hosts
+
+#
+# tests
+#
+
+def test_concurrent_hosts():
+    """Exchanges with many hosts overlap, rather than run one after another."""
+    qty   = 10
+    delay = 1.0
+
+    async def exchange(host):
+        await host.connect()
+        # each host responds after a delay
+        await host.send_recv('sleep {0}; echo done-$((20+22))'.format(delay),
+                             'done-42')
+        await host.disconnect()
+
+    async def main():
+        hosts = [AsyncExpectHost(None, 'bash --norc --noprofile') for i in range(qty)]
+        start = time.monotonic()
+        await asyncio.gather(*[exchange(host) for host in hosts])
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) < qty * delay / 2
+
+def test_run_and_exit():
+    async def main():
+        output = await AsyncExpectHost(None, 'echo hello').run()
+        host = AsyncExpectHost(None, 'sh -c "sleep 0.2; echo bye"')
+        await host.connect()
+        await host.wait_exit(5)
+        return output, host.term.before
+
+    output, before = asyncio.run(main())
+    assert output == b'hello\n'
+    assert 'bye' in before
+
+def test_timeout():
+    async def main():
+        host = AsyncExpectHost(None, 'cat', timeout=0.2)
+        await host.connect()
+        try:
+            await host.send_recv('ping', 'never')
+        finally:
+            await host.disconnect()
+
+    with pytest.raises(pexpect.TIMEOUT):
+        asyncio.run(main())
+
+def test_start_hosts(tmp_path):
+    """Hosts start concurrently, each in its own folder, without changing the
+       working directory of the test process."""
+    pwd   = os.getcwd()
+    delay = 1.0
+
+    def start(folder):
+        host = ExpectHost(str(folder), 'sh -c "sleep {0}; pwd; cat"'.format(delay))
+        host.connect()
+        host.term.expect(str(folder))
+        return host
+
+    folders = [tmp_path / str(i) for i in range(4)]
+    for folder in folders:
+        folder.mkdir()
+
+    # finalizing pexpect spawn objects from earlier tests sleeps, so get it
+    # out of the way before timing
+    gc.collect()
+    start_time = time.monotonic()
+    hosts = start_hosts([lambda f=f: start(f) for f in folders])
+    assert time.monotonic() - start_time < 2 * delay
+    assert os.getcwd() == pwd
+
+    for host in hosts:
+        host.disconnect()
+
+def test_outlive_loop():
+    """A host that outlives the event loop of a timed out expect, like a
+       pooled host, still works from a new loop."""
+    host = AsyncExpectHost(None, 'cat', timeout=0.2)
+
+    async def first():
+        await host.connect()
+        with pytest.raises(pexpect.TIMEOUT):
+            await host.expect('never')
+
+    async def second():
+        host.term.sendline('after-loop')
+        await host.expect('after-loop', 2)
+        host.term.sendeof()
+        await host.wait_exit(2)
+
+    asyncio.run(first())
+    assert not host.term._callbacks
+    asyncio.run(second())
@@ -8,10 +8,17 @@
 """
 Test nanocoap Block1 server response to SHA256 hash request payload
 
-Expected result: aiocoap prints response code 2.04 and SHA256 digest
+Sends the payload block by block, reading each block from the payload source
+as it is sent, and hashing it. So memory use is constant regardless of payload
+size. The payload is a short sentence by default, or the contents of a file
+(-f), or deterministic pseudo-random data of a given size (-s, -e).
+
+Expected result: aiocoap prints the expected SHA256 digest of the payload, and
+then response code 2.04 and the same digest
 
 Usage:
-    usage: block1_client.py -r HOST [-b BLOCK_SIZE] [-c FILE]
+    usage: block1_client.py -r HOST [-b BLOCK_SIZE] [-c FILE] [-f FILE]
+                            [-s SIZE] [-e SEED]
     usage: block1_client.py -h
 
     optional arguments:
@@ -19,56 +26,104 @@ Usage:
       -r HOST        remote host for URI
       -b BLOCK_SIZE  one of 16, 32, 64, ..., 1024
       -c FILE        DTLS credentials file, name format: *.json
+      -f FILE        file for payload
+      -s SIZE        size of pseudo-random payload, in bytes
+      -e SEED        seed for pseudo-random payload; 0 by default
 
 Example:
 
 $ PYTHONPATH="/home/kbee/src/aiocoap" ./block1_client.py -r [fe80::200:bbff:febb:2%tap0]
 
+Expected: C496DF5946783990BEC5EFDC2999530EEB9175B83094BAE66170FF2431FC896E
 Result: 2.04 Changed
 b'C496DF5946783990BEC5EFDC2999530EEB9175B83094BAE66170FF2431FC896E'
 """
 
 import logging
 import asyncio
+import hashlib
 import json
 import math
+import os
 from argparse import ArgumentParser
 from aiocoap import *
+from aiocoap import optiontypes
 from conftest import proto_params
 from pathlib import Path
+from payload_source import open_payload
+from readiness import coap_ping, split_host, wait_ready_async
 
-logging.basicConfig(level=logging.INFO)
+DEFAULT_PAYLOAD = b'If one advances confidently in the direction of his dreams...'
 
-async def main(host, block_size, credentialsFile=None):
-    # create async context and wait a couple of seconds
+async def main(host, block_size, credentialsFile=None, payloadFile=None,
+               payloadSize=None, seed=0):
+    # create async context and wait for the server to answer
     context = await Context.create_client_context()
     if proto_params['is_dtls']:
         context.client_credentials.load_from_dict(json.load(credentialsFile.open('rb')))
-    await asyncio.sleep(2)
-
-    payload = b'If one advances confidently in the direction of his dreams...'
-
-    request = Message(code=POST, payload=payload,
-                      uri='{0}://{1}/sha256'.format(proto_params['uri_proto'], host))
-
-    block_exp = round(math.log(block_size, 2)) - 4
-    request.opt.block1 = optiontypes.BlockOption.BlockwiseTuple(0, 0, block_exp)
-
-    response = await context.request(request).response
-
+    else:
+        # DTLS server ignores a plain CoAP ping; rely on handshake retries
+        addr, port = split_host(host, proto_params['port'])
+        await wait_ready_async(lambda: coap_ping(addr, port), host)
+
+    source = open_payload(payloadFile, payloadSize, seed, DEFAULT_PAYLOAD)
+    try:
+        response, digest = await post_blocks(context, host, source, block_size)
+    finally:
+        source.close()
+        await context.shutdown()
+
+    print('Expected: %s'%digest)
     print('Result: %s\n%r'%(response.code, response.payload))
 
-if __name__ == "__main__":
-    # read command line
-    parser = ArgumentParser()
+async def post_blocks(context, host, source, block_size):
+    """
+    POSTs the payload source to /sha256 with Block1, one block at a time.
+
+    :return: (final response, expected hex digest of the payload sent)
+    """
+    uri    = '{0}://{1}/sha256'.format(proto_params['uri_proto'], host)
+    digest = hashlib.sha256()
+    offset = 0
+    while True:
+        block = source.read(offset, block_size)
+        more  = offset + len(block) < source.size
+        digest.update(block)
+
+        request = Message(code=POST, payload=block, uri=uri)
+        block_exp = round(math.log(block_size, 2)) - 4
+        request.opt.block1 = optiontypes.BlockOption.BlockwiseTuple(
+                                 offset // block_size, more, block_exp)
+        response = await context.request(request, handle_blockwise=False).response
+        if not more or response.code != CONTINUE:
+            return response, digest.hexdigest().upper()
+
+        offset += len(block)
+        # server may ask for a smaller block size
+        if response.opt.block1 is not None:
+            block_size = min(block_size, response.opt.block1.size)
+
+def command(argv=None):
+    """Reads the command line, and provides the main() coroutine for it. Also
+       used by scenario_daemon.py."""
+    parser = ArgumentParser(prog=os.path.basename(__file__))
     parser.add_argument('-r', dest='host', required=True,
                         help='remote host for URI')
     parser.add_argument('-b', dest='block_size', type=int, default=32,
                         help='one of 16, 32, 64, ..., 1024')
     parser.add_argument('-c', dest='credentialsFile', type=Path,
                         help='DTLS credentials file, name format: *.json')
+    parser.add_argument('-f', dest='payloadFile',
+                        help='file for payload')
+    parser.add_argument('-s', dest='payloadSize', type=int,
+                        help='size of pseudo-random payload, in bytes')
+    parser.add_argument('-e', dest='seed', type=int, default=0,
+                        help='seed for pseudo-random payload')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    return main(args.host, args.block_size, args.credentialsFile, args.payloadFile,
+                args.payloadSize, args.seed)
 
-    asyncio.get_event_loop().run_until_complete(main(args.host, args.block_size,
-                                                     args.credentialsFile))
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.get_event_loop().run_until_complete(command())
@@ -10,10 +10,10 @@ Tests POSTing a large payload to a RIOT CoAP server via block1.
 
 import pytest
 import os
+import pexpect
 import re
 
-from conftest import ExpectHost
-from conftest import proto_params
+from conftest import ExpectHost, proto_params, sut_block_host
 
 pwd = os.getcwd()
 
@@ -26,55 +26,42 @@ def block_size(request):
     """Provides the size of the block to test."""
     return request.param
 
-
-@pytest.fixture
-def pkt_block_server():
-    """
-    Provides a block server that uses Packet API functions to build the
-    response.
-    """
-    base_folder = os.environ.get('RIOTAPPSBASE', None)
-    board       = os.environ.get('BOARD', 'native')
-
-    term_cmd = 'make term'
-    term_resp = 'gcoap block handler'
-        
-    host = ExpectHost(os.path.join(base_folder, 'gcoap-block-server'), term_cmd)
-    term = host.connect()
-    term.expect(term_resp)
-
-    # set ULA
-    pid = '5' if proto_params['is_dtls'] else '6'
-    cmd = 'ifconfig {0} add unicast fd00:bbbb::2/64'.format(pid)
-    host.send_recv(cmd, 'success:')
-
-    yield host
-
-    # teardown
-    host.disconnect()
-
 #
 # tests
 #
 
-def run_block1(server_addr, block_size):
-    """Runs block1 test"""
-    signature = b'C496DF5946783990BEC5EFDC2999530EEB9175B83094BAE66170FF2431FC896E'
+def run_block1(client_cmd, server_host, block_size, payload_args='', timeout=30):
+    """Runs block1 test. The client computes the expected digest as it sends
+       the payload; the server must respond with the same digest.
 
-    cmd = './block1_client.py -r [{0}] -b {1} {2}'
-    host = ExpectHost(pwd, cmd.format(server_addr, block_size,
-                                      '-c dtls-credentials.json' if proto_params['is_dtls'] else ''))
+    :param client_cmd: client_cmd fixture
+    :param string server_host: Host for URI, like [fd00:bbbb::2]
+    """
+    args = '-r {0} -b {1} {2} {3}'
+    host = ExpectHost(pwd, client_cmd('block1_client.py', args.format(
+                               server_host, block_size, payload_args,
+                               '-c dtls-credentials.json' if proto_params['is_dtls'] else '')),
+                      timeout=timeout)
 
-    output = host.run()
-    assert re.search(b'2.04 Changed', output)
-    assert re.search(signature, output)
+    term = host.connect()
+    term.expect(r'Expected: (\w+)')
+    signature = term.match.group(1)
+    term.expect(pexpect.EOF)
+    assert re.search('2.04 Changed', term.before)
+    assert re.search(signature, term.before)
 
-def test_block1_buf(nanocoap_server, block_size):
+def test_block1_buf(nanocoap_server, client_cmd, block_size):
     """Handle block1 request for Buffer API based server."""
     address = os.environ.get('TAP_LLADDR_SUT', None)
-    run_block1(address, block_size)
+    run_block1(client_cmd, '[{0}]'.format(address), block_size)
 
-def test_block1_pkt(pkt_block_server, block_size):
+def test_block1_pkt(pkt_block_server, client_cmd, block_size):
     """Handle block1 request for Packet API based server."""
-    server_addr = 'fd00:bbbb::2'
-    run_block1(server_addr, block_size)
+    run_block1(client_cmd, sut_block_host(), block_size)
+
+@pytest.mark.parametrize('payload_size', [4096, 1024 * 1024])
+def test_block1_pkt_stream(pkt_block_server, client_cmd, payload_size):
+    """Handle a large, pseudo-random block1 payload for Packet API based
+       server."""
+    run_block1(client_cmd, sut_block_host(), 64, '-s {0} -e {1}'.format(payload_size, payload_size),
+               timeout=max(30, payload_size // 1000))
@@ -8,10 +8,21 @@
 """
 Test nanocoap Block2 server response to GET request
 
-Expected result: aiocoap prints response code 2.05 and payload
+By default, aiocoap fetches the blocks one after another. With -w, the client
+fetches the first block with a Size2 request option, to learn the size of the
+resource. Then it requests the remaining blocks concurrently, up to WINDOW at
+a time, so they may complete out of order. Each block is written in place into
+a buffer preallocated for the whole resource. If the server does not provide
+Size2, the client fetches the remaining blocks in sequence. Each block must
+be the one requested, at the server's block size, and full length unless it
+is the last; otherwise the transfer fails, with response code 4.08 if the
+server responded 2.05.
+
+Expected result: aiocoap prints response code 2.05 and payload, followed by
+the time for the transfer
 
 Usage:
-    usage: block2_client.py -r HOST [-b BLOCK_SIZE] [-c FILE]
+    usage: block2_client.py -r HOST [-b BLOCK_SIZE] [-c FILE] [-w WINDOW]
     usage: block2_client.py -h
 
     optional arguments:
@@ -19,6 +30,7 @@ Usage:
       -r HOST        remote host for URI
       -b BLOCK_SIZE  one of 16, 32, 64, ..., 1024
       -c FILE        DTLS credentials file, name format: *.json
+      -w WINDOW      max concurrent block requests
 
 Example:
 
@@ -33,41 +45,131 @@ import logging
 import asyncio
 import json
 import math
+import os
+import time
 from argparse import ArgumentParser
 from aiocoap import *
+from aiocoap import optiontypes
 from conftest import proto_params
 from pathlib import Path
+from readiness import coap_ping, split_host, wait_ready_async
 
-logging.basicConfig(level=logging.INFO)
-
-async def main(host, block_size, credentialsFile=None):
-    # create async context and wait a couple of seconds
+async def main(host, block_size, credentialsFile=None, window=None):
+    # create async context and wait for the server to answer
     context = await Context.create_client_context()
     if proto_params['is_dtls']:
         context.client_credentials.load_from_dict(json.load(credentialsFile.open('rb')))
-    await asyncio.sleep(2)
-
-    uri = '{0}://{1}/riot/ver'.format(proto_params['uri_proto'], host)
+    else:
+        # DTLS server ignores a plain CoAP ping; rely on handshake retries
+        addr, port = split_host(host, proto_params['port'])
+        await wait_ready_async(lambda: coap_ping(addr, port), host)
+
+    uri   = '{0}://{1}/riot/ver'.format(proto_params['uri_proto'], host)
+    start = time.monotonic()
+    try:
+        if window:
+            code, payload, blocks = await fetch_window(context, uri, block_size, window)
+        else:
+            request = Message(code=GET, uri=uri)
+
+            block_exp = round(math.log(block_size, 2)) - 4
+            request.opt.block2 = optiontypes.BlockOption.BlockwiseTuple(0, 0, block_exp)
+
+            response = await context.request(request).response
+            code, payload = response.code, response.payload
+            blocks = math.ceil(len(payload) / block_size)
+    finally:
+        await context.shutdown()
+    elapsed = time.monotonic() - start
+
+    print('Result: %s\n%r'%(code, payload))
+    print('Fetched %d bytes in %d blocks, window %d, in %.3f s'%(len(payload), blocks,
+                                                                window or 1, elapsed))
+
+async def fetch_block(context, uri, num, block_exp, size2=False):
+    """GETs a single block, without aiocoap blockwise handling."""
     request = Message(code=GET, uri=uri)
-
+    request.opt.block2 = optiontypes.BlockOption.BlockwiseTuple(num, 0, block_exp)
+    if size2:
+        request.opt.size2 = 0
+    return await context.request(request, handle_blockwise=False).response
+
+async def fetch_window(context, uri, block_size, window):
+    """
+    Fetches a resource with concurrent block requests, after learning its
+    size from the first block.
+
+    :return: (response code, payload bytes, count of blocks)
+    """
     block_exp = round(math.log(block_size, 2)) - 4
-    request.opt.block2 = optiontypes.BlockOption.BlockwiseTuple(0, 0, block_exp)
-
-    response = await context.request(request).response
-
-    print('Result: %s\n%r'%(response.code, response.payload))
-
-if __name__ == "__main__":
-    # read command line
-    parser = ArgumentParser()
+    first = await fetch_block(context, uri, 0, block_exp, size2=True)
+    block = first.opt.block2
+    if first.code != CONTENT or block is None or not block.more:
+        return first.code, first.payload, 1
+    # server may choose a smaller block size
+    block_size, block_exp = block.size, block.size_exponent
+
+    total = first.opt.size2
+    if total is None:
+        logging.info('No Size2 from server; fetching in sequence')
+        payload, num = bytearray(first.payload), 1
+        while block.more:
+            response = await fetch_block(context, uri, num, block_exp)
+            if response.code != CONTENT:
+                return response.code, bytes(payload), num
+            payload.extend(response.payload)
+            block, num = response.opt.block2, num + 1
+        return first.code, bytes(payload), num
+
+    buf  = bytearray(total)
+    view = memoryview(buf)
+    view[:len(first.payload)] = first.payload
+    count  = math.ceil(total / block_size)
+    slots  = asyncio.Semaphore(window)
+    failed = []
+    filled = len(first.payload)
+
+    async def fetch(num):
+        nonlocal filled
+        async with slots:
+            response = await fetch_block(context, uri, num, block_exp)
+        offset = num * block_size
+        # each block must be the one requested, in full, at the size of the first
+        length = min(block_size, total - offset)
+        block  = response.opt.block2
+        if response.code != CONTENT or block is None or block.block_number != num \
+                or block.size != block_size or block.more != (num < count - 1) \
+                or len(response.payload) != length:
+            failed.append((num, response.code, block, len(response.payload)))
+            return
+        view[offset:offset + length] = response.payload
+        filled += length
+
+    await asyncio.gather(*[fetch(num) for num in range(1, count)])
+    if failed or filled != total:
+        logging.warning('Failed blocks, as (num, code, block2, length): %r'%sorted(failed))
+        logging.warning('Received %d of %d bytes'%(filled, total))
+        # report a response code as failure, even if the server's were 2.05
+        codes = [code for num, code, block, length in sorted(failed) if code != CONTENT]
+        return (codes[0] if codes else REQUEST_ENTITY_INCOMPLETE), bytes(buf), count
+    return first.code, bytes(buf), count
+
+def command(argv=None):
+    """Reads the command line, and provides the main() coroutine for it. Also
+       used by scenario_daemon.py."""
+    parser = ArgumentParser(prog=os.path.basename(__file__))
     parser.add_argument('-r', dest='host', required=True,
                         help='remote host for URI')
     parser.add_argument('-b', dest='block_size', type=int, default=32,
                         help='one of 16, 32, 64, ..., 1024')
     parser.add_argument('-c', dest='credentialsFile', type=Path,
                         help='DTLS credentials file, name format: *.json')
+    parser.add_argument('-w', dest='window', type=int,
+                        help='max concurrent block requests')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    return main(args.host, args.block_size, args.credentialsFile, args.window)
 
-    asyncio.get_event_loop().run_until_complete(main(args.host, args.block_size,
-                                                     args.credentialsFile))
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.get_event_loop().run_until_complete(command())
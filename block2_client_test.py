@@ -12,8 +12,9 @@ import pytest
 import os
 import re
 
-from conftest import ExpectHost
-from conftest import proto_params
+from conftest import ExpectHost, check_shell, riot_iface, riot_term_cmd
+from conftest import block_standin, start_block_standin
+from conftest import net, proto_params, proto_port
 
 pwd = os.getcwd()
 
@@ -32,52 +33,74 @@ def is_confirm(request):
     return request.param
 
 
-@pytest.fixture
-def block_server():
-    """
-    Provides a block server that uses Packet API functions to build the
-    response.
-    """
-    base_folder = os.environ.get('RIOTAPPSBASE', None)
-    board       = os.environ.get('BOARD', 'native')
+def _start_block_server():
+    folder = os.path.join(os.environ.get('RIOTAPPSBASE', None), 'gcoap-block-server')
+    putenv = {'PORT':net.tap_remote}
 
-    term_cmd = 'make term'
+    term_cmd = riot_term_cmd(folder, putenv)
     term_resp = 'gcoap block handler'
         
-    host = ExpectHost(os.path.join(base_folder, 'gcoap-block-server'), term_cmd,
-                      putenv={'PORT':'tap1'})
+    host = ExpectHost(folder, term_cmd, putenv=putenv)
     term = host.connect()
     term.expect(term_resp)
 
     # set ULA
     pid = '5' if proto_params['is_dtls'] else '6'
-    cmd = 'ifconfig {0} add unicast fd00:bbbb::1/64'.format(pid)
+    cmd = 'ifconfig {0} add unicast {1}/64'.format(pid, net.remote_addr)
     host.send_recv(cmd, 'success:')
+    return host
+
+@pytest.fixture
+def block_server(host_pool):
+    """
+    Provides a block server that uses Packet API functions to build the
+    response. Or, if BLOCK_SERVER is 'standin', provides standin_server.py
+    at the same address and port.
+    """
+    if block_standin:
+        host = start_block_standin(net.remote_addr, net.sut_port)
+        yield host
+        host.disconnect(True)
+        return
 
+    host = host_pool.acquire(*block_server_spec)
     yield host
 
     # teardown
-    host.disconnect()
+    host_pool.release(host)
 
+# pool spec for block_server, for use with HostPool.acquire_all()
+block_server_spec = ('block_server', _start_block_server,
+                     lambda h: check_shell(h, net.remote_addr),
+                     riot_iface({'PORT':net.tap_remote}))
+# pool specs to start concurrently with a block client
+block_server_specs = [] if block_standin else [block_server_spec]
 
-@pytest.fixture
-def nano_block_client():
-    """
-    Provides an ExpectHost that runs the nanocoap block client app.
-    """
-    base_folder = os.environ.get('RIOTAPPSBASE', None)
 
-    host = ExpectHost(os.path.join(base_folder, 'nano-block-client'), 'make term')
+def _start_nano_block_client():
+    folder = os.path.join(os.environ.get('RIOTAPPSBASE', None), 'nano-block-client')
+
+    host = ExpectHost(folder, riot_term_cmd(folder))
     term = host.connect()
     term.expect('nanocoap block client app')
 
     # set ULA
-    host.send_recv('ifconfig 5 add unicast fd00:bbbb::2/64','success:')
+    host.send_recv('ifconfig 5 add unicast {0}/64'.format(net.sut_addr), 'success:')
+    return host
 
-    yield host
+@pytest.fixture
+def nano_block_client(host_pool):
+    """
+    Provides an ExpectHost that runs the nanocoap block client app. Also
+    starts block_server concurrently, since the client always uses it.
+    """
+    hosts = host_pool.acquire_all([('nano_block_client', _start_nano_block_client,
+                                    lambda h: check_shell(h, net.sut_addr),
+                                    riot_iface())] + block_server_specs)
+    yield hosts[0]
 
     # teardown
-    host.disconnect()
+    host_pool.release(*hosts)
 
 #
 # tests
@@ -87,11 +110,12 @@ def test_block2_pkt(gcoap_example, block_server, block_size, is_confirm):
     """Handle block2 server response for Packet API based client. Tests
     confirmable and non-confirmable request.
     """
-    cmd_text = 'coap get {0} fd00:bbbb::1 {1} /riot/ver'.format('-c' if is_confirm else '',
-                                                                proto_params['port'])
+    cmd_text = 'coap get {0} {1} {2} /riot/ver'.format('-c' if is_confirm else '',
+                                                       net.remote_addr,
+                                                       proto_port(net.sut_port))
     gcoap_example.send_recv(cmd_text, r'This is RIOT \(Ve.*blockwise complete')
 
 def test_block2_buf(nano_block_client, block_server, block_size):
     """Handle block2 server response for Packet API based client."""
-    nano_block_client.send_recv('get fd00:bbbb::1 5683',
+    nano_block_client.send_recv('get {0} {1}'.format(net.remote_addr, net.sut_port),
                                 r'This is RIOT \(Ve.*native MCU.')
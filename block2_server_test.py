@@ -9,11 +9,11 @@ Tests GETting a large payload from nanocoap via block2.
 """
 
 import pytest
+import logging
 import os
 import re
 
-from conftest import ExpectHost
-from conftest import proto_params
+from conftest import ExpectHost, proto_params, sut_block_host
 
 pwd = os.getcwd()
 
@@ -26,56 +26,59 @@ def block_size(request):
     """Provides the size of the block to test."""
     return request.param
 
-
-@pytest.fixture
-def pkt_block_server():
-    """
-    Provides a block server that uses Packet API functions to build the
-    response.
-    """
-    base_folder = os.environ.get('RIOTAPPSBASE', None)
-    board       = os.environ.get('BOARD', 'native')
-
-    term_cmd = 'make term'
-    term_resp = 'gcoap block handler'
-        
-    host = ExpectHost(os.path.join(base_folder, 'gcoap-block-server'), term_cmd)
-    term = host.connect()
-    term.expect(term_resp)
-
-    # set ULA
-    pid = '5' if proto_params['is_dtls'] else '6'
-    cmd = 'ifconfig {0} add unicast fd00:bbbb::2/64'.format(pid)
-    host.send_recv(cmd, 'success:')
-
-    yield host
-
-    # teardown
-    host.disconnect()
-
 #
 # tests
 #
 
-def run_block2(address, block_size):
-    """Runs block2 test"""
+def run_block2(client_cmd, host, block_size, window=None):
+    """Runs block2 test
+
+    :param client_cmd: client_cmd fixture
+    :param string host: Host for URI, like [fd00:bbbb::2]
+    :param int window: Max concurrent block requests; if None, aiocoap
+                       fetches blocks in sequence
+    :return: bytes output from client
+    """
     response = b'This is RIOT \\(Version'
 
-    cmdText = './block2_client.py -r [{0}] -b {1} {2}'
-    cmd = cmdText.format(address, block_size,
-                         '-c dtls-credentials.json' if proto_params['is_dtls'] else '')
-    host = ExpectHost(pwd, cmd)
+    argText = '-r {0} -b {1} {2} {3}'
+    args = argText.format(host, block_size,
+                          '-w {0}'.format(window) if window else '',
+                          '-c dtls-credentials.json' if proto_params['is_dtls'] else '')
+    host = ExpectHost(pwd, client_cmd('block2_client.py', args))
 
     output = host.run()
     assert re.search(b'2.05 Content', output)
     assert re.search(response, output)
-
-def test_block2_buf(nanocoap_server, block_size):
+    return output
+
+def compare_window(client_cmd, host, block_size):
+    """Fetches with concurrent block requests, and compares with the sequential
+       baseline. Logs the time for each."""
+    pattern  = rb"Result: .*\n([^\r\n]*)\r?\n(Fetched [^\r\n]*)"
+    baseline = re.search(pattern, run_block2(client_cmd, host, block_size))
+    for window in (1, 4):
+        result = re.search(pattern, run_block2(client_cmd, host, block_size, window))
+        assert result.group(1) == baseline.group(1)
+        logging.info('{0}; baseline {1}'.format(result.group(2).decode(),
+                                                baseline.group(2).decode()))
+
+def test_block2_buf(nanocoap_server, client_cmd, block_size):
     """Handle block2 request for Buffer API based server."""
     address = os.environ.get('TAP_LLADDR_SUT', None)
-    run_block2(address, block_size)
+    run_block2(client_cmd, '[{0}]'.format(address), block_size)
 
-def test_block2_pkt(pkt_block_server, block_size):
+def test_block2_pkt(pkt_block_server, client_cmd, block_size):
     """Handle block2 request for Packet API based server."""
-    server_addr = 'fd00:bbbb::2'
-    run_block2(server_addr, block_size)
+    run_block2(client_cmd, sut_block_host(), block_size)
+
+def test_block2_buf_window(nanocoap_server, client_cmd, block_size):
+    """Handle concurrent, out of order block2 requests for Buffer API based
+       server."""
+    compare_window(client_cmd, '[{0}]'.format(os.environ.get('TAP_LLADDR_SUT', None)),
+                   block_size)
+
+def test_block2_pkt_window(pkt_block_server, client_cmd, block_size):
+    """Handle concurrent, out of order block2 requests for Packet API based
+       server."""
+    compare_window(client_cmd, sut_block_host(), block_size)
@@ -0,0 +1,90 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests fetch_window() in block2_client.py, which fetches Block2 blocks
+concurrently, with a stand-in for the aiocoap client context. Does not require
+RIOT.
+"""
+
+import asyncio
+import pytest
+import types
+
+from aiocoap import CONTENT, NOT_FOUND, REQUEST_ENTITY_INCOMPLETE, Message
+from aiocoap.optiontypes import BlockOption
+from block2_client import fetch_window
+
+#
+# fixtures and utility functions
+#
+
+class WindowContext():
+    """
+    Stands in for an aiocoap client context, for fetch_window(). Responds to
+    each Block2 request from a body, with at most 32 byte blocks.
+
+    :param alter: Function to change a response, with args (block number,
+                  response Message)
+    """
+
+    def __init__(self, body, alter=lambda num, response: None):
+        self.body  = body
+        self.alter = alter
+
+    def request(self, request, handle_blockwise=True):
+        block = request.opt.block2
+        exp   = min(block.size_exponent, 1)
+        start = block.block_number * 2 ** (exp + 4)
+        end   = start + 2 ** (exp + 4)
+        response = Message(code=CONTENT, payload=self.body[start:end])
+        response.opt.block2 = BlockOption.BlockwiseTuple(block.block_number,
+                                                         end < len(self.body), exp)
+        if request.opt.size2 is not None:
+            response.opt.size2 = len(self.body)
+        self.alter(block.block_number, response)
+
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(response)
+        return types.SimpleNamespace(response=future)
+
+def window_fetch(alter=lambda num, response: None):
+    """Runs fetch_window() for a 200 byte body with 64 byte blocks, which the
+       context reduces to 32 bytes.
+
+    :return: (response code, payload bytes, count of blocks)
+    """
+    context = WindowContext(bytes(range(200)), alter)
+    return asyncio.run(fetch_window(context, 'coap://[::1]/riot/ver', 64, 4))
+
+#
+# tests
+#
+
+def test_window():
+    """Fetches all blocks concurrently, at the server's block size."""
+    assert window_fetch() == (CONTENT, bytes(range(200)), 7)
+
+@pytest.mark.parametrize('alter', [
+    lambda num, response: setattr(response, 'payload', response.payload[:-1]),
+    lambda num, response: setattr(response.opt, 'block2', None),
+    lambda num, response: setattr(response.opt, 'block2', BlockOption.BlockwiseTuple(
+                                      num + 1, True, 1)),
+    lambda num, response: setattr(response.opt, 'block2', BlockOption.BlockwiseTuple(
+                                      num * 2, True, 0))],
+    ids=['short', 'no_block2', 'wrong_num', 'resized'])
+def test_window_bad_block(alter):
+    """Reports failure for a block that is not the one requested, in full, at
+       the negotiated size."""
+    code, payload, count = window_fetch(lambda num, response: num == 3
+                                        and alter(num, response))
+    assert code == REQUEST_ENTITY_INCOMPLETE
+
+def test_window_error():
+    """Reports the response code for a failed block."""
+    code, payload, count = window_fetch(lambda num, response: num == 5
+                                        and setattr(response, 'code', NOT_FOUND))
+    assert code == NOT_FOUND
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Benchmarks blockwise transfer throughput for a RIOT CoAP server. Sweeps block
+sizes against payload sizes, for Block1 POST of a payload to /sha256, and
+Block2 GET of a resource like /riot/ver, each with CON and NON requests.
+
+A RIOT server's Block2 resource has a fixed body, so by default Block2 sweeps
+block sizes only. With '-v', Block2 also sweeps body sizes, requested with a
+'size=N' query, like standin_server.py serves from /riot/ver.
+
+Uses its own minimal client over a plain UDP socket, built on coap_msg.py, so
+it can count every message and retransmission. So it does not support DTLS.
+A NON request is sent again if no response arrives within the timeout, and
+counted as a retransmission.
+
+Prints a table with a row per transfer:
+
+dir      block1 or block2
+type     CON or NON
+block    block size in bytes
+payload  transferred payload bytes; for block2, the body size
+time     seconds for the transfer
+goodput  payload bytes per second
+msgs     messages sent and received, including ACKs
+retx     retransmissions
+ok       for block1, whether the response matches the payload SHA256 digest;
+         for block2 with '-v', whether the body has the requested size
+
+Usage:
+    usage: block_bench.py -r HOST [-b SIZES] [-s SIZES] [-v SIZES] [-t TYPES]
+                          [-1 PATH] [-2 PATH] [-w TIMEOUT] [-j FILE]
+    usage: block_bench.py -h
+
+    optional arguments:
+      -h, --help  show this help message and exit
+      -r HOST     remote host, like [fd00:bbbb::2] or [fd00:bbbb::2]:5683
+      -b SIZES    comma separated block sizes; 16,32,...,1024 by default
+      -s SIZES    comma separated block1 payload sizes, with optional k or M
+                  suffix; 64,1k,16k by default
+      -v SIZES    comma separated block2 body sizes, with optional k or M
+                  suffix, requested with a size query; the resource's fixed
+                  body by default
+      -t TYPES    comma separated message types; CON,NON by default
+      -1 PATH     block1 resource path, or '' to skip; /sha256 by default
+      -2 PATH     block2 resource path, or '' to skip; /riot/ver by default
+      -w TIMEOUT  seconds to wait for a NON response; 2 by default
+      -j FILE     write a JSON Lines record for each transfer; see
+                  coap_results.py
+
+Example:
+
+$ ./block_bench.py -r [fd00:bbbb::2] -b 16,1024 -s 1k -t CON
+dir    type  block   payload    time  goodput B/s  msgs  retx  ok
+block1 CON      16      1024   0.271       3778.6   128     0  yes
+block1 CON    1024      1024   0.004     256000.0     2     0  yes
+block2 CON      16        98   0.031       3161.3    14     0
+block2 CON    1024        98   0.002      49000.0     2     0
+
+$ ./block_bench.py -r [::1]:5799 -b 1024 -s 1k -v 1k,1M -t CON
+dir    type  block   payload    time  goodput B/s  msgs  retx  ok
+block1 CON    1024      1024   0.002     596767.2     2     0  yes
+block2 CON    1024      1024   0.001     922717.0     2     0  yes
+block2 CON    1024   1048576   0.823    1274290.3  2048     0  yes
+"""
+
+import hashlib
+import os
+import random
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+from collections import namedtuple
+
+import coap_msg
+from coap_results import ResultWriter
+from conftest import proto_params, scaled
+from readiness import split_host
+
+class Transfer(namedtuple('Transfer', ['direction', 'mtype', 'block_size',
+                                       'payload_size', 'elapsed', 'messages',
+                                       'retransmissions', 'response'])):
+    """Result of a blockwise transfer. 'response' is the final Message."""
+    __slots__ = ()
+
+    def goodput(self):
+        """Payload bytes per second."""
+        return self.payload_size / self.elapsed if self.elapsed else 0
+
+
+class BlockClient():
+    """
+    Blockwise CoAP client over a plain UDP socket, with RFC 7252 CON
+    retransmission. Counts the messages it sends and receives.
+
+    :param bool confirmable: True to send CON requests, False for NON
+    :param float non_timeout: Seconds to wait for a response to a NON request,
+                              or for a separate response after an empty ACK
+    """
+    ACK_TIMEOUT       = scaled(2.0)
+    ACK_RANDOM_FACTOR = 1.5
+    MAX_RETRANSMIT    = 4
+
+    def __init__(self, addr, port=5683, confirmable=True, non_timeout=2.0):
+        info = socket.getaddrinfo(addr, port, type=socket.SOCK_DGRAM)[0]
+        self._sock   = socket.socket(info[0], socket.SOCK_DGRAM)
+        self._remote = info[4]
+        self._mid    = random.getrandbits(16)
+        self.confirmable = confirmable
+        self.non_timeout = non_timeout
+        self.sent = self.received = self.retransmissions = 0
+
+    def close(self):
+        self._sock.close()
+
+    def exchange(self, code, options, payload=b''):
+        """
+        Sends a request and waits for its response, retransmitting on timeout.
+
+        :return: response Message
+        :raises TimeoutError: if no response after all retransmissions
+        :raises ConnectionError: if the server resets the request
+        """
+        self._mid = (self._mid + 1) & 0xFFFF
+        mid, token = self._mid, os.urandom(4)
+        mtype = coap_msg.CON if self.confirmable else coap_msg.NON
+        msg   = coap_msg.encode(mtype, code, mid, token, options, payload)
+
+        if self.confirmable:
+            timeout = self.ACK_TIMEOUT * random.uniform(1, self.ACK_RANDOM_FACTOR)
+        else:
+            timeout = self.non_timeout
+        acked = False
+        for attempt in range(self.MAX_RETRANSMIT + 1):
+            if attempt:
+                if acked:
+                    break
+                self.retransmissions += 1
+            self._sock.sendto(msg, self._remote)
+            self.sent += 1
+
+            reply = self._receive(mid, token, timeout)
+            if reply is None:
+                if self.confirmable:
+                    timeout *= 2
+                continue
+            if reply.code == coap_msg.EMPTY:
+                # empty ACK; wait for a separate response
+                acked = True
+                reply = self._receive(mid, token, self.non_timeout)
+                if reply is None or reply.code == coap_msg.EMPTY:
+                    break
+            return reply
+        raise TimeoutError('No response for MID {0}'.format(mid))
+
+    def block1(self, path, payload, block_size):
+        """POSTs the payload to the path with Block1.
+
+        :return: Transfer
+        """
+        start  = self._start()
+        opts   = coap_msg.path_options(path)
+        offset = 0
+        while True:
+            num   = offset // block_size
+            more  = offset + block_size < len(payload)
+            reply = self.exchange(coap_msg.POST,
+                                  opts + [(coap_msg.BLOCK1,
+                                           coap_msg.encode_block(num, more, block_size))],
+                                  payload[offset:offset+block_size])
+            if not more:
+                break
+            if reply.code != coap_msg.CONTINUE:
+                raise ValueError('Block1 {0} failed: {1}'.format(
+                                 num, coap_msg.code_text(reply.code)))
+            offset += block_size
+            # server may ask for a smaller block size
+            value = coap_msg.get_option(reply, coap_msg.BLOCK1)
+            if value is not None:
+                block_size = min(block_size, coap_msg.decode_block(value)[2])
+        return self._finish('block1', start, block_size, len(payload), reply)
+
+    def block2(self, path, block_size, size=None):
+        """GETs the path with Block2.
+
+        :param int size: body size to request with a 'size=N' query, if any
+        :return: Transfer; the response payload is the complete body
+        """
+        start = self._start()
+        if size is not None:
+            path = '{0}?size={1}'.format(path, size)
+        opts  = coap_msg.path_options(path)
+        body  = bytearray()
+        while True:
+            num   = len(body) // block_size
+            reply = self.exchange(coap_msg.GET,
+                                  opts + [(coap_msg.BLOCK2,
+                                           coap_msg.encode_block(num, False, block_size))])
+            if reply.code != coap_msg.CONTENT:
+                raise ValueError('Block2 {0} failed: {1}'.format(
+                                 num, coap_msg.code_text(reply.code)))
+            body.extend(reply.payload)
+            value = coap_msg.get_option(reply, coap_msg.BLOCK2)
+            if value is None:
+                break
+            _, more, size = coap_msg.decode_block(value)
+            if not more:
+                break
+            block_size = min(block_size, size)
+        return self._finish('block2', start, block_size, len(body),
+                            reply._replace(payload=bytes(body)))
+
+    def _start(self):
+        self.sent = self.received = self.retransmissions = 0
+        return time.monotonic()
+
+    def _finish(self, direction, start, block_size, payload_size, reply):
+        return Transfer(direction, 'CON' if self.confirmable else 'NON', block_size,
+                        payload_size, time.monotonic() - start,
+                        self.sent + self.received, self.retransmissions, reply)
+
+    def _receive(self, mid, token, timeout):
+        """Receives the reply to a request, ACKing a CON response.
+
+        :return: Message, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._sock.settimeout(remaining)
+            try:
+                reply = coap_msg.decode(self._sock.recv(2048))
+            except socket.timeout:
+                return None
+            except ValueError:
+                continue
+            self.received += 1
+
+            if reply.mtype == coap_msg.RST and reply.mid == mid:
+                raise ConnectionError('Reset by server')
+            if reply.mtype == coap_msg.ACK and reply.mid == mid:
+                if reply.code == coap_msg.EMPTY or reply.token == token:
+                    return reply
+            elif reply.token == token:
+                if reply.mtype == coap_msg.CON:
+                    self._sock.sendto(coap_msg.encode(coap_msg.ACK, coap_msg.EMPTY,
+                                                      reply.mid), self._remote)
+                    self.sent += 1
+                return reply
+
+
+def make_payload(size):
+    """Provides a deterministic payload of the given size."""
+    return (bytes(range(256)) * (size // 256 + 1))[:size]
+
+def parse_size(text):
+    """Parses a size like '64', '16k' or '2M' to bytes."""
+    scale = {'k': 1024, 'M': 1024 * 1024}.get(text[-1:], 1)
+    return int(text[:-1] if scale > 1 else text) * scale
+
+def format_row(transfer, ok=''):
+    return '{0:6} {1:4} {2:6} {3:9} {4:7.3f} {5:12.1f} {6:5} {7:5}  {8}'.format(
+           transfer.direction, transfer.mtype, transfer.block_size,
+           transfer.payload_size, transfer.elapsed, transfer.goodput(),
+           transfer.messages, transfer.retransmissions, ok)
+
+def main(host, block_sizes, payload_sizes, mtypes=('CON', 'NON'), block1_path='/sha256',
+         block2_path='/riot/ver', timeout=2.0, resultsFile=None, body_sizes=None):
+    """
+    Runs the sweep, and prints the table.
+
+    :param body_sizes: block2 body sizes to request, or None for the resource's
+                       fixed body
+    :return: list of (Transfer, ok) tuples; ok is None for block2 without
+             body_sizes
+    """
+    addr, port = split_host(host)
+    results = ResultWriter(resultsFile)
+    rows    = []
+    print('dir    type  block   payload    time  goodput B/s  msgs  retx  ok', flush=True)
+    for mtype in mtypes:
+        client = BlockClient(addr, port, mtype == 'CON', timeout)
+        try:
+            runs = []
+            if block1_path:
+                runs.extend(('block1', b, s) for s in payload_sizes for b in block_sizes)
+            if block2_path:
+                runs.extend(('block2', b, s) for s in (body_sizes or [None])
+                                             for b in block_sizes)
+            for direction, block_size, size in runs:
+                if direction == 'block1':
+                    payload  = make_payload(size)
+                    transfer = client.block1(block1_path, payload, block_size)
+                    digest   = hashlib.sha256(payload).hexdigest().upper()
+                    ok = transfer.response.payload.decode(errors='replace').upper() == digest
+                else:
+                    transfer = client.block2(block2_path, block_size, size)
+                    ok = None if size is None else transfer.payload_size == size
+                rows.append((transfer, ok))
+                print(format_row(transfer, '' if ok is None else ('yes' if ok else 'NO')),
+                      flush=True)
+                results.write(ok=ok, goodput=transfer.goodput(),
+                              **transfer._replace(response=None)._asdict())
+        finally:
+            client.close()
+    results.close()
+    return rows
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-r', dest='host', required=True,
+                        help='remote host, like [fd00:bbbb::2]')
+    parser.add_argument('-b', dest='block_sizes', default='16,32,64,128,256,512,1024',
+                        help='comma separated block sizes')
+    parser.add_argument('-s', dest='payload_sizes', default='64,1k,16k',
+                        help='comma separated block1 payload sizes, like 64,1k,2M')
+    parser.add_argument('-v', dest='body_sizes',
+                        help='comma separated block2 body sizes, requested with a '
+                             'size query, like 64,1k,2M')
+    parser.add_argument('-t', dest='mtypes', default='CON,NON',
+                        help='comma separated message types')
+    parser.add_argument('-1', dest='block1_path', default='/sha256',
+                        help="block1 resource path, or '' to skip")
+    parser.add_argument('-2', dest='block2_path', default='/riot/ver',
+                        help="block2 resource path, or '' to skip")
+    parser.add_argument('-w', dest='timeout', type=float, default=2.0,
+                        help='seconds to wait for a NON response')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='JSON Lines file for a record of each transfer')
+
+    args = parser.parse_args()
+    if proto_params['is_dtls']:
+        sys.exit('block_bench.py supports plain UDP only')
+
+    rows = main(args.host, [int(b) for b in args.block_sizes.split(',')],
+                [parse_size(s) for s in args.payload_sizes.split(',')],
+                args.mtypes.split(','), args.block1_path, args.block2_path,
+                args.timeout, args.resultsFile,
+                args.body_sizes and [parse_size(s) for s in args.body_sizes.split(',')])
+    sys.exit(0 if all(ok is not False for _, ok in rows) else 1)
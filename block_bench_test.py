@@ -0,0 +1,109 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests blockwise transfers with block_bench.py. The client tests use the Python
+stand-in server, so do not require RIOT. The sweep benchmarks gcoap.
+"""
+
+import hashlib
+import os
+import pytest
+
+import coap_msg
+from block_bench import BlockClient, make_payload
+from conftest import proto_params, run_bench_script, standin_addr, sut_block_host
+from conftest import udp_responder
+
+#
+# fixtures and utility functions
+#
+
+# 64 byte max blocks, and a 300 byte /riot/ver body
+small_blocks = pytest.mark.parametrize('standin_server', ['-m 64 -v 300'], indirect=True)
+
+@pytest.fixture
+def lossy_responder():
+    """Runs a UDP endpoint on ::1 that ignores the first request, and then
+       responds 2.04 Changed to each request, with its Block1 option.
+
+    :return: port for the endpoint
+    """
+    state = {'ignore': 1}
+
+    def respond(sock, data, remote):
+        if state['ignore']:
+            state['ignore'] -= 1
+            return
+        msg   = coap_msg.decode(data)
+        mtype = coap_msg.ACK if msg.mtype == coap_msg.CON else coap_msg.NON
+        block = (coap_msg.BLOCK1, coap_msg.get_option(msg, coap_msg.BLOCK1))
+        sock.sendto(coap_msg.encode(mtype, coap_msg.CHANGED, msg.mid, msg.token, [block]),
+                    remote)
+
+    with udp_responder(respond) as port:
+        yield port
+
+#
+# tests
+#
+
+@small_blocks
+@pytest.mark.parametrize('confirmable', [True, False])
+def test_block1(standin_server, confirmable):
+    """Block1 POST with server negotiated block size."""
+    client   = BlockClient(*standin_addr(), confirmable=confirmable)
+    payload  = make_payload(1000)
+    transfer = client.block1('/sha256', payload, 256)
+    client.close()
+
+    assert transfer.response.payload.decode() == hashlib.sha256(payload).hexdigest().upper()
+    assert transfer.retransmissions == 0
+    assert transfer.block_size == 64
+    # first 256 byte block, then 12 blocks of 64
+    assert transfer.messages == 2 * (1 + 12)
+
+@pytest.mark.parametrize('confirmable', [True, False])
+def test_retransmission(lossy_responder, confirmable):
+    """Request resent when the first is lost, for CON and NON."""
+    client   = BlockClient('::1', lossy_responder, confirmable, non_timeout=0.2)
+    client.ACK_TIMEOUT = 0.1
+    transfer = client.block1('/sha256', make_payload(20), 64)
+    client.close()
+
+    assert transfer.response.code == coap_msg.CHANGED
+    assert transfer.retransmissions == 1
+    assert transfer.messages == 3
+
+@small_blocks
+def test_block2(standin_server):
+    client   = BlockClient(*standin_addr())
+    transfer = client.block2('/riot/ver', 1024)
+    client.close()
+    assert transfer.response.payload.startswith(b'This is RIOT (Version: standin)')
+    assert transfer.payload_size == 300
+    assert transfer.block_size == 64
+
+@small_blocks
+@pytest.mark.parametrize('size', [10, 1000, 70000])
+def test_block2_size(standin_server, size):
+    """Block2 GET of a body size requested with a query, to sweep body sizes."""
+    client   = BlockClient(*standin_addr())
+    transfer = client.block2('/riot/ver', 64, size)
+    client.close()
+    assert transfer.payload_size == size
+    assert transfer.response.payload.startswith(b'This is RIOT (Version: standin)'[:size])
+    assert transfer.messages == 2 * max(1, -(-size // 64))
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(proto_params['is_dtls'], reason='block_bench.py requires UDP')
+def test_sweep(pkt_block_server, tmp_path):
+    """Sweeps block and payload sizes for gcoap-block-server."""
+    sizes   = os.environ.get('BLOCK_BENCH_SIZES', '64,1k,16k')
+    records = run_bench_script(tmp_path, './block_bench.py -r {0} -s {1}'.format(
+                                         sut_block_host(), sizes), 1800)
+    assert records
+    assert all(r['ok'] is not False for r in records)
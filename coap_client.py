@@ -0,0 +1,167 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Persistent in-process CoAP client for tests, so a test may send many requests
+without starting a client process for each one. Runs an aiocoap client
+context on an event loop in a background thread, and keeps it open until
+closed. So a DTLS session with a server is reused across requests.
+
+Requests are synchronous calls from the test thread, and return a parsed
+Response. A request that receives no response raises the aiocoap error, or
+TimeoutError.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+from collections import namedtuple
+
+from aiocoap import *
+
+import coap_msg
+from conftest import proto_params
+
+Response = namedtuple('Response', ['code', 'payload', 'mtype', 'observe'])
+Response.__doc__ = """Parsed response. 'code' is text like '2.05', 'mtype' is
+                      like 'ACK', and 'observe' is the Observe value or None."""
+
+
+def parse_response(msg):
+    return Response(coap_msg.code_text(int(msg.code)), msg.payload, msg.mtype.name,
+                    msg.opt.observe)
+
+
+class CoapClient():
+    """
+    aiocoap client context on a background event loop.
+
+    :param dtls_hosts: Hosts to provide DTLS credentials for, like
+                       '[fd00:bbbb::2]'; credentials from proto_params
+    :param bool reuse: False to use a new context for each request, so each
+                       request over DTLS needs a new session
+    """
+
+    def __init__(self, dtls_hosts=(), reuse=True):
+        self.reuse   = reuse
+        self._hosts  = list(dtls_hosts)
+        self._loop   = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._context = self._call(self._new_context()) if reuse else None
+
+    def close(self):
+        if self._context:
+            self._call(self._context.shutdown())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop.close()
+
+    def uri(self, host, path):
+        """Provides a URI for the transport protocol. Encodes the zone of a link
+           local host, like '[fe80::2%tap0]'."""
+        return '{0}://{1}{2}'.format(proto_params['uri_proto'],
+                                     host.replace('%', '%25'), path)
+
+    def request(self, code, uri, payload=b'', mtype=CON, timeout=10):
+        """
+        Sends a request, and waits for the response.
+
+        :param code: aiocoap request code, like GET
+        :param string uri: URI, like from uri()
+        :return: Response
+        """
+        return self._call(self._request(code, uri, payload, mtype), timeout)
+
+    def get(self, uri, **kwargs):
+        return self.request(GET, uri, **kwargs)
+
+    def post(self, uri, payload, **kwargs):
+        return self.request(POST, uri, payload, **kwargs)
+
+    def get_many(self, uris, **kwargs):
+        return self.request_many(GET, uris, **kwargs)
+
+    def request_many(self, code, uris, concurrency=4, mtype=CON, timeout=60):
+        """
+        Sends a request for each URI, with up to concurrency outstanding.
+
+        :return: list of Response, or of the exception for a failed request,
+                 in URI order
+        """
+        async def send_all():
+            window = asyncio.Semaphore(concurrency)
+
+            async def send(uri):
+                async with window:
+                    return await self._request(code, uri, b'', mtype)
+
+            return await asyncio.gather(*[send(uri) for uri in uris],
+                                        return_exceptions=True)
+
+        return self._call(send_all(), timeout)
+
+    def observe(self, uri, count=1, timeout=10):
+        """
+        Registers to observe the URI, and collects the first response and the
+        following notifications, until count notifications or the timeout.
+        Then cancels the observation.
+
+        :return: list of Response; the first is the registration response
+        """
+        async def collect():
+            context = self._context or await self._new_context()
+            req = context.request(Message(code=GET, uri=uri, observe=0))
+            responses = [parse_response(await req.response)]
+
+            async def consume():
+                async for resp in req.observation:
+                    responses.append(parse_response(resp))
+                    if len(responses) > count:
+                        break
+            try:
+                await asyncio.wait_for(consume(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                req.observation.cancel()
+            # cancel the registration at the server
+            cancel = context.request(Message(code=GET, uri=uri, observe=1))
+            await cancel.response
+            if not self._context:
+                await context.shutdown()
+            return responses
+
+        # allow time for registration and cancellation
+        return self._call(collect(), timeout + 20)
+
+    async def _new_context(self):
+        context = await Context.create_client_context()
+        if proto_params['is_dtls']:
+            for host in self._hosts:
+                context.client_credentials.load_from_dict({
+                    'coaps://{0}/*'.format(host): {'dtls': {
+                        'psk': {'ascii': proto_params['psk_key']},
+                        'client-identity': {'ascii': proto_params['psk_id']}}}})
+        return context
+
+    async def _request(self, code, uri, payload, mtype):
+        context = self._context or await self._new_context()
+        try:
+            msg = Message(code=code, mtype=mtype, uri=uri, payload=payload)
+            return parse_response(await context.request(msg).response)
+        finally:
+            if not self._context:
+                await context.shutdown()
+
+    def _call(self, coro, timeout=None):
+        """Runs a coroutine on the event loop, and waits for its result."""
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
@@ -0,0 +1,131 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests the persistent in-process client in coap_client.py, with
+standin_server.py. Does not require RIOT. Over DTLS, also verifies that the
+client reuses its DTLS session, which requires aiocoap's tinydtls support,
+from the DTLSSocket package.
+"""
+
+import concurrent.futures
+import os
+import pexpect
+import pytest
+import signal
+import socket
+import time
+
+from aiocoap import NON
+from coap_client import CoapClient
+from coap_results import ResultReader
+from conftest import ExpectHost, proto_params, proto_port, standin_addr
+
+#
+# fixtures and utility functions
+#
+
+@pytest.fixture(params=[True, False], ids=['reuse', 'new_context'])
+def client(request, standin_server):
+    """Provides a CoapClient for the stand-in server, which reuses its context,
+       or not."""
+    client = CoapClient([standin_host()], reuse=request.param)
+    yield client
+
+    # teardown
+    client.close()
+
+def standin_host(port=None):
+    """Provides the URI host for the stand-in server, or for a port on its
+       address."""
+    addr, udp_port = standin_addr()
+    return '[{0}]:{1}'.format(addr, port or proto_port(udp_port))
+
+def free_port():
+    """Provides a UDP port on ::1 that is not bound."""
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        sock.bind(('::1', 0))
+        return sock.getsockname()[1]
+
+def count_client_packets(tmp_path, reuse, count):
+    """Sends count GET requests through impair_proxy.py to the stand-in
+       server.
+
+    :return: count of packets from the client
+    """
+    port    = free_port()
+    results = ResultReader(str(tmp_path / 'proxy-{0}.jsonl'.format(reuse)))
+    proxy   = ExpectHost(os.path.dirname(os.path.abspath(__file__)),
+                         './impair_proxy.py -l [::1]:{0} -u {1} -j {2}'.format(
+                         port, standin_host(), results.path))
+    term = proxy.connect()
+    term.expect('Proxy ready')
+
+    client = CoapClient([standin_host(port)], reuse=reuse)
+    try:
+        for i in range(count):
+            response = client.get(client.uri(standin_host(port), '/cli/stats'))
+            assert response.code == '2.05'
+    finally:
+        client.close()
+        term.kill(signal.SIGTERM)
+        term.expect(pexpect.EOF, 5)
+    return sum(r['dir'] == 'up' for r in results.read())
+
+#
+# tests
+#
+
+def test_get(client):
+    response = client.get(client.uri(standin_host(), '/riot/ver'))
+    assert response.code == '2.05'
+    assert response.payload.startswith(b'This is RIOT (Version: standin)')
+    assert response.mtype == 'ACK'
+
+    response = client.get(client.uri(standin_host(), '/riot/ver'), mtype=NON)
+    assert response.code == '2.05'
+    assert response.mtype == 'NON'
+
+def test_get_many(client):
+    """Requests with several outstanding; each response is in URI order,
+       including an error response."""
+    paths = ['/riot/ver', '/cli/stats', '/none'] * 3
+    responses = client.get_many([client.uri(standin_host(), p) for p in paths],
+                                concurrency=3)
+    assert [r.code for r in responses] == ['2.05', '2.05', '4.04'] * 3
+    assert all(r.payload.startswith(b'This is RIOT') for r in responses[::3])
+
+def test_observe(client):
+    """Registers, and receives a notification for each GET of /cli/stats
+       that follows."""
+    uri = client.uri(standin_host(), '/cli/stats')
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        future = pool.submit(client.observe, uri, 3, 10)
+        # update until the observer has its notifications; updates before
+        # the registration do not notify
+        deadline = time.monotonic() + 10
+        while not future.done() and time.monotonic() < deadline:
+            client.get(uri)
+            time.sleep(0.2)
+        responses = future.result()
+
+    assert len(responses) == 4
+    assert all(r.code == '2.05' for r in responses)
+    assert all(r.observe is not None for r in responses)
+    counts = [int(r.payload) for r in responses]
+    assert counts == sorted(set(counts))
+
+@pytest.mark.skipif(not proto_params['is_dtls'], reason='requires DTLS')
+def test_dtls_reuse(standin_server, tmp_path):
+    """A client that reuses its context sets up one DTLS session for all of
+       its requests, rather than one for each request."""
+    pytest.importorskip('DTLSSocket')
+    count    = 4
+    setup    = proto_params['session_setup_msgs']
+    reused   = count_client_packets(tmp_path, True, count)
+    sessions = count_client_packets(tmp_path, False, count)
+
+    assert reused + (count - 1) * setup <= sessions
@@ -0,0 +1,131 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Minimal asyncio CoAP client endpoint over a plain UDP socket, built on
+coap_msg.py. Sends CON requests with RFC 7252 retransmission, for tools that
+must count or pace every request, like the benchmarks. So it does not support
+DTLS.
+"""
+
+import asyncio
+import os
+import random
+import time
+
+import coap_msg
+from conftest import scaled
+
+class CoapEndpoint(asyncio.DatagramProtocol):
+    """
+    Local socket for CON requests to one remote endpoint, like from
+    create_datagram_endpoint() with a remote_addr. Matches a response by
+    token, including a separate response after an empty ACK, which stops
+    retransmission. ACKs a CON response.
+
+    A message that does not match an outstanding request goes to unmatched().
+    If not handled there, a CON or NON message is reset, so a server removes
+    a stale Observe registration.
+    """
+    ACK_TIMEOUT       = scaled(2.0)
+    ACK_RANDOM_FACTOR = 1.5
+    MAX_RETRANSMIT    = 4
+
+    def __init__(self):
+        self.transport = None
+        self._mid      = random.getrandbits(16)
+        # token -> [future for the response, acknowledged]
+        self._pending  = {}
+        self._by_mid   = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            msg = coap_msg.decode(data)
+        except ValueError:
+            return
+
+        if msg.code == coap_msg.EMPTY:
+            pending = self._by_mid.get(msg.mid)
+            if msg.mtype == coap_msg.ACK and pending:
+                pending[1] = True
+            elif msg.mtype == coap_msg.RST and pending:
+                if not pending[0].done():
+                    pending[0].set_result(None)
+            elif msg.mtype == coap_msg.CON:
+                # CoAP ping
+                self._send_empty(coap_msg.RST, msg.mid)
+            return
+
+        pending = self._pending.get(msg.token)
+        if msg.mtype == coap_msg.ACK:
+            # piggybacked response
+            if pending and self._by_mid.get(msg.mid) is pending and not pending[0].done():
+                pending[0].set_result(msg)
+            return
+
+        if pending:
+            handled = True
+            if not pending[0].done():
+                pending[0].set_result(msg)
+        else:
+            handled = self.unmatched(msg)
+        if not handled:
+            self._send_empty(coap_msg.RST, msg.mid)
+        elif msg.mtype == coap_msg.CON:
+            self._send_empty(coap_msg.ACK, msg.mid)
+
+    def unmatched(self, msg):
+        """
+        Handles a CON or NON message that does not respond to an outstanding
+        request, like an Observe notification. Override in a subclass.
+
+        :return: True if handled, to ACK a CON message; False to reset it
+        """
+        return False
+
+    async def request(self, code, options, payload=b'', timeout=5.0, token=None):
+        """
+        Sends a CON request, and waits for the response, retransmitting with
+        exponential backoff until acknowledged.
+
+        :param bytes token: Token for the request; random if None
+        :return: response Message, or None if reset, or no response within
+                 timeout
+        """
+        self._mid = (self._mid + 1) & 0xFFFF
+        mid, token = self._mid, token or os.urandom(4)
+        msg = coap_msg.encode(coap_msg.CON, code, mid, token, options, payload)
+
+        pending = [asyncio.get_event_loop().create_future(), False]
+        self._pending[token] = self._by_mid[mid] = pending
+        deadline = time.monotonic() + timeout
+        wait     = self.ACK_TIMEOUT * random.uniform(1, self.ACK_RANDOM_FACTOR)
+        attempts = 0
+        try:
+            while True:
+                if not pending[1]:
+                    self.transport.sendto(msg)
+                    attempts += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    return await asyncio.wait_for(asyncio.shield(pending[0]),
+                                                  remaining if pending[1]
+                                                  else min(wait, remaining))
+                except asyncio.TimeoutError:
+                    if attempts > self.MAX_RETRANSMIT and not pending[1]:
+                        return None
+                    wait *= 2
+        finally:
+            del self._pending[token]
+            del self._by_mid[mid]
+
+    def _send_empty(self, mtype, mid):
+        self.transport.sendto(coap_msg.encode(mtype, coap_msg.EMPTY, mid))
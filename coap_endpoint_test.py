@@ -0,0 +1,115 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests CON requests with coap_endpoint.py, against a Python UDP responder. Does
+not require RIOT.
+"""
+
+import asyncio
+import pytest
+import time
+import types
+
+import coap_msg
+from coap_endpoint import CoapEndpoint
+from conftest import udp_responder
+
+#
+# fixtures and utility functions
+#
+
+class FastEndpoint(CoapEndpoint):
+    ACK_TIMEOUT = 0.05
+
+@pytest.fixture
+def responder():
+    """
+    Runs a UDP endpoint on ::1 that records each message it receives, with its
+    time, and responds with the server's 'respond' function, with args
+    (socket, request Message, remote address).
+
+    :return: namespace with the port, the received list, and respond
+    """
+    server = types.SimpleNamespace(received=[], respond=lambda sock, msg, remote: None)
+
+    def handle(sock, data, remote):
+        msg = coap_msg.decode(data)
+        server.received.append((time.monotonic(), msg))
+        server.respond(sock, msg, remote)
+
+    with udp_responder(handle) as port:
+        server.port = port
+        yield server
+
+def request(port, timeout=2.0):
+    """Sends a GET of /test from a FastEndpoint, and waits for the response.
+
+    :return: response Message, or None
+    """
+    async def main():
+        loop = asyncio.get_event_loop()
+        _, endpoint = await loop.create_datagram_endpoint(FastEndpoint,
+                                                          remote_addr=('::1', port))
+        try:
+            response = await endpoint.request(coap_msg.GET,
+                                              coap_msg.path_options('/test'),
+                                              timeout=timeout)
+            # let the endpoint ACK or reset any late messages
+            await asyncio.sleep(0.1)
+            return response
+        finally:
+            endpoint.transport.close()
+
+    return asyncio.run(main())
+
+#
+# tests
+#
+
+def test_retransmit(responder):
+    """Retransmits an unanswered request MAX_RETRANSMIT times, with randomized
+       exponential backoff."""
+    assert request(responder.port, timeout=10) is None
+
+    times = [t for t, msg in responder.received]
+    assert len(times) == CoapEndpoint.MAX_RETRANSMIT + 1
+    first = times[1] - times[0]
+    assert 0.05 <= first <= 0.075 + 0.02
+    for i in range(1, len(times) - 1):
+        assert times[i+1] - times[i] == pytest.approx(first * 2 ** i, abs=0.03)
+
+def test_separate(responder):
+    """An empty ACK stops retransmission. The separate CON response is ACKed."""
+    def respond(sock, msg, remote):
+        if msg.code == coap_msg.GET:
+            sock.sendto(coap_msg.encode(coap_msg.ACK, coap_msg.EMPTY, msg.mid), remote)
+            time.sleep(0.5)
+            sock.sendto(coap_msg.encode(coap_msg.CON, coap_msg.CONTENT, 100, msg.token,
+                                        [], b'separate'), remote)
+    responder.respond = respond
+
+    response = request(responder.port)
+    assert response.payload == b'separate'
+    received = [msg for t, msg in responder.received]
+    assert [m.mtype for m in received] == [coap_msg.CON, coap_msg.ACK]
+    assert received[1].mid == 100
+
+def test_unknown_token(responder):
+    """A CON message with an unknown token is reset, and not ACKed."""
+    def respond(sock, msg, remote):
+        if msg.code == coap_msg.GET:
+            sock.sendto(coap_msg.encode(coap_msg.CON, coap_msg.CONTENT, 100, b'stale',
+                                        [(coap_msg.OBSERVE, b'\x02')]), remote)
+            sock.sendto(coap_msg.encode(coap_msg.ACK, coap_msg.CONTENT, msg.mid,
+                                        msg.token, [], b'piggybacked'), remote)
+    responder.respond = respond
+
+    response = request(responder.port)
+    assert response.payload == b'piggybacked'
+    received = [msg for t, msg in responder.received]
+    assert [(m.mtype, m.mid) for m in received] == [(coap_msg.CON, received[0].mid),
+                                                    (coap_msg.RST, 100)]
@@ -0,0 +1,182 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Minimal CoAP message encoding and decoding (RFC 7252), using only the Python
+standard library. Useful for probes and tools that must work below, or
+without, aiocoap.
+
+Only the message format is implemented; there is no messaging layer.
+"""
+
+import struct
+from collections import namedtuple
+
+# message types
+CON = 0
+NON = 1
+ACK = 2
+RST = 3
+
+# codes, as the single byte value
+EMPTY    = 0x00
+GET      = 0x01
+POST     = 0x02
+PUT      = 0x03
+DELETE   = 0x04
+CREATED  = 0x41
+DELETED  = 0x42
+CHANGED  = 0x44
+CONTENT  = 0x45
+CONTINUE = 0x5F
+
+# option numbers
+OBSERVE        = 6
+LOCATION_PATH  = 8
+URI_PATH       = 11
+CONTENT_FORMAT = 12
+URI_QUERY      = 15
+BLOCK2         = 23
+BLOCK1         = 27
+SIZE2          = 28
+SIZE1          = 60
+
+_header = struct.Struct('!BBH')
+
+Message = namedtuple('Message', ['mtype', 'code', 'mid', 'token', 'options',
+                                 'payload'])
+Message.__doc__ = """Decoded CoAP message. 'options' is a list of
+                     (number, bytes value) tuples, in message order."""
+
+
+def code_text(code):
+    """Provides the dotted text form of a code, like '2.05'."""
+    return '{0}.{1:02d}'.format(code >> 5, code & 0x1F)
+
+def encode_uint(value):
+    """Encodes an unsigned integer option value in the minimum length."""
+    return value.to_bytes((value.bit_length() + 7) // 8, 'big')
+
+def decode_uint(value):
+    return int.from_bytes(value, 'big')
+
+def encode_block(num, more, size):
+    """Encodes a Block1 or Block2 option value.
+
+    :param int size: Block size, a power of two from 16 to 1024
+    """
+    szx = size.bit_length() - 5
+    if not 0 <= szx <= 6 or size != 1 << (szx + 4):
+        raise ValueError('bad block size: {0}'.format(size))
+    return encode_uint((num << 4) | (0x08 if more else 0) | szx)
+
+def decode_block(value):
+    """Decodes a Block1 or Block2 option value.
+
+    :return: (num, more, size) tuple
+    """
+    value = decode_uint(value)
+    return value >> 4, bool(value & 0x08), 1 << ((value & 0x07) + 4)
+
+def get_option(msg, number, default=None):
+    """Provides the value of the first option with the number in a
+       decoded Message."""
+    for num, value in msg.options:
+        if num == number:
+            return value
+    return default
+
+def path_options(path):
+    """Provides Uri-Path options for a path like '/.well-known/core', and
+       Uri-Query options for a query, like '/riot/ver?size=1024'."""
+    path, _, query = path.partition('?')
+    return [(URI_PATH, seg.encode('utf-8')) for seg in path.split('/') if seg] + \
+           [(URI_QUERY, arg.encode('utf-8')) for arg in query.split('&') if arg]
+
+def _opt_nibble(value):
+    """Provides the 4 bit nibble and extended bytes for an option delta or
+       length."""
+    if value < 13:
+        return value, b''
+    elif value < 269:
+        return 13, bytes((value - 13,))
+    else:
+        return 14, struct.pack('!H', value - 269)
+
+def encode(mtype, code, mid, token=b'', options=(), payload=b''):
+    """
+    Encodes a CoAP message.
+
+    :param options: Iterable of (number, bytes value) tuples, in any order
+    :return: bytes
+    """
+    parts = [_header.pack(0x40 | (mtype << 4) | len(token), code, mid), token]
+    last  = 0
+    for number, value in sorted(options, key=lambda opt: opt[0]):
+        delta, delta_ext = _opt_nibble(number - last)
+        length, len_ext  = _opt_nibble(len(value))
+        parts.append(bytes(((delta << 4) | length,)))
+        parts.append(delta_ext)
+        parts.append(len_ext)
+        parts.append(value)
+        last = number
+    if payload:
+        parts.append(b'\xff')
+        parts.append(payload)
+    return b''.join(parts)
+
+def decode(data):
+    """
+    Decodes a CoAP message.
+
+    :return: Message
+    :raises ValueError: if data is not a well formed CoAP message
+    """
+    if len(data) < 4:
+        raise ValueError('message too short')
+    first, code, mid = _header.unpack_from(data)
+    if first >> 6 != 1:
+        raise ValueError('unknown CoAP version')
+    tkl = first & 0x0F
+    pos = 4 + tkl
+    if tkl > 8 or pos > len(data):
+        raise ValueError('bad token length')
+    token = bytes(data[4:pos])
+
+    options = []
+    number  = 0
+    end     = len(data)
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        if byte == 0xFF:
+            break
+        delta  = byte >> 4
+        length = byte & 0x0F
+        if delta == 13:
+            delta = data[pos] + 13
+            pos  += 1
+        elif delta == 14:
+            delta = struct.unpack_from('!H', data, pos)[0] + 269
+            pos  += 2
+        elif delta == 15:
+            raise ValueError('bad option delta')
+        if length == 13:
+            length = data[pos] + 13
+            pos   += 1
+        elif length == 14:
+            length = struct.unpack_from('!H', data, pos)[0] + 269
+            pos   += 2
+        elif length == 15:
+            raise ValueError('bad option length')
+        number += delta
+        if pos + length > end:
+            raise ValueError('option overruns message')
+        options.append((number, bytes(data[pos:pos+length])))
+        pos += length
+
+    return Message((first >> 4) & 0x03, code, mid, token, options,
+                   bytes(data[pos:]))
@@ -0,0 +1,38 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests CoAP message encoding and decoding. Does not require RIOT.
+"""
+
+import pytest
+
+import coap_msg
+
+#
+# tests
+#
+
+def test_codec():
+    """Message round trips through encode and decode, including extended
+       option delta and length."""
+    options = coap_msg.path_options('/cli/stats') + [(coap_msg.SIZE1, b'x' * 300)]
+    data = coap_msg.encode(coap_msg.NON, coap_msg.POST, 1234, b'\x01\x02',
+                           options, b'payload')
+    msg = coap_msg.decode(data)
+    assert msg == (coap_msg.NON, coap_msg.POST, 1234, b'\x01\x02', options,
+                   b'payload')
+    assert coap_msg.code_text(coap_msg.CONTENT) == '2.05'
+    assert coap_msg.path_options('/riot/ver?size=64&x') == [
+           (coap_msg.URI_PATH, b'riot'), (coap_msg.URI_PATH, b'ver'),
+           (coap_msg.URI_QUERY, b'size=64'), (coap_msg.URI_QUERY, b'x')]
+
+def test_block_option():
+    value = coap_msg.encode_block(1000, True, 64)
+    assert coap_msg.decode_block(value) == (1000, True, 64)
+    assert coap_msg.encode_block(0, False, 16) == b''
+    with pytest.raises(ValueError):
+        coap_msg.encode_block(0, False, 48)
@@ -0,0 +1,139 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Structured results from client scripts, as a JSON Lines file with one record
+per exchange. A client writes with ResultWriter, and a test reads with
+ResultReader while the client runs, so validation proceeds as records arrive
+rather than by scanning a log after the client exits.
+
+An exchange record includes these fields; a lost request includes only 't',
+'lost' and any fields added by the client:
+
+:t:     Wall clock time the request was sent, in seconds since the epoch
+:rtt:   Seconds from send until the response was received
+:code:  Response code text, like '2.05 Content'
+:mtype: Response message type, like 'ACK'
+:mid:   Response message ID
+:token: Response token, as hex
+:size:  Response payload length in bytes
+"""
+
+import json
+import time
+
+from coap_stats import Histogram
+
+class ResultWriter():
+    """
+    Writes result records to a JSON Lines file. Each record is flushed as it
+    is written, for a live reader.
+
+    :param string path: Path to the file, or None to discard records
+    """
+
+    def __init__(self, path=None):
+        self._file = open(path, 'w', buffering=1) if path else None
+
+    def exchange(self, response, sent, sent_time=None, **fields):
+        """
+        Writes the record for a request/response exchange.
+
+        :param response: aiocoap Message received
+        :param float sent: time.monotonic() when the request was sent
+        :param float sent_time: time.time() when the request was sent;
+                                estimated from sent if None
+        :param fields: Additional fields for the record
+        """
+        now = time.monotonic()
+        if sent_time is None:
+            sent_time = time.time() - (now - sent)
+        self.write(t=sent_time, rtt=now - sent, code=str(response.code),
+                   mtype=response.mtype.name, mid=response.mid,
+                   token=response.token.hex(), size=len(response.payload),
+                   **fields)
+
+    def lost(self, sent_time, **fields):
+        """Writes the record for a request with no response."""
+        self.write(t=sent_time, lost=True, **fields)
+
+    def write(self, **record):
+        if self._file:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+class ResultReader():
+    """
+    Reads result records incrementally from a JSON Lines file that a client
+    may still be writing. Each read() parses only the records appended since
+    the previous read. The file need not exist yet.
+    """
+
+    def __init__(self, path):
+        self.path     = path
+        # all records read so far
+        self.records  = []
+        self._offset  = 0
+        self._partial = b''
+
+    def read(self):
+        """Reads the complete records appended since the last read.
+
+        :return: list of new records
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        self._offset += len(data)
+
+        lines = (self._partial + data).split(b'\n')
+        # last element is an incomplete line, or empty
+        self._partial = lines.pop()
+        new = [json.loads(line) for line in lines if line]
+        self.records.extend(new)
+        return new
+
+    def wait_for(self, count, select=None, timeout=10, interval=0.05):
+        """
+        Reads records until count of them match select, counting records
+        already read.
+
+        :param select: Function that accepts a record and returns True if it
+                       matches; if None, all records match
+        :return: list of matching records
+        :raises TimeoutError: if fewer records match within the timeout
+        """
+        select   = select or (lambda record: True)
+        matched  = [r for r in self.records if select(r)]
+        deadline = time.monotonic() + timeout
+        while len(matched) < count:
+            new = self.read()
+            matched.extend(r for r in new if select(r))
+            if len(matched) >= count:
+                break
+            if time.monotonic() >= deadline:
+                raise TimeoutError('Found {0} of {1} results in {2}'.format(
+                                   len(matched), count, self.path))
+            if not new:
+                time.sleep(interval)
+        return matched
+
+
+def rtt_histogram(records):
+    """Provides a Histogram of round trip time in microseconds, for records
+       with a response."""
+    hist = Histogram()
+    for record in records:
+        if 'rtt' in record:
+            hist.record(record['rtt'] * 1e6)
+    return hist
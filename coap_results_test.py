@@ -0,0 +1,57 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests the structured results channel for client scripts. Does not require
+RIOT.
+"""
+
+import pytest
+import threading
+import time
+
+from coap_results import ResultReader, ResultWriter, rtt_histogram
+
+#
+# tests
+#
+
+def test_incremental(tmp_path):
+    """Reader returns only complete records, as they are appended."""
+    path   = str(tmp_path / 'results.jsonl')
+    reader = ResultReader(path)
+    assert reader.read() == []
+
+    with open(path, 'w') as f:
+        f.write('{"code":"2.05 Content","rtt":0.002}\n{"code":"2.05')
+        f.flush()
+        assert reader.read() == [{'code': '2.05 Content', 'rtt': 0.002}]
+        f.write(' Content","rtt":0.004}\n')
+        f.flush()
+        assert reader.read() == [{'code': '2.05 Content', 'rtt': 0.004}]
+    assert len(reader.records) == 2
+    assert rtt_histogram(reader.records).percentiles((50, 100)) == {50: 2000, 100: 4000}
+
+def test_wait_for(tmp_path):
+    """Waits for records written by a concurrent writer."""
+    path   = str(tmp_path / 'results.jsonl')
+    writer = ResultWriter(path)
+
+    def write():
+        for i in range(5):
+            time.sleep(0.02)
+            writer.write(code='2.05 Content' if i % 2 else '4.04 Not Found', mid=i)
+    thread = threading.Thread(target=write)
+    thread.start()
+
+    reader = ResultReader(path)
+    found  = reader.wait_for(2, lambda r: r['code'] == '2.05 Content', timeout=2)
+    assert [r['mid'] for r in found] == [1, 3]
+    thread.join()
+    writer.close()
+
+    with pytest.raises(TimeoutError):
+        reader.wait_for(3, lambda r: r['code'] == '2.05 Content', timeout=0.1)
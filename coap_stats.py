@@ -0,0 +1,200 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Statistics for CoAP client scripts and benchmarks.
+
+Histogram records values like an HDR histogram: buckets are spaced
+logarithmically by powers of two, and each power is divided linearly into
+enough sub-buckets to resolve a value to the requested count of significant
+digits. So memory remains small and constant over a wide range of values,
+while percentiles are accurate to a fixed relative error.
+
+ObserveSequence tracks the Observe option values of a notification stream,
+with the RFC 7641 freshness rules.
+"""
+
+import collections
+import math
+import time
+
+class Histogram():
+    """
+    Histogram of non-negative integer values, like latencies in microseconds.
+
+    :param int significant_digits: Decimal digits of precision for a recorded
+                                   value, from 1 to 5
+    """
+
+    def __init__(self, significant_digits=3):
+        if not 1 <= significant_digits <= 5:
+            raise ValueError('significant_digits must be from 1 to 5')
+        # bits for sub-buckets within a power of two
+        self._sub_bits = math.ceil(math.log2(2 * 10**significant_digits))
+        # key: (shift, sub-bucket), so key order matches value order
+        self._counts   = collections.Counter()
+        self.count     = 0
+        self.total     = 0
+        self.min       = None
+        self.max       = None
+
+    def record(self, value, count=1):
+        """Records a value, count times. Rounds a float value to int."""
+        value = int(round(value))
+        if value < 0:
+            raise ValueError('Value must not be negative: {0}'.format(value))
+        self._counts[self._key(value)] += count
+        self.count += count
+        self.total += value * count
+        self.min    = value if self.min is None else min(self.min, value)
+        self.max    = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Adds the values recorded by another Histogram with the same
+           precision."""
+        if other._sub_bits != self._sub_bits:
+            raise ValueError('Histogram precision differs')
+        if not other.count:
+            return
+        self._counts.update(other._counts)
+        self.count += other.count
+        self.total += other.total
+        self.min    = other.min if self.min is None else min(self.min, other.min)
+        self.max    = other.max if self.max is None else max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def value_at(self, percentile):
+        """
+        Provides the value at or below which the percentile of recorded values
+        fall. The value is the highest equivalent to the recorded value, within
+        the histogram's precision.
+
+        :param float percentile: Percentile from 0 to 100
+        :return: int value, or None if nothing recorded
+        """
+        if not self.count:
+            return None
+        # round away float error, like 99.9 / 100 * 20000 = 19980.000000000004
+        target  = max(1, math.ceil(round(percentile / 100 * self.count, 6)))
+        running = 0
+        for shift, sub in sorted(self._counts):
+            running += self._counts[(shift, sub)]
+            if running >= target:
+                return min(((sub + 1) << shift) - 1, self.max)
+        return self.max
+
+    def percentiles(self, percentiles=(50, 90, 99, 99.9)):
+        """Provides an ordered dict of value by percentile."""
+        return collections.OrderedDict((p, self.value_at(p)) for p in percentiles)
+
+    def _key(self, value):
+        shift = max(value.bit_length() - self._sub_bits, 0)
+        return shift, value >> shift
+
+
+class ObserveSequence():
+    """
+    Tracks the sequence values of a notification stream, to detect reordering,
+    duplicates and gaps, and records inter-arrival time. Orders values like
+    RFC 7641, section 3.4: a notification is fresh if its value is greater
+    than the value of the last fresh notification in 24 bit serial number
+    arithmetic, or if more than 128 seconds have passed since then. A stale
+    notification with the same value is a duplicate; otherwise it was
+    reordered.
+
+    A gap counts values skipped between fresh notifications. It is meaningful
+    for a server that increments the Observe value for each notification, like
+    aiocoap, but not for one that derives it from a clock. Also useful for any
+    other increasing counter, like the count in a /cli/stats payload.
+    """
+    MODULUS       = 1 << 24
+    FRESH_SECONDS = 128
+
+    def __init__(self):
+        self.received   = 0
+        self.fresh      = 0
+        self.reordered  = 0
+        self.duplicates = 0
+        self.gaps       = 0
+        # microseconds between notifications
+        self.interarrival = Histogram()
+        self._last        = None
+        self._last_time   = None
+        self._arrival     = None
+
+    def record(self, value, now=None):
+        """
+        Records the sequence value of a notification.
+
+        :param float now: time.monotonic() when received; current time if None
+        :return: True if the notification is fresh
+        """
+        now = time.monotonic() if now is None else now
+        self.received += 1
+        if self._arrival is not None:
+            self.interarrival.record((now - self._arrival) * 1e6)
+        self._arrival = now
+
+        if self._last is None:
+            fresh = True
+        else:
+            delta = (value - self._last) % self.MODULUS
+            fresh = 0 < delta < self.MODULUS // 2
+            if fresh:
+                self.gaps += delta - 1
+            elif now > self._last_time + self.FRESH_SECONDS:
+                fresh = True
+            elif delta == 0:
+                self.duplicates += 1
+            else:
+                self.reordered += 1
+
+        if fresh:
+            self.fresh     += 1
+            self._last      = value
+            self._last_time = now
+        return fresh
+
+    def restart(self):
+        """Forgets the last value, as for a new Observe registration, but keeps
+           the counts."""
+        self._last    = None
+        self._arrival = None
+
+    def counters(self):
+        """Provides the counts, as fields for a result record."""
+        return {'received': self.received, 'fresh': self.fresh,
+                'reordered': self.reordered, 'duplicates': self.duplicates,
+                'gaps': self.gaps}
+
+
+def format_latency(hist, unit='ms', scale=1000):
+    """
+    Formats percentiles of a histogram of microsecond latencies, like
+    'p50 1.204 p90 1.630 p99 2.301 p99.9 4.012 max 4.551 ms'.
+
+    :param int scale: Count of microseconds per unit
+    """
+    if not hist.count:
+        return 'no samples'
+    parts = ['p{0:g} {1:.3f}'.format(p, v / scale)
+             for p, v in hist.percentiles().items()]
+    parts.append('max {0:.3f}'.format(hist.max / scale))
+    return '{0} {1}'.format(' '.join(parts), unit)
+
+def summary_fields(hist, scale=1000):
+    """
+    Provides percentiles and count of a histogram of microsecond latencies,
+    as fields for a result record, like {'p50': 1.204, ..., 'count': 20}.
+
+    :param int scale: Count of microseconds per unit of the percentile fields
+    """
+    fields = {'p{0:g}'.format(p): v / scale if v is not None else None
+              for p, v in hist.percentiles().items()}
+    fields['count'] = hist.count
+    return fields
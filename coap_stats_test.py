@@ -0,0 +1,68 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests statistics for client scripts. Does not require RIOT.
+"""
+
+import pytest
+import random
+
+from coap_stats import Histogram, ObserveSequence, format_latency
+
+#
+# tests
+#
+
+def test_percentiles():
+    """Percentiles are accurate within the histogram precision, over a wide
+       range of values."""
+    rng    = random.Random(1)
+    values = sorted(int(rng.lognormvariate(7, 2)) for i in range(20000))
+    hist   = Histogram(3)
+    for value in values:
+        hist.record(value)
+
+    assert hist.count == len(values)
+    assert hist.min == values[0] and hist.max == values[-1]
+    for p in (50, 90, 99, 99.9):
+        exact = values[int(len(values) * p / 100) - 1]
+        assert abs(hist.value_at(p) - exact) <= exact / 1000 + 1
+    assert hist.value_at(100) == values[-1]
+
+def test_merge():
+    """Merged histograms match a histogram of all values."""
+    one, two, both = Histogram(), Histogram(), Histogram()
+    for value in range(0, 100000, 7):
+        (one if value % 2 else two).record(value)
+        both.record(value)
+    one.merge(two)
+    assert one.percentiles() == both.percentiles()
+    assert one.mean() == both.mean()
+
+    with pytest.raises(ValueError):
+        one.merge(Histogram(2))
+
+def test_format():
+    hist = Histogram()
+    assert format_latency(hist) == 'no samples'
+    hist.record(1500)
+    assert format_latency(hist) == 'p50 1.500 p90 1.500 p99 1.500 p99.9 1.500 max 1.500 ms'
+
+def test_observe_sequence():
+    """Detects gaps, duplicates and reordering, including across the 24 bit
+       wrap of the Observe value."""
+    seq = ObserveSequence()
+    for i, value in enumerate([0xFFFFFE, 0xFFFFFF, 1, 1, 0, 4]):
+        seq.record(value, now=i * 0.5)
+    assert seq.counters() == {'received': 6, 'fresh': 4, 'reordered': 1,
+                              'duplicates': 1, 'gaps': 3}
+    assert seq.interarrival.count == 5
+    assert seq.interarrival.value_at(50) == 500000
+
+    # a lower value is fresh after 128 seconds
+    assert not seq.record(2, now=100)
+    assert seq.record(2, now=200)
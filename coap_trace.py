@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Indexes the CoAP messages in a pcap capture, like from the packet_capture
+fixture or impair_proxy.py, by token and message ID. From the index, computes
+after a test the latency of each request until its response, CON
+retransmissions, Block1 and Block2 transfers, and Observe notifications.
+
+Decodes with struct, from the whole capture in memory. Decodes only the IP,
+UDP and CoAP headers, the token, and the Observe, Block2 and Block1 options,
+so a capture of a million packets decodes in a few seconds. Trace.message()
+decodes the rest of a message when needed. Skips packets that are not CoAP,
+like DTLS records, so analyze plain UDP only.
+
+Matches a request to its response by token and endpoints, so separate
+responses count. Groups the transmissions of a request by message ID with the
+ACK or RST, as in con_timing.py, so check_backoff() applies. Further
+responses with the token are Observe notifications. A retransmitted CON
+response counts only once.
+
+Prints a summary; with -v, also prints each exchange and block transfer:
+
+Packets 2046, CoAP messages 2046, decoded in 0.011 s
+Requests 1012, responses 1012, retransmissions 22
+Latency p50 1.204 p90 1.630 p99 2.301 p99.9 4.012 max 4.551 ms
+Block transfers 2, complete 2, blocks 12
+Observations 1, notifications 10, reordered 0, duplicates 0
+
+Usage:
+    usage: coap_trace.py [-p PORTS] [-v] [-j FILE] PCAP
+    usage: coap_trace.py -h
+
+    positional arguments:
+      PCAP      pcap capture file
+
+    optional arguments:
+      -h, --help  show this help message and exit
+      -p PORTS    only UDP packets to or from these ports, like 5683,5684
+      -v          also print each exchange and block transfer
+      -j FILE     write the summary as a JSON Lines record
+
+Example:
+
+$ ./coap_trace.py -p 5683 test_server.pcap
+"""
+
+import collections
+import contextlib
+import gc
+import socket
+import struct
+import time
+from argparse import ArgumentParser
+
+import coap_msg
+from coap_results import ResultWriter
+from coap_stats import Histogram, ObserveSequence, format_latency, summary_fields
+from con_timing import ConExchange
+from pcap_file import LINK_HEADER, LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, parse_header
+
+TraceMessage = collections.namedtuple('TraceMessage', [
+               't', 'src', 'dst', 'mtype', 'code', 'mid', 'token', 'observe',
+               'block1', 'block2', 'start', 'end'])
+TraceMessage.__doc__ = """Fields of a CoAP message in Trace.messages, which
+                          holds plain tuples for speed; use
+                          TraceMessage._make() for the names. 'src' and 'dst'
+                          are indexes into Trace.endpoints. 'observe',
+                          'block1' and 'block2' are the option values as
+                          bytes, or None. 'start' and 'end' locate the message
+                          in the capture, for Trace.message()."""
+
+# From an IPv6 header: next header; addresses and ports; UDP length; CoAP
+# first byte, code and message ID. Assumes no extension headers.
+_ipv6_coap = struct.Struct('!6xBx36sH2xBBH')
+# From a UDP header: length; CoAP first byte, code and message ID
+_udp_coap  = struct.Struct('!4xH2xBBH')
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Pauses the cyclic garbage collector while building the many objects
+       that live as long as a Trace. Its passes over them find nothing to
+       collect, and would double the time to build them."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class Exchange(ConExchange):
+    """
+    A request and the responses to it, from a trace. As for ConExchange,
+    'attempts' are the times of the request's transmissions, and 'response'
+    the time of the ACK or RST. 'reply' is the time of the first response,
+    piggybacked or separate, and 'notifications' the (time, Observe value) of
+    each further response.
+    """
+
+    def __init__(self, client, server, mid, token, code, request):
+        super().__init__(client, mid, token)
+        self.server  = server
+        self.code    = code
+        # index of the request's first transmission in Trace.messages
+        self.request = request
+        # Block1 option value of the request, and Block2 of the first
+        # response, as bytes; None if absent
+        self.block1  = None
+        self.block2  = None
+        self.reply   = None
+        self.reply_code    = None
+        self.reply_index   = None
+        self.reply_observe = None
+        self.notifications = []
+
+    def set_reply(self, index, t, code, observe, block2):
+        """Records the first response, at an index in Trace.messages."""
+        self.reply       = t
+        self.reply_code  = code
+        self.reply_index = index
+        self.block2      = block2
+        if observe is not None:
+            self.reply_observe = int.from_bytes(observe, 'big')
+
+    def latency(self):
+        """Provides seconds from the first transmission of the request until
+           the first response, or None if no response."""
+        return self.reply - self.attempts[0] if self.reply is not None else None
+
+    def observe_sequence(self):
+        """Provides an ObserveSequence for the Observe values of the first
+           response and the notifications, or None if not observed."""
+        if self.reply_observe is None:
+            return None
+        sequence = ObserveSequence()
+        sequence.record(self.reply_observe, self.reply)
+        for t, value in self.notifications:
+            sequence.record(value, t)
+        return sequence
+
+    def __str__(self):
+        text = '{0} -> {1} {2} token {3}: '.format(self.client, self.server,
+                                                    coap_msg.code_text(self.code),
+                                                    self.token.hex())
+        text += super().__str__()
+        if self.reply is not None:
+            text += '; ' + coap_msg.code_text(self.reply_code)
+            if self.reply != self.response:
+                text += ' after {0:.3f} s'.format(self.latency())
+        if self.notifications:
+            text += '; {0} notifications'.format(len(self.notifications))
+        return text
+
+
+class BlockTransfer():
+    """
+    The exchanges of a Block1 or Block2 transfer, from block 0 until the
+    block without the 'more' flag.
+
+    :param string kind: 'block1' or 'block2'
+    """
+
+    def __init__(self, kind, client, server, path):
+        self.kind      = kind
+        self.client    = client
+        self.server    = server
+        self.path      = path
+        self.exchanges = []
+        self.complete  = False
+        # payload bytes transferred
+        self.size      = 0
+
+    def elapsed(self):
+        """Provides seconds from the first request until the last response, or
+           None if no response."""
+        last = self.exchanges[-1].reply
+        return last - self.exchanges[0].attempts[0] if last is not None else None
+
+    def __str__(self):
+        elapsed = self.elapsed()
+        return '{0} {1} -> {2} /{3}: {4} blocks, {5} bytes, {6}{7}'.format(
+               self.kind, self.client, self.server, self.path, len(self.exchanges),
+               self.size, 'complete' if self.complete else 'incomplete',
+               ' in {0:.3f} s'.format(elapsed) if elapsed is not None else '')
+
+
+class Trace():
+    """
+    CoAP messages decoded from a pcap capture, in capture order, as tuples
+    with the TraceMessage fields.
+
+    :param data: Contents of the capture
+    :param ports: Collection of UDP ports; if not empty, only decodes packets
+                  to or from one of them
+    """
+
+    def __init__(self, data, ports=()):
+        self._data     = data
+        self.messages  = []
+        # endpoint text, like '[fd00:bbbb::1]:5683', by index
+        self.endpoints = []
+        self._endpoint_ids = {}
+        self.packets   = 0
+        self._exchanges = None
+        self._response_retransmissions = 0
+        with _gc_paused():
+            self._decode(frozenset(ports))
+
+    @classmethod
+    def load(cls, path, ports=()):
+        """Reads and decodes a capture file."""
+        with open(path, 'rb') as f:
+            return cls(f.read(), ports)
+
+    def _decode(self, ports):
+        header   = parse_header(self._data)
+        data     = self._data
+        end      = len(data)
+        record   = header.record.unpack_from
+        rec_size = header.record.size
+        scale    = header.time_scale
+        link     = LINK_HEADER[header.linktype]
+        typed    = header.linktype in (LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL)
+        # addresses and ports, as in the packet, to (source, destination)
+        # endpoint indexes, or False if not a port to decode
+        flows    = {}
+        ipv6_coap = _ipv6_coap.unpack_from
+        udp_coap  = _udp_coap.unpack_from
+        append   = self.messages.append
+        count    = 0
+        # TraceMessage without the keyword handling of its constructor, and
+        # option numbers as locals, for speed
+        new = tuple.__new__
+        OBSERVE, BLOCK2, BLOCK1 = coap_msg.OBSERVE, coap_msg.BLOCK2, coap_msg.BLOCK1
+
+        pos = 24
+        while pos + rec_size <= end:
+            secs, frac, caplen, _ = record(data, pos)
+            pos   += rec_size
+            ip     = pos + link
+            pos   += caplen
+            count += 1
+            if pos > end:
+                break
+            if typed and data[ip-2:ip] not in (b'\x86\xdd', b'\x08\x00'):
+                continue
+
+            # IP, UDP and CoAP headers; one unpack for IPv6
+            version = data[ip] >> 4
+            if version == 6 and ip + 52 <= pos:
+                proto, flow, length, byte, code, mid = ipv6_coap(data, ip)
+                if proto != 17:
+                    continue
+                start = ip + 48
+            elif version == 4:
+                # also skip a fragment after the first
+                if data[ip+9] != 17 or data[ip+6] & 0x1F or data[ip+7]:
+                    continue
+                udp = ip + (data[ip] & 0x0F) * 4
+                if udp + 12 > pos:
+                    continue
+                flow = data[ip+12:ip+20] + data[udp:udp+4]
+                length, byte, code, mid = udp_coap(data, udp)
+                start = udp + 8
+            else:
+                continue
+            ids = flows.get(flow)
+            if ids is None:
+                ids = flows[flow] = self._add_flow(flow, ports)
+            if not ids:
+                continue
+            msg_end = start - 8 + length
+            if msg_end > pos:
+                msg_end = pos
+            opt = start + 4 + (byte & 0x0F)
+            if byte >> 6 != 1 or byte & 0x0F > 8 or opt > msg_end:
+                continue
+
+            # only the options to index; stop after the last of them
+            observe = block1 = block2 = None
+            number  = 0
+            while opt < msg_end:
+                option = data[opt]
+                if option == 0xFF:
+                    break
+                opt    += 1
+                number += option >> 4
+                size    = option & 0x0F
+                if option >= 0xD0:
+                    number -= option >> 4
+                    if option < 0xE0:
+                        number += data[opt] + 13
+                        opt    += 1
+                    elif option < 0xF0:
+                        number += (data[opt] << 8 | data[opt+1]) + 269
+                        opt    += 2
+                    else:
+                        break
+                if size >= 13:
+                    if size == 13:
+                        size = data[opt] + 13
+                        opt += 1
+                    elif size == 14:
+                        size = (data[opt] << 8 | data[opt+1]) + 269
+                        opt += 2
+                    else:
+                        break
+                if number >= OBSERVE:
+                    if number == OBSERVE:
+                        observe = data[opt:opt+size]
+                    elif number == BLOCK2:
+                        block2 = data[opt:opt+size]
+                    elif number == BLOCK1:
+                        block1 = data[opt:opt+size]
+                        break
+                    elif number > BLOCK1:
+                        break
+                opt += size
+
+            append((secs + frac * scale, ids[0], ids[1], (byte >> 4) & 0x03, code,
+                    mid, data[start+4:start+4+(byte & 0x0F)], observe, block1, block2,
+                    start, msg_end))
+        self.packets = count
+
+    def _add_flow(self, flow, ports):
+        """Adds the endpoints for the addresses and ports of a packet, if
+           either port is to be decoded.
+
+        :return: (source, destination) endpoint indexes, or False
+        """
+        alen = (len(flow) - 4) // 2
+        sport, dport = struct.unpack_from('!HH', flow, 2 * alen)
+        if ports and sport not in ports and dport not in ports:
+            return False
+        return (self._add_endpoint(flow[:alen], sport),
+                self._add_endpoint(flow[alen:2*alen], dport))
+
+    def _add_endpoint(self, addr, port):
+        """:return: index of the endpoint in 'endpoints', added if new"""
+        if len(addr) == 16:
+            text = '[{0}]:{1}'.format(socket.inet_ntop(socket.AF_INET6, addr), port)
+        else:
+            text = '{0}:{1}'.format(socket.inet_ntop(socket.AF_INET, addr), port)
+        if text not in self._endpoint_ids:
+            self._endpoint_ids[text] = len(self.endpoints)
+            self.endpoints.append(text)
+        return self._endpoint_ids[text]
+
+    def message(self, index):
+        """Decodes the message at an index in 'messages' completely.
+
+        :return: coap_msg.Message
+        """
+        start, end = self.messages[index][-2:]
+        return coap_msg.decode(self._data[start:end])
+
+    def by_token(self):
+        """
+        Indexes messages by token, for each client and server. Includes the
+        requests from the client, and the responses from the server. Empty
+        messages have no token, so are not included.
+
+        :return: dictionary of (client, server, token) to list of message
+                 indexes, in capture order; client and server are endpoint
+                 indexes
+        """
+        index = collections.defaultdict(list)
+        for i, (t, src, dst, mtype, code, mid, token, *_) in enumerate(self.messages):
+            if 0 < code < 32:
+                index[(src, dst, token)].append(i)
+            elif code >= 64:
+                index[(dst, src, token)].append(i)
+        return index
+
+    def by_mid(self):
+        """
+        Indexes messages by message ID, for the endpoint that sent the CON or
+        NON message. Groups a message with its retransmissions, and with the
+        ACK or RST for it.
+
+        :return: dictionary of (sender, receiver, mid) to list of message
+                 indexes, in capture order; sender and receiver are endpoint
+                 indexes
+        """
+        index = collections.defaultdict(list)
+        for i, (t, src, dst, mtype, code, mid, *_) in enumerate(self.messages):
+            if mtype >= coap_msg.ACK:
+                index[(dst, src, mid)].append(i)
+            else:
+                index[(src, dst, mid)].append(i)
+        return index
+
+    def exchanges(self):
+        """
+        Matches each request with its transmissions and responses. A request
+        with the message ID of an earlier request from the client to the
+        server, and the same token, is a retransmission.
+
+        :return: list of Exchange, in order of first transmission
+        """
+        if self._exchanges is not None:
+            return self._exchanges
+        with _gc_paused():
+            self._exchanges = self._match()
+        return self._exchanges
+
+    def _match(self):
+        exchanges = []
+        # latest exchange, by (client, server, mid) and by (client, server,
+        # token); so a reused token or message ID starts a new exchange
+        by_mid    = {}
+        by_token  = {}
+        # (server, client, mid) of CON and NON responses seen
+        responses = set()
+        retransmitted = 0
+        endpoints = self.endpoints
+        ACK       = coap_msg.ACK
+        for i, (t, src, dst, mtype, code, mid, token, observe, block1, block2, _, _) \
+                in enumerate(self.messages):
+            if 0 < code < 32:
+                exchange = by_mid.get((src, dst, mid))
+                if exchange is not None and exchange.token == token:
+                    exchange.attempts.append(t)
+                    continue
+                exchange = Exchange(endpoints[src], endpoints[dst], mid, token, code, i)
+                exchange.attempts.append(t)
+                exchange.block1 = block1
+                by_mid[(src, dst, mid)] = by_token[(src, dst, token)] = exchange
+                exchanges.append(exchange)
+            elif mtype >= ACK:
+                exchange = by_mid.get((dst, src, mid))
+                if exchange is None:
+                    # ACK for a separate response or notification
+                    continue
+                if exchange.response is None:
+                    exchange.response = t
+                if code >= 64 and exchange.reply is None:
+                    exchange.set_reply(i, t, code, observe, block2)
+            elif code >= 64:
+                if (src, dst, mid) in responses:
+                    retransmitted += 1
+                    continue
+                responses.add((src, dst, mid))
+                exchange = by_token.get((dst, src, token))
+                if exchange is None:
+                    continue
+                if exchange.reply is None:
+                    exchange.set_reply(i, t, code, observe, block2)
+                elif observe is not None:
+                    exchange.notifications.append((t, int.from_bytes(observe, 'big')))
+
+        self._response_retransmissions = retransmitted
+        return exchanges
+
+    def retransmissions(self):
+        """Counts retransmitted CON messages, requests and responses."""
+        exchanges = self.exchanges()
+        return sum(len(e.attempts) - 1 for e in exchanges) + \
+               self._response_retransmissions
+
+    def block_transfers(self):
+        """
+        Groups the exchanges for Block1 requests, and for Block2 responses, by
+        client, server and Uri-Path. A transfer starts at block 0.
+
+        :return: list of BlockTransfer, in order of first request
+        """
+        transfers = []
+        current   = {}
+        for exchange in self.exchanges():
+            for kind, value, index in (('block1', exchange.block1, exchange.request),
+                                       ('block2', exchange.block2, exchange.reply_index)):
+                if value is None:
+                    continue
+                num, more, _ = coap_msg.decode_block(value)
+                request = self.message(exchange.request)
+                path    = '/'.join(v.decode('utf-8', 'replace') for n, v in request.options
+                                   if n == coap_msg.URI_PATH)
+                key = (kind, exchange.client, exchange.server, path)
+                if num == 0:
+                    current[key] = BlockTransfer(kind, exchange.client, exchange.server,
+                                                 path)
+                    transfers.append(current[key])
+                transfer = current.get(key)
+                if transfer is None:
+                    continue
+                transfer.exchanges.append(exchange)
+                transfer.size += len(self.message(index).payload)
+                if not more:
+                    transfer.complete = True
+                    del current[key]
+        return transfers
+
+    def summary(self):
+        """
+        Provides the counts and latency percentiles for the trace.
+
+        :return: (fields for a result record, with latency in milliseconds;
+                 Histogram of latency in microseconds)
+        """
+        exchanges = self.exchanges()
+        latency   = Histogram()
+        for exchange in exchanges:
+            if exchange.reply is not None:
+                latency.record(exchange.latency() * 1e6)
+        transfers = self.block_transfers()
+        sequences = [s for s in (e.observe_sequence() for e in exchanges) if s]
+
+        fields = {'packets': self.packets, 'messages': len(self.messages),
+                  'requests': len(exchanges), 'responses': latency.count,
+                  'retransmissions': self.retransmissions(),
+                  'block_transfers': len(transfers),
+                  'blocks_complete': sum(1 for t in transfers if t.complete),
+                  'blocks': sum(len(t.exchanges) for t in transfers),
+                  'observations': len(sequences),
+                  'notifications': sum(s.received - 1 for s in sequences),
+                  'reordered': sum(s.reordered for s in sequences),
+                  'duplicates': sum(s.duplicates for s in sequences)}
+        fields.update({'latency_{0}'.format(k): v
+                       for k, v in summary_fields(latency).items()})
+        return fields, latency
+
+
+def main(path, ports=(), verbose=False, resultsFile=None):
+    start = time.monotonic()
+    trace = Trace.load(path, ports)
+    trace.exchanges()
+    decoded = time.monotonic() - start
+
+    if verbose:
+        for exchange in trace.exchanges():
+            print(exchange)
+        for transfer in trace.block_transfers():
+            print(transfer)
+
+    fields, latency = trace.summary()
+    print('Packets {0}, CoAP messages {1}, decoded in {2:.3f} s'.format(
+          fields['packets'], fields['messages'], decoded))
+    print('Requests {0}, responses {1}, retransmissions {2}'.format(
+          fields['requests'], fields['responses'], fields['retransmissions']))
+    print('Latency {0}'.format(format_latency(latency)))
+    print('Block transfers {0}, complete {1}, blocks {2}'.format(
+          fields['block_transfers'], fields['blocks_complete'], fields['blocks']))
+    print('Observations {0}, notifications {1}, reordered {2}, duplicates {3}'.format(
+          fields['observations'], fields['notifications'], fields['reordered'],
+          fields['duplicates']), flush=True)
+
+    results = ResultWriter(resultsFile)
+    results.write(file=path, decode_time=decoded, **fields)
+    results.close()
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('path', metavar='PCAP',
+                        help='pcap capture file')
+    parser.add_argument('-p', dest='ports', default='',
+                        help='only UDP packets to or from these ports, like 5683,5684')
+    parser.add_argument('-v', dest='verbose', action='store_true',
+                        help='also print each exchange and block transfer')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='write the summary as a JSON Lines record')
+
+    args = parser.parse_args()
+
+    main(args.path, [int(p) for p in filter(None, args.ports.split(','))],
+         args.verbose, args.resultsFile)
@@ -0,0 +1,222 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests the pcap writer and the CoAP trace index with synthetic captures. Does
+not require RIOT.
+"""
+
+import logging
+import pytest
+import struct
+import time
+
+import coap_msg
+from coap_trace import Trace
+import pcap_file
+from pcap_file import LINKTYPE_RAW, PcapWriter, parse_header, udp_packet
+
+logging.basicConfig(level=logging.INFO)
+
+CLIENT = ('fd00:bbbb::1', 40000)
+SERVER = ('fd00:bbbb::2', 5683)
+
+#
+# fixtures and utility functions
+#
+
+@pytest.fixture
+def capture(tmp_path):
+    """Provides a function to write packets between CLIENT and SERVER to a
+       pcap file, with the pcap file path as an attribute.
+
+    :return: function(t, up, mtype, code, mid, token, options, payload);
+             'up' is True from client to server
+    """
+    path   = str(tmp_path / 'trace.pcap')
+    writer = PcapWriter(path, autoflush=False)
+
+    def write(t, up, mtype, code, mid, token=b'', options=(), payload=b''):
+        src, dst = (CLIENT, SERVER) if up else (SERVER, CLIENT)
+        writer.write_udp(src, dst, coap_msg.encode(mtype, code, mid, token, options,
+                                                   payload), t)
+
+    write.path  = path
+    write.close = writer.close
+    yield write
+
+    # teardown
+    writer.close()
+
+#
+# tests
+#
+
+def test_header(capture):
+    capture.close()
+    with open(capture.path, 'rb') as f:
+        header = parse_header(f.read())
+    assert header.linktype == LINKTYPE_RAW and header.time_scale == 1e-6
+    with pytest.raises(ValueError):
+        parse_header(b'\x0a\x0d\x0d\x0a' + bytes(24))
+
+    # UDP checksum over the pseudo-header verifies to zero
+    packet = udp_packet(CLIENT, SERVER, b'abc')
+    pseudo = packet[8:40] + struct.pack('!I3xB', len(packet) - 40, 17)
+    assert pcap_file._checksum(pseudo + packet[40:]) == 0
+
+def test_ethernet(tmp_path):
+    """IPv4 in Ethernet, in big endian byte order, and a packet that is not
+       UDP."""
+    path  = tmp_path / 'eth.pcap'
+    ether = bytes(12) + b'\x08\x00'
+    udp   = udp_packet(('10.0.0.1', 40000), ('10.0.0.2', 5683),
+                       coap_msg.encode(coap_msg.NON, coap_msg.GET, 7, b'\x07'))
+    icmp  = udp[:9] + b'\x01' + udp[10:]
+    with open(str(path), 'wb') as f:
+        f.write(struct.pack('>IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for t, packet in ((5, udp), (6, icmp)):
+            f.write(struct.pack('>IIII', t, 250000, 14 + len(packet), 14 + len(packet)))
+            f.write(ether + packet)
+
+    trace = Trace.load(str(path))
+    assert trace.packets == 2
+    assert [m[:6] for m in trace.messages] == [(5.25, 0, 1, coap_msg.NON, coap_msg.GET, 7)]
+    assert trace.endpoints == ['10.0.0.1:40000', '10.0.0.2:5683']
+
+def test_retransmission(capture):
+    """CON request retransmitted twice, then a piggybacked response; and an
+       unanswered request."""
+    for t in (0.0, 2.5, 7.5):
+        capture(100 + t, True, coap_msg.CON, coap_msg.GET, 1, b'\x01',
+                coap_msg.path_options('/cli/stats'))
+    capture(107.6, False, coap_msg.ACK, coap_msg.CONTENT, 1, b'\x01', payload=b'7')
+    capture(110, True, coap_msg.CON, coap_msg.GET, 2, b'\x02')
+    # 'ping' has no token
+    capture(111, True, coap_msg.CON, coap_msg.EMPTY, 3)
+    capture(111.001, False, coap_msg.RST, coap_msg.EMPTY, 3)
+    capture.close()
+
+    trace = Trace.load(capture.path)
+    assert trace.packets == 7 and len(trace.messages) == 7
+    assert trace.endpoints == ['[fd00:bbbb::1]:40000', '[fd00:bbbb::2]:5683']
+
+    answered, lost = trace.exchanges()
+    assert answered.client == '[fd00:bbbb::1]:40000'
+    assert answered.attempts == pytest.approx([100, 102.5, 107.5])
+    assert answered.check_backoff() == []
+    assert answered.latency() == pytest.approx(7.6)
+    assert answered.reply_code == coap_msg.CONTENT
+    assert trace.message(answered.reply_index).payload == b'7'
+    assert lost.latency() is None and lost.response is None
+    assert trace.retransmissions() == 2
+
+    assert trace.by_mid()[(0, 1, 1)] == [0, 1, 2, 3]
+    assert trace.by_token()[(0, 1, b'\x02')] == [4]
+
+    fields, latency = trace.summary()
+    assert fields['requests'] == 2 and fields['responses'] == 1
+    assert fields['latency_count'] == 1
+
+def test_separate(capture):
+    """Empty ACK, then a separate CON response, retransmitted."""
+    capture(0, True, coap_msg.CON, coap_msg.GET, 10, b'ab')
+    capture(0.01, False, coap_msg.ACK, coap_msg.EMPTY, 10)
+    capture(0.5, False, coap_msg.CON, coap_msg.CONTENT, 500, b'ab')
+    capture(2.5, False, coap_msg.CON, coap_msg.CONTENT, 500, b'ab')
+    capture(2.51, True, coap_msg.ACK, coap_msg.EMPTY, 500)
+    capture.close()
+
+    trace    = Trace.load(capture.path)
+    exchange = trace.exchanges()[0]
+    assert exchange.response == pytest.approx(0.01)
+    assert exchange.latency() == pytest.approx(0.5)
+    assert exchange.notifications == []
+    assert trace.retransmissions() == 1
+
+def test_blocks(capture):
+    """Block1 transfer of 3 blocks, then Block2 transfer of 2 blocks."""
+    body = bytes(range(80))
+    for num in range(3):
+        block = body[num*32:(num+1)*32]
+        more  = num < 2
+        capture(num, True, coap_msg.CON, coap_msg.POST, 20 + num, bytes((num,)),
+                coap_msg.path_options('/sha256') +
+                [(coap_msg.BLOCK1, coap_msg.encode_block(num, more, 32))], block)
+        capture(num + 0.1, False, coap_msg.ACK,
+                coap_msg.CONTINUE if more else coap_msg.CHANGED, 20 + num, bytes((num,)),
+                [(coap_msg.BLOCK1, coap_msg.encode_block(num, more, 32))])
+    for num in range(2):
+        capture(10 + num, True, coap_msg.CON, coap_msg.GET, 30 + num, b'\x10',
+                coap_msg.path_options('/riot/ver') +
+                [(coap_msg.BLOCK2, coap_msg.encode_block(num, False, 16))])
+        capture(10.1 + num, False, coap_msg.ACK, coap_msg.CONTENT, 30 + num, b'\x10',
+                [(coap_msg.BLOCK2, coap_msg.encode_block(num, num == 0, 16)),
+                 (coap_msg.SIZE2, coap_msg.encode_uint(20))], body[num*16:num*16+16][:20-num*16])
+    capture.close()
+
+    block1, block2 = Trace.load(capture.path).block_transfers()
+    assert (block1.kind, block1.path, len(block1.exchanges)) == ('block1', 'sha256', 3)
+    assert block1.complete and block1.size == 80
+    assert block1.elapsed() == pytest.approx(2.1)
+    assert (block2.kind, block2.path, len(block2.exchanges)) == ('block2', 'riot/ver', 2)
+    assert block2.complete and block2.size == 20
+
+def test_observe(capture):
+    """Registration, then NON notifications, one reordered; and a filter by
+       port that excludes them all."""
+    capture(0, True, coap_msg.CON, coap_msg.GET, 40, b'ob',
+            [(coap_msg.OBSERVE, b'')] + coap_msg.path_options('/cli/stats'))
+    capture(0.01, False, coap_msg.ACK, coap_msg.CONTENT, 40, b'ob',
+            [(coap_msg.OBSERVE, coap_msg.encode_uint(1))], b'0')
+    for i, seq in enumerate([2, 4, 3, 5]):
+        capture(1 + i, False, coap_msg.NON, coap_msg.CONTENT, 600 + i, b'ob',
+                [(coap_msg.OBSERVE, coap_msg.encode_uint(seq))], b'x')
+    capture.close()
+
+    trace    = Trace.load(capture.path)
+    exchange = trace.exchanges()[0]
+    assert [seq for t, seq in exchange.notifications] == [2, 4, 3, 5]
+    sequence = exchange.observe_sequence()
+    assert (sequence.received, sequence.reordered) == (5, 1)
+    assert trace.summary()[0]['notifications'] == 4
+
+    assert Trace.load(capture.path, ports=[5684]).messages == []
+
+@pytest.mark.benchmark
+def test_decode_rate(tmp_path):
+    """Decodes a capture of a million packets, request and response pairs
+       with Observe and Block2 options, in a few seconds."""
+    token    = b'\x00\x00\x00\x00'
+    request  = udp_packet(CLIENT, SERVER, coap_msg.encode(
+                          coap_msg.CON, coap_msg.GET, 0, token,
+                          coap_msg.path_options('/cli/stats')))
+    response = udp_packet(SERVER, CLIENT, coap_msg.encode(
+                          coap_msg.ACK, coap_msg.CONTENT, 0, token,
+                          [(coap_msg.OBSERVE, b'\x01'), (coap_msg.CONTENT_FORMAT, b''),
+                           (coap_msg.BLOCK2, coap_msg.encode_block(0, False, 64))],
+                          bytes(40)))
+    # message ID and token follow the IPv6, UDP and CoAP headers; checksums
+    # are not verified
+    path   = str(tmp_path / 'rate.pcap')
+    writer = PcapWriter(path, autoflush=False)
+    for i in range(500000):
+        mid_token = (i & 0xFFFF).to_bytes(2, 'big') + i.to_bytes(4, 'big')
+        writer.write(request[:50] + mid_token + request[56:], i * 1e-3)
+        writer.write(response[:50] + mid_token + response[56:], i * 1e-3 + 5e-4)
+    writer.close()
+
+    start     = time.monotonic()
+    trace     = Trace.load(path)
+    decoded   = time.monotonic() - start
+    exchanges = trace.exchanges()
+    analyzed  = time.monotonic() - start
+    logging.info('Decoded {0} packets in {1:.2f} s, with exchanges in {2:.2f} s'.format(
+                 trace.packets, decoded, analyzed))
+    assert len(trace.messages) == 1000000 and len(exchanges) == 500000
+    assert exchanges[-1].latency() == pytest.approx(5e-4)
+    assert trace.retransmissions() == 0
+    assert analyzed < 15
@@ -7,45 +7,90 @@
 """
 Tests CoAP confirmable message retry capability.
 
-Sends a GET request from gcoap to a libcoap server that ignores a configurable
-number of requests.
+Sends a GET request from gcoap to a libcoap server, through impair_proxy.py,
+which drops a configurable number of requests.
 
 Requires:
    - RIOTBASE env variable for RIOT root directory
 
-   - Network with ULA fd00:bbbb::1/64
+   - Network with ULA fd00:bbbb::1/64, or as allocated by conftest.NetAllocator
 """
 
 import pytest
-import pexpect
 import logging
+import time
 
-from conftest import proto_params
+from coap_results import ResultReader
+from con_timing import max_transmit_wait, wait_exchange
+from conftest import drop_requests, net, proto_params, proto_port, riot_time
 
 logging.basicConfig(level=logging.INFO, filename='con_retry.log')
 
+# seconds gcoap may report a timeout before or after predicted, for timer
+# granularity and terminal output
+GIVE_UP_TOLERANCE = 1.0
+
 #
 # fixtures and utility functions
 #
 
+@pytest.fixture(scope='session')
+def libcoap_port(net_segment):
+    """Runs libcoap_server on the alternative port, behind impair_proxy."""
+    return str(net_segment.alt_port)
+
+def get_cmd():
+    return 'coap get -c {0} {1} /time'.format(net.remote_addr, proto_port(net.port))
+
 def send_recv(client):
-    client.send_recv('coap get -c fd00:bbbb::1 {0} /time'.format(proto_params['port']),
-                     r'\w+ \w+ \d+:\d+:')
+    client.send_recv(get_cmd(), r'\w+ \w+ \d+:\d+:')
+
+def give_up_time():
+    """Provides seconds to wait for gcoap to give up on a request, for its
+       ACK_TIMEOUT at TIME_SCALE, with allowance for DTLS session setup."""
+    return max_transmit_wait(riot_time['COAP_ACK_TIMEOUT']) + 10
 
 #
 # tests
 #
 
-@pytest.mark.parametrize('libcoap_ignore_count', [2])
-def test_recover(libcoap_server, gcoap_example):
-    """Recover from 2 ignored requests and receive time value."""
+@pytest.mark.parametrize('impair_spec', [(drop_requests(2), '')])
+def test_recover(libcoap_server, impair_proxy, gcoap_example, tmp_path):
+    """Recover from 2 ignored requests and receive time value. For UDP,
+       retransmissions follow the exponential backoff."""
 
     send_recv(gcoap_example)
 
-@pytest.mark.parametrize('libcoap_ignore_count', [5])
-def test_timeout(libcoap_server, gcoap_example):
-    """Times out from 5 ignored requests."""
-    gcoap_example.timeout = 100
+    if not proto_params['is_dtls']:
+        exchange = wait_exchange(ResultReader(str(tmp_path / 'impair.jsonl')), 3,
+                                 response=True, timeout=5)
+        logging.info(exchange)
+        assert len(exchange.attempts) == 3
+        assert exchange.check_backoff(ack_timeout=riot_time['COAP_ACK_TIMEOUT']) == []
+
+@pytest.mark.parametrize('impair_spec', [(drop_requests(5), '')])
+def test_timeout(libcoap_server, impair_proxy, gcoap_example, tmp_path):
+    """Times out from 5 ignored requests. For UDP, the retransmissions follow
+       the exponential backoff, and gcoap reports the timeout when predicted
+       from them. The proxy cannot read DTLS messages, so for DTLS only waits
+       for gcoap to report the timeout. Either way the request is finished
+       before the pooled gcoap host is reused."""
+    gcoap_example.term.sendline(get_cmd())
+    if proto_params['is_dtls']:
+        gcoap_example.term.expect(r'gcoap: timeout', give_up_time())
+        return
+
+    exchange = wait_exchange(ResultReader(str(tmp_path / 'impair.jsonl')), 5,
+                             timeout=give_up_time())
+    logging.info(exchange)
+    assert exchange.check_backoff(ack_timeout=riot_time['COAP_ACK_TIMEOUT']) == []
+    assert exchange.response is None
 
-    with pytest.raises(pexpect.TIMEOUT):
-        send_recv(gcoap_example)
+    predicted = exchange.give_up()
+    gcoap_example.term.expect(r'gcoap: timeout',
+                              max(exchange.attempts[0] + predicted - time.time(), 0)
+                              + GIVE_UP_TOLERANCE)
+    measured = time.time() - exchange.attempts[0]
+    logging.info('gcoap gave up after {0:.3f} s; predicted {1:.3f} s'.format(measured,
+                                                                          predicted))
+    assert abs(measured - predicted) <= GIVE_UP_TOLERANCE
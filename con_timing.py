@@ -0,0 +1,153 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Analyzes confirmable message retransmission, from the packet log written by
+impair_proxy.py. Groups the transmissions of a CON request by client and
+message ID, and verifies the intervals between them against the RFC 7252
+exponential backoff: the first timeout is random from ACK_TIMEOUT to
+ACK_TIMEOUT * ACK_RANDOM_FACTOR, and each following timeout doubles, for at
+most MAX_RETRANSMIT retransmissions.
+
+Times are from the proxy's receipt of each packet. The proxy cannot decode
+messages protected by DTLS, so analyze plain UDP only.
+"""
+
+import collections
+import time
+
+import coap_msg
+
+# transmission parameters, RFC 7252 section 4.8; defaults for gcoap too
+ACK_TIMEOUT       = 2.0
+ACK_RANDOM_FACTOR = 1.5
+MAX_RETRANSMIT    = 4
+
+def max_transmit_wait(ack_timeout=ACK_TIMEOUT):
+    """Provides the longest time from the first transmission of a CON request
+       until the client gives up, MAX_TRANSMIT_WAIT in RFC 7252."""
+    return ack_timeout * (2 ** (MAX_RETRANSMIT + 1) - 1) * ACK_RANDOM_FACTOR
+
+class ConExchange():
+    """Transmissions of a CON request, and the response to it."""
+
+    def __init__(self, client, mid, token):
+        self.client   = client
+        self.mid      = mid
+        self.token    = token
+        # times of each transmission, in seconds since the epoch
+        self.attempts = []
+        # time of the ACK or RST, or None
+        self.response = None
+
+    def intervals(self):
+        """Provides the seconds between each transmission and the next."""
+        return [b - a for a, b in zip(self.attempts, self.attempts[1:])]
+
+    def elapsed(self):
+        """Provides seconds from the first transmission until the response, or
+           None if no response."""
+        return self.response - self.attempts[0] if self.response else None
+
+    def give_up(self):
+        """
+        Predicts seconds from the first transmission until the client gives up,
+        after the timeout for its last retransmission, from the first
+        interval. None until there is a retransmission.
+        """
+        intervals = self.intervals()
+        if not intervals:
+            return None
+        return intervals[0] * (2 ** (MAX_RETRANSMIT + 1) - 1)
+
+    def check_backoff(self, tolerance=0.2, ack_timeout=ACK_TIMEOUT):
+        """
+        Verifies the intervals between transmissions follow the exponential
+        backoff.
+
+        :param float tolerance: Seconds an interval may differ from expected,
+                                for timer granularity and scheduling
+        :param float ack_timeout: The client's ACK_TIMEOUT, like for a RIOT app
+                                  built with a TIME_SCALE
+        :return: list of problem descriptions; empty if none
+        """
+        problems  = []
+        intervals = self.intervals()
+        if len(intervals) > MAX_RETRANSMIT:
+            problems.append('{0} retransmissions, more than {1}'.format(
+                            len(intervals), MAX_RETRANSMIT))
+        if not intervals:
+            return problems
+
+        first = intervals[0]
+        if not ack_timeout - tolerance <= first <= \
+                ack_timeout * ACK_RANDOM_FACTOR + tolerance:
+            problems.append('first timeout {0:.3f} s, expected {1} to {2} s'.format(
+                            first, ack_timeout, ack_timeout * ACK_RANDOM_FACTOR))
+        for i, interval in enumerate(intervals[1:], 1):
+            expected = first * 2 ** i
+            if abs(interval - expected) > tolerance:
+                problems.append('timeout {0} {1:.3f} s, expected {2:.3f} s'.format(
+                                i + 1, interval, expected))
+        return problems
+
+    def __str__(self):
+        text = 'MID {0}: {1} transmissions, intervals {2} s'.format(
+               self.mid, len(self.attempts),
+               ' '.join('{0:.3f}'.format(i) for i in self.intervals()) or '-')
+        if self.response:
+            return text + '; response after {0:.3f} s'.format(self.elapsed())
+        give_up = self.give_up()
+        return text + '; no response' + \
+               ('; gives up after {0:.3f} s'.format(give_up) if give_up else '')
+
+
+def con_exchanges(records):
+    """
+    Groups the CON requests in a packet log by client and message ID. Counts a
+    request dropped by the proxy as a transmission, since the client sent it,
+    but not a dropped response.
+
+    :return: list of ConExchange, in order of first transmission
+    """
+    exchanges = collections.OrderedDict()
+    for record in records:
+        if 'mid' not in record:
+            continue
+        key = (record['client'], record['mid'])
+        if record['dir'] == 'up':
+            if record['mtype'] == coap_msg.CON and record['code'] != '0.00':
+                if key not in exchanges:
+                    exchanges[key] = ConExchange(record['client'], record['mid'],
+                                                 record['token'])
+                exchanges[key].attempts.append(record['t'])
+        elif record['mtype'] in (coap_msg.ACK, coap_msg.RST) and key in exchanges \
+                and record['action'] != 'drop' and exchanges[key].response is None:
+            exchanges[key].response = record['t']
+    return list(exchanges.values())
+
+def wait_exchange(reader, transmissions, response=False, timeout=60, interval=0.05):
+    """
+    Reads a packet log until the first CON exchange has the count of
+    transmissions, and a response if requested. So a test may finish as soon
+    as the pattern it expects is complete.
+
+    :param reader: ResultReader for the log
+    :return: ConExchange
+    :raises TimeoutError: if the pattern is not complete within the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        reader.read()
+        exchanges = con_exchanges(reader.records)
+        if exchanges and len(exchanges[0].attempts) >= transmissions \
+                and (exchanges[0].response or not response):
+            return exchanges[0]
+        if time.monotonic() >= deadline:
+            raise TimeoutError('Expected {0} transmissions{1}; found {2}'.format(
+                               transmissions, ' and response' if response else '',
+                               exchanges[0] if exchanges else 'none'))
+        time.sleep(interval)
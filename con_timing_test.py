@@ -0,0 +1,68 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests CON retransmission analysis with a synthetic packet log. Does not
+require RIOT.
+"""
+
+import pytest
+
+import coap_msg
+from coap_results import ResultReader, ResultWriter
+from con_timing import con_exchanges, max_transmit_wait, wait_exchange
+
+#
+# fixtures and utility functions
+#
+
+def packet(t, direction, mtype, mid, code='0.01', action='forward'):
+    return {'t': t, 'dir': direction, 'client': '[::1]:5683', 'num': 1, 'size': 10,
+            'action': action, 'mtype': mtype, 'code': code, 'mid': mid, 'token': '01'}
+
+#
+# tests
+#
+
+def test_backoff():
+    """Retransmissions that double the first timeout pass; a response ends
+       the exchange."""
+    records = [packet(t, 'up', coap_msg.CON, 7, action='drop') for t in (100, 102.5, 107.5)]
+    records.append(packet(107.6, 'down', coap_msg.ACK, 7, '2.05'))
+    exchange, = con_exchanges(records)
+    assert exchange.intervals() == pytest.approx([2.5, 5.0])
+    assert exchange.check_backoff() == []
+    # a client built with a shorter ACK_TIMEOUT, for TIME_SCALE
+    assert exchange.check_backoff(ack_timeout=1)[0].startswith('first timeout')
+    assert exchange.elapsed() == pytest.approx(7.6)
+    assert 'response after 7.600 s' in str(exchange)
+
+def test_transmit_wait():
+    assert max_transmit_wait() == pytest.approx(93)
+    assert max_transmit_wait(1) == pytest.approx(46.5)
+
+def test_bad_backoff():
+    """A constant interval, and too many retransmissions, are problems."""
+    records = [packet(100 + 2 * i, 'up', coap_msg.CON, 8) for i in range(6)]
+    # a dropped response does not end the exchange
+    records.append(packet(111, 'down', coap_msg.ACK, 8, '2.05', action='drop'))
+    exchange, = con_exchanges(records)
+    problems = exchange.check_backoff()
+    assert len(problems) == 5
+    assert problems[0].startswith('5 retransmissions')
+    assert exchange.response is None
+    assert exchange.give_up() == pytest.approx(62)
+
+def test_wait(tmp_path):
+    path    = str(tmp_path / 'impair.jsonl')
+    results = ResultWriter(path)
+    results.write(**packet(100, 'up', coap_msg.CON, 9))
+    results.write(**packet(102, 'up', coap_msg.CON, 9))
+    results.close()
+
+    assert len(wait_exchange(ResultReader(path), 2, timeout=0.1).attempts) == 2
+    with pytest.raises(TimeoutError):
+        wait_exchange(ResultReader(path), 2, response=True, timeout=0.1)
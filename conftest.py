@@ -8,12 +8,25 @@
 Utilities for tests
 """
 
+import asyncio
+import concurrent.futures
+import contextlib
 import pytest
 import pexpect
 import os
+import re
 import signal
+import socket
+import threading
 import logging
 
+from collections import namedtuple
+from coap_results import ResultReader
+from host_capture import CaptureSpawn
+from host_reaper import Reaper
+from readiness import banner, coap_ping, wait_ready
+from riot_build import BuildCache, time_cflags, time_params
+
 class ExpectHost():
     """
     A networking host wrapped in a pexpect spawn. There are two ways to run
@@ -21,47 +34,70 @@ class ExpectHost():
 
     1. connect() to start an interactive session, followed by send_recv() or
        directly sending commands from the returned pexpect 'term' object.
-       Finally, use disconnect() to kill the session.
+       Finally, use disconnect() to kill the session. disconnect(True) hands
+       the process to the session reaper, which stops it in the background
+       and tracks when the host's resources are free again.
 
     2. run() to start and run the process to completion with no interaction.
+
+    For connect(), host output is captured with a CaptureSpawn, which tees it
+    to a rotating log in the HOST_LOG_DIR directory, 'host_logs' by default.
+    Set HOST_LOG_DIR to '0' to use a plain pexpect spawn instead.
     """
 
-    def __init__(self, folder, term_cmd, putenv={}, timeout=10):
+    def __init__(self, folder, term_cmd, putenv={}, timeout=10, resources=()):
         """
         :putenv: Additional entries for os.environ dictionary to pass to
                  spawned process
+        :resources: Names of resources held by the process, like 'tap0' or
+                    'udp/5683'; see host_reaper
         """
         self.folder   = folder
         self.term     = None
         self.term_cmd = term_cmd
         self.timeout  = timeout
         self.putenv   = putenv
+        self.resources = resources
+        self.initial_timeout = timeout
 
     def connect(self):
         """
-        Starts OS host process.
+        Starts OS host process, in the host folder. Does not change the working
+        directory of this process, so hosts may be started concurrently.
 
         :return: pexpect spawn object; the 'term' attribute for ExpectHost
         """
-        if self.folder:
-            os.chdir(self.folder)
-
-        self.term = pexpect.spawnu(self.term_cmd, timeout=self.timeout,
-                                   env=self._build_env(), codec_errors='replace')
+        log_dir = os.environ.get('HOST_LOG_DIR', 'host_logs')
+        if log_dir == '0':
+            self.term = pexpect.spawnu(self._build_cmd(), timeout=self.timeout,
+                                       cwd=self.folder, env=self._build_env(),
+                                       codec_errors='replace')
+        else:
+            self.term = CaptureSpawn(self._build_cmd(), timeout=self.timeout,
+                                     cwd=self.folder, env=self._build_env(),
+                                     codec_errors='replace',
+                                     log_path=os.path.join(log_dir, self._log_name()))
         return self.term
 
     def run(self):
         """
-        Runs OS host process to completion
+        Runs OS host process to completion, in the host folder.
 
         :return: String output from process
         """
-        if self.folder:
-            os.chdir(self.folder)
-        return pexpect.run(self.term_cmd, env=self._build_env())
+        return pexpect.run(self._build_cmd(), cwd=self.folder, env=self._build_env())
 
-    def disconnect(self):
-        """Kill OS host process"""
+    def disconnect(self, background=False):
+        """
+        Kill OS host process
+
+        :param bool background: If True, return immediately and stop the
+                                process gracefully with the reaper. Use
+                                reaper.wait_free() to wait for its resources.
+        """
+        if background:
+            reaper.reap(self.term, self.resources)
+            return
         try:
             os.killpg(os.getpgid(self.term.pid), signal.SIGKILL)
         except ProcessLookupError:
@@ -73,6 +109,32 @@ class ExpectHost():
         self.term.sendline(out_text)
         self.term.expect(in_text, self.timeout)
 
+    def drain(self):
+        """Discards pending output from the host, so a later expect() does
+           not match text from an earlier test."""
+        try:
+            while True:
+                self.term.read_nonblocking(self.term.maxread, timeout=0)
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            pass
+        self.term.buffer = self.term.string_type()
+
+    def _log_name(self):
+        """Builds the file name for the host output log, from the folder or the
+           command."""
+        name = os.path.basename(os.path.normpath(self.folder)) if self.folder \
+               else os.path.basename(self.term_cmd.split(' ')[0])
+        return name + '-{pid}.log'
+
+    def _build_cmd(self):
+        """Builds the command to spawn. pexpect finds a relative executable
+           path from the working directory of this process, so make the path
+           relative to the host folder."""
+        exe, sep, args = self.term_cmd.partition(' ')
+        if self.folder and '/' in exe and not os.path.isabs(exe):
+            exe = os.path.join(self.folder, exe)
+        return exe + sep + args
+
     def _build_env(self):
         """Builds full os.environ dictionary if putenv instance variable has
            been defined."""
@@ -82,6 +144,143 @@ class ExpectHost():
             env.update(self.putenv)
         return env
 
+
+class AsyncExpectHost(ExpectHost):
+    """
+    Asyncio counterpart to ExpectHost. Reads from the host's pty without
+    blocking, so a single event loop may drive many hosts concurrently, like:
+
+        await asyncio.gather(*[host.send_recv('ping6 ...', 'bytes from')
+                               for host in hosts])
+
+    Must be used from within a running event loop.
+    """
+
+    async def connect(self):
+        """
+        Starts OS host process. Spawns the process in a worker thread, so it
+        does not block the event loop.
+
+        :return: pexpect spawn object; the 'term' attribute for ExpectHost
+        """
+        loop = asyncio.get_running_loop()
+        term = await loop.run_in_executor(None, super().connect)
+        # sendline() sleeps for this delay; instead sleep without blocking
+        self.send_delay = term.delaybeforesend or 0
+        term.delaybeforesend = None
+        return term
+
+    async def run(self):
+        """
+        Runs OS host process to completion
+
+        :return: bytes output from process
+        """
+        proc = await asyncio.create_subprocess_shell(self.term_cmd, cwd=self.folder,
+                                                     env=self._build_env(),
+                                                     stdout=asyncio.subprocess.PIPE,
+                                                     stderr=asyncio.subprocess.STDOUT)
+        output, _ = await proc.communicate()
+        return output
+
+    async def disconnect(self, background=False):
+        """Kill OS host process"""
+        super().disconnect(background)
+
+    async def send_recv(self, out_text, in_text):
+        """Sends the given text to the host, and expects the given text
+           response."""
+        await asyncio.sleep(self.send_delay)
+        self.term.sendline(out_text)
+        await self.expect(in_text)
+
+    async def expect(self, pattern, timeout=-1):
+        """
+        Waits for host output that matches the pattern, like pexpect
+        spawn.expect().
+
+        Implemented with an event loop reader on the pty, or a callback from
+        CaptureSpawn, rather than pexpect's own async_ option, which does not
+        support recent Python versions.
+
+        :param float timeout: Seconds to wait; defaults to host timeout
+        :return: index of the matched pattern, if pattern is a list
+        """
+        if timeout == -1:
+            timeout = self.timeout
+        loop     = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        patterns = self.term.compile_pattern_list(pattern)
+
+        while True:
+            # match against output already available, without blocking
+            try:
+                return self.term.expect_list(patterns, timeout=0)
+            except pexpect.TIMEOUT:
+                if deadline is not None and loop.time() >= deadline:
+                    raise
+
+            readable = loop.create_future()
+            def on_readable():
+                if not readable.done():
+                    readable.set_result(None)
+            # a CaptureSpawn reads the pty in its own thread
+            is_capture = isinstance(self.term, CaptureSpawn)
+            if is_capture:
+                callback = lambda: loop.call_soon_threadsafe(on_readable)
+                self.term.add_data_callback(callback)
+            else:
+                loop.add_reader(self.term.child_fd, on_readable)
+            try:
+                await asyncio.wait_for(readable, None if deadline is None
+                                                 else deadline - loop.time())
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                # remove on timeout or cancellation, so the callback does not
+                # outlive the loop, like for a pooled host
+                if is_capture:
+                    self.term.remove_data_callback(callback)
+                else:
+                    loop.remove_reader(self.term.child_fd)
+
+    async def wait_exit(self, timeout=None):
+        """Waits for the host process to finish its output and exit, without
+           polling."""
+        await self.expect(pexpect.EOF, timeout)
+
+# Set the TIME_SCALE environment variable below 1 to compress protocol time,
+# like 0.1 for lifetimes and retransmission timeouts ten times shorter. RIOT
+# apps are built with the scaled parameters in riot_time, through CFLAGS; see
+# pytest_configure(). Tests wait for scaled deadlines.
+time_scale = float(os.environ.get('TIME_SCALE', '1'))
+riot_time  = time_params(time_scale)
+
+def scaled(seconds):
+    """Scales a protocol time, in seconds, for TIME_SCALE."""
+    return seconds * time_scale
+
+# Native RIOT apps, built once and then started directly
+build_cache = BuildCache()
+
+# Stops hosts in the background; see ExpectHost.disconnect()
+reaper = Reaper(float(os.environ.get('REAP_GRACE', '1')))
+
+# RIOT app used by each fixture, as (base folder environment variable, path).
+# Key is the fixture name, or 'module::fixture' if the fixture name is shared
+# by modules for different apps. Used to build apps up front for a session.
+riot_apps = {
+    'gcoap_example'            : ('RIOTBASE', 'examples/gcoap'),
+    'nanocoap_server'          : ('RIOTBASE', 'examples/nanocoap_server'),
+    'nanocoap_cli'             : ('RIOTBASE', 'tests/nanocoap_cli'),
+    'cord_ep_test::cord_cli'   : ('RIOTBASE', 'examples/cord_ep'),
+    'cord_epsim_test::cord_cli': ('RIOTBASE', 'examples/cord_epsim'),
+    'block_server'             : ('RIOTAPPSBASE', 'gcoap-block-server'),
+    'pkt_block_server'         : ('RIOTAPPSBASE', 'gcoap-block-server'),
+    'nano_block_client'        : ('RIOTAPPSBASE', 'nano-block-client'),
+    'gcoap_block_client'       : ('RIOTAPPSBASE', 'gcoap-block-client'),
+}
+
 # Protocol level parameters -- DTLS vs. UDP
 proto_params = {}
 if (os.environ.get('TRANSPORT_PROTOCOL', 'UDP') == 'DTLS'):
@@ -97,131 +296,666 @@ else:
     proto_params['port'] = 5683
     proto_params['session_setup_msgs'] = 0
 
+def proto_port(port):
+    """Provides the port for the transport protocol, given the plain UDP
+       port. By convention, the DTLS port is one more than the UDP port."""
+    return int(port) + (1 if proto_params['is_dtls'] else 0)
 
-@pytest.fixture
-def gcoap_example():
+
+class NetSegment(namedtuple('NetSegment', ['prefix', 'remote_addr', 'sut_addr',
+                                           'tap', 'tap_remote', 'port',
+                                           'alt_port', 'sut_port'])):
     """
-    Runs the RIOT gcoap CLI example as an ExpectHost. Uses BOARD environment
-    variable to run on real hardware.
+    Network addressing for one test worker. All ports are plain UDP ports; use
+    proto_port() for the DTLS equivalent.
+
+    :prefix:      /64 prefix for the worker's ULA network, like 'fd00:bbbb::'
+    :remote_addr: Address for the remote endpoint; the OS, or the peer RIOT
+                  instance for native2native tests
+    :sut_addr:    Address for the system under test
+    :tap:         Interface for the SUT, or None for loopback
+    :tap_remote:  Interface for the peer RIOT instance, or None for loopback
+    :port:        Port for a server at remote_addr, like libcoap_server
+    :alt_port:    Alternative port at remote_addr, for a second server
+    :sut_port:    Port for a server in the SUT, or in the peer RIOT instance
+    """
+    __slots__ = ()
+
+    def sut_host(self):
+        """Provides the SUT host for a URI, including port for the transport
+           protocol."""
+        return '[{0}]:{1}'.format(self.sut_addr, proto_port(self.sut_port))
+
+
+class NetAllocator():
     """
-    base_folder = os.environ.get('RIOTBASE', None)
-    board       = os.environ.get('BOARD', 'native')
+    Allocates a separate network segment to each test worker, so workers may
+    run in parallel. Worker 0 uses the fd00:bbbb::/64 network on tap0 and
+    tap1, and ports from 5683. Worker n uses fd00:bbbb:0:n::/64 on tap(2n) and
+    tap(2n+1), and ports offset by n * PORT_STRIDE.
+
+    In 'loopback' mode, all endpoints use ::1 with no tap interface. Only
+    ports vary between workers, so Python stand-in endpoints may exercise
+    parallel execution without RIOT.
+    """
+    PORT_BASE   = 5683
+    PORT_STRIDE = 10
+
+    def __init__(self, mode='tap'):
+        if mode not in ('tap', 'loopback'):
+            raise ValueError('Unknown network mode: {0}'.format(mode))
+        self.mode = mode
+
+    def segment(self, worker):
+        """Provides the NetSegment for a worker index."""
+        base = self.PORT_BASE + worker * self.PORT_STRIDE
+        if self.mode == 'loopback':
+            return NetSegment('::1', '::1', '::1', None, None, base, base + 2,
+                              base + 4)
+
+        prefix = 'fd00:bbbb:0:{0:x}::'.format(worker) if worker else 'fd00:bbbb::'
+        return NetSegment(prefix, prefix + '1', prefix + '2',
+                          'tap{0}'.format(2 * worker), 'tap{0}'.format(2 * worker + 1),
+                          base, base + 2, self.PORT_BASE)
+
+def worker_index():
+    """Provides the index of the pytest-xdist worker running this process,
+       or 0 if not run with xdist."""
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'gw0')
+    return int(worker.lstrip('gw') or 0)
+
+# Network segment for this worker. Select the allocator mode with the NET_MODE
+# environment variable, 'tap' by default.
+net = NetAllocator(os.environ.get('NET_MODE', 'tap')).segment(worker_index())
+
+
+class HostPool():
+    """
+    Session-wide pool of long running RIOT hosts, keyed by name. Keeps each
+    host alive across tests rather than rebuilding and rebooting it for every
+    test. Only one host may own a network interface (tap or serial port) at a
+    time, so acquiring a host for an interface evicts any other host on it.
+
+    Between uses, a pooled host is reset cheaply with a caller provided check
+    function, which probes the host's health and addressing. The host is
+    restarted only if the check fails.
+
+    Set the RIOT_HOST_POOL environment variable to '0' to disable reuse, so a
+    host is disconnected at release, as for a standalone fixture.
+
+    Evicted hosts are stopped in the background by the reaper. A new host
+    for the interface starts as soon as the evicted host releases it.
+    """
+
+    def __init__(self, reuse=True):
+        self.reuse  = reuse
+        # key: interface name, value: (host name, ExpectHost)
+        self._hosts = {}
+
+    def acquire(self, name, start, check=None, iface='tap0'):
+        """
+        Provides a running host, reusing a pooled host if healthy.
+
+        :param string name: Identifies the kind of host, like 'gcoap_example'
+        :param start: Function with no arguments that starts and configures a
+                      new host; returns the ExpectHost
+        :param check: Function that accepts an ExpectHost and raises a pexpect
+                      exception if the host is not healthy
+        :param string iface: Network interface used by the host
+        :return: ExpectHost
+        """
+        return self.acquire_all([(name, start, check, iface)])[0]
+
+    def acquire_all(self, specs):
+        """
+        Provides a set of running hosts, like acquire(). Starts any new hosts
+        concurrently, so setup takes the time of the slowest host rather than
+        the sum of them.
+
+        :param specs: Sequence of (name, start, check, iface) tuples, with
+                      elements as for the acquire() parameters
+        :return: list of ExpectHost, in order of specs
+        """
+        hosts   = [None] * len(specs)
+        pending = []
+        for i, (name, start, check, iface) in enumerate(specs):
+            entry = self._hosts.get(iface)
+            if entry and entry[0] == name:
+                if self._reset(entry[1], check):
+                    hosts[i] = entry[1]
+                    continue
+                logging.info('Restarting unhealthy host {0}'.format(name))
+            self.evict(iface)
+            pending.append(i)
+
+        reaper.wait_free([specs[i][3] for i in pending])
+        started = start_hosts([specs[i][1] for i in pending])
+        for i, host in zip(pending, started):
+            host.resources = (specs[i][3],)
+            self._hosts[specs[i][3]] = (specs[i][0], host)
+            hosts[i] = host
+        return hosts
+
+    def release(self, *hosts):
+        """Returns hosts to the pool after use by a test, like all of those
+           from acquire_all()."""
+        if not self.reuse:
+            for iface, entry in list(self._hosts.items()):
+                if entry[1] in hosts:
+                    self.evict(iface)
+
+    def evict(self, iface):
+        """Disconnects any pooled host that uses the provided interface, in
+           the background."""
+        entry = self._hosts.pop(iface, None)
+        if entry:
+            entry[1].disconnect(True)
+
+    def claim(self, iface):
+        """Evicts any pooled host that uses the provided interface, and waits
+           until the interface is free, for use by a host outside the pool."""
+        self.evict(iface)
+        reaper.wait_free([iface])
+
+    def close(self):
+        """Disconnects all pooled hosts."""
+        for iface in list(self._hosts):
+            self.evict(iface)
+
+    def _reset(self, host, check):
+        """Restores a pooled host to a known state for the next test.
+
+        :return: True if host is healthy
+        """
+        host.timeout = host.initial_timeout
+        if not host.term.isalive():
+            return False
+        host.drain()
+        if check:
+            try:
+                check(host)
+            except (pexpect.TIMEOUT, pexpect.EOF):
+                return False
+        return True
+
+
+def start_hosts(starts):
+    """
+    Starts hosts concurrently, each in a worker thread. Returns when all hosts
+    are ready.
+
+    :param starts: Sequence of functions with no arguments, each of which
+                   starts and configures a host; returns the ExpectHost
+    :return: list of ExpectHost, in order of starts
+    :raises: the first exception from a start function, after disconnecting
+             the hosts that did start
+    """
+    if not starts:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(len(starts)) as pool:
+        futures = [pool.submit(start) for start in starts]
+
+    hosts, error = [], None
+    for future in futures:
+        try:
+            hosts.append(future.result())
+        except Exception as e:
+            error = error or e
+    if error:
+        for host in hosts:
+            host.disconnect()
+        raise error
+    return hosts
+
+def riot_term_cmd(folder, putenv={}):
+    """Provides the command to start a RIOT app with a terminal, via the
+       build cache."""
+    return build_cache.term_cmd(folder, riot_iface(putenv))
+
+def riot_iface(putenv={}):
+    """Provides the name of the network interface, or serial port, for a RIOT
+       host spawned with the provided environment additions."""
+    return putenv.get('PORT', os.environ.get('PORT', net.tap or 'tap0'))
+
+def check_shell(host, ula=None):
+    """
+    Cheap health check for a pooled RIOT host with a shell. Verifies the shell
+    responds, and that the expected ULA remains assigned.
+
+    :param string ula: Address expected in ifconfig output; if None, only
+                       verifies the shell responds
+    """
+    if ula:
+        host.send_recv('ifconfig', re.escape(ula))
+    else:
+        host.send_recv('help', 'Command')
+
+
+@pytest.fixture(scope='session')
+def host_pool():
+    """Provides the session-wide pool of RIOT hosts."""
+    pool = HostPool(os.environ.get('RIOT_HOST_POOL', '1') != '0')
+    yield pool
+
+    # teardown
+    pool.close()
+
+
+def _start_gcoap_example():
+    """Starts the gcoap example host and sets its ULA."""
+    folder = os.path.join(os.environ.get('RIOTBASE', None), 'examples/gcoap')
+    board  = os.environ.get('BOARD', 'native')
 
     if board == 'native':
-        term_cmd = 'make term'
+        term_cmd = riot_term_cmd(folder)
         term_resp = 'gcoap .* app'
     else:
         term_cmd = 'make term BOARD="{0}"'.format(board)
         term_resp = 'Welcome to pyterm!'
         
-    host = ExpectHost(os.path.join(base_folder, 'examples/gcoap'), term_cmd)
+    host = ExpectHost(folder, term_cmd)
     term = host.connect()
     term.expect(term_resp)
 
     # set ULA
     if board == 'native':
         pid = '5' if proto_params['is_dtls'] else '6'
-        host.send_recv('ifconfig {0} add unicast fd00:bbbb::2/64'.format(pid),
+        host.send_recv('ifconfig {0} add unicast {1}/64'.format(pid, net.sut_addr),
                        'success:')
     else:
-        host.send_recv('ifconfig 8 add unicast fd00:bbbb::2/64',
+        host.send_recv('ifconfig 8 add unicast {0}/64'.format(net.sut_addr),
                         'success:')
-        term.sendline('nib neigh add 8 fd00:bbbb::1')
-        host.send_recv('nib neigh', 'fd00:bbbb::1')
+        term.sendline('nib neigh add 8 {0}'.format(net.remote_addr))
+        host.send_recv('nib neigh', net.remote_addr)
+    return host
+
+@pytest.fixture
+def gcoap_example(host_pool):
+    """
+    Runs the RIOT gcoap CLI example as an ExpectHost. Uses BOARD environment
+    variable to run on real hardware.
+    """
+    host = host_pool.acquire('gcoap_example', _start_gcoap_example,
+                             lambda h: check_shell(h, net.sut_addr), riot_iface())
     yield host
 
     # teardown
-    host.disconnect()
+    host_pool.release(host)
+
+
+def _start_nanocoap_server():
+    folder = os.path.join(os.environ.get('RIOTBASE', None), 'examples/nanocoap_server')
 
+    host = ExpectHost(folder, riot_term_cmd(folder))
+    term = host.connect()
+    term.expect('Configured network interfaces')
+    return host
 
 @pytest.fixture
-def nanocoap_server():
+def nanocoap_server(host_pool):
     """
     Runs the RIOT nanocoap server example as an ExpectHost. It does not provide
     a CLI to customize network addresses. So, it is easiest to specify the link
     address when defining the tap interface on the test host. Tests usually
     expect the environment variable TAP_LLADDR for this address.
-    """
-    base_folder = os.environ.get('RIOTBASE', None)
 
-    host = ExpectHost(os.path.join(base_folder, 'examples/nanocoap_server'),
-                                   'make term')
-    term = host.connect()
-    term.expect('Configured network interfaces')
+    Without a CLI, the pool only verifies the host process remains alive.
+    """
+    host = host_pool.acquire('nanocoap_server', _start_nanocoap_server,
+                             iface=riot_iface())
     yield host
 
     # teardown
-    host.disconnect()
+    host_pool.release(host)
+
+
+def _start_nanocoap_cli():
+    folder = os.path.join(os.environ.get('RIOTBASE', None), 'tests/nanocoap_cli')
+
+    host = ExpectHost(folder, riot_term_cmd(folder))
+    term = host.connect()
+    term.expect('nanocoap test app')
+    return host
 
 @pytest.fixture
-def nanocoap_cli():
+def nanocoap_cli(host_pool):
     """
     Runs the RIOT nanocoap CLI test app as an ExpectHost. Cannot explicitly
     set network addressing due to limitations of the app.
     """
-    base_folder = os.environ.get('RIOTBASE', None)
+    host = host_pool.acquire('nanocoap_cli', _start_nanocoap_cli, check_shell,
+                             riot_iface())
+    yield host
+
+    # teardown
+    host_pool.release(host)
+
+@pytest.fixture(scope='session')
+def coap_client():
+    """
+    Provides a persistent in-process CoapClient for the session, with DTLS
+    credentials for the SUT. Use it to send requests to a server under test
+    without starting a client process for each one. See coap_client.py.
+    """
+    # aiocoap is not required to import conftest
+    from coap_client import CoapClient
+
+    client = CoapClient([net.sut_host()])
+    yield client
 
-    host = ExpectHost(os.path.join(base_folder, 'tests/nanocoap_cli'), 'make term')
+    # teardown
+    client.close()
+
+@pytest.fixture(scope='session')
+def client_cmd(tmp_path_factory):
+    """
+    Provides a function to build the command for an aiocoap client script,
+    like client_cmd('block1_client.py', '-r [fd00:bbbb::2] -b 64'). Runs the
+    script in scenario_daemon.py, started for the session, so the script does
+    not pay for a new interpreter and the aiocoap imports on each run. Set the
+    SCENARIO_DAEMON environment variable to '0' to run the script directly.
+    """
+    if os.environ.get('SCENARIO_DAEMON', '1') == '0':
+        yield lambda script, args: './{0} {1}'.format(script, args)
+        return
+
+    # the daemon resolves relative paths in arguments, like the credentials
+    # file, from the same directory as a client script would
+    path = tmp_path_factory.mktemp('scenario') / 'daemon.sock'
+    host = ExpectHost(os.getcwd(), './scenario_daemon.py -s {0}'.format(path))
     term = host.connect()
-    term.expect('nanocoap test app')
+    wait_ready(lambda: banner(term, 'Daemon ready'), 'scenario daemon')
+    yield lambda script, args: './run_scenario.py -s {0} {1} {2}'.format(path, script,
+                                                                         args)
+
+    # teardown
+    host.disconnect(True)
 
+def standin_addr():
+    """Provides the (address, UDP port) for a Python stand-in server on this
+       host. In loopback mode, this address is the SUT."""
+    return '::1', net.port + 4
+
+def start_standin(addr, port, args=''):
+    """
+    Starts standin_server.py as an ExpectHost, and waits until it is ready.
+    Also serves DTLS with the gcoap PSK, if aiocoap supports it.
+
+    :param string args: Additional command line arguments
+    """
+    psk = proto_params.get('psk_key', 'secretPSK')
+
+    resources = ['udp/{0}'.format(port), 'udp/{0}'.format(port + 1)]
+    reaper.wait_free(resources)
+    host = ExpectHost(os.path.dirname(os.path.abspath(__file__)),
+                      './standin_server.py -a {0} -p {1} -k {2} {3}'.format(addr, port,
+                                                                            psk, args),
+                      resources=resources)
+    term = host.connect()
+    wait_ready(lambda: banner(term, 'Server ready'), 'stand-in server')
+    return host
+
+@pytest.fixture
+def standin_server(request):
+    """Runs standin_server.py as an ExpectHost, on standin_addr(). Parametrize
+       indirectly for additional command line arguments, like '-m 64'."""
+    host = start_standin(*standin_addr(), getattr(request, 'param', ''))
     yield host
 
     # teardown
-    host.disconnect()
+    host.disconnect(True)
 
-@pytest.fixture
-def libcoap_client(request_path):
-    """Runs a libcoap example client as an ExpectHost to retrieve a response."""
-    folder = os.environ.get('LIBCOAP_BASE', None)
-    cmd_folder = folder + '/examples/' if folder else ''
-    if proto_params['is_dtls']:
-        dtls_arg = '-k {0} -u {1}'.format(proto_params['psk_key'],
-                                          proto_params['psk_id'])
-    else:
-        dtls_arg = ''
+# Set the BLOCK_SERVER environment variable to 'standin' to run block tests
+# against standin_server.py rather than a RIOT block server app, with
+# STANDIN_ARGS for additional arguments, like '-m 64'.
+block_standin = os.environ.get('BLOCK_SERVER', 'riot') == 'standin'
+
+def start_block_standin(addr, port):
+    """Starts the stand-in block server, with STANDIN_ARGS."""
+    return start_standin(addr, port, os.environ.get('STANDIN_ARGS', ''))
+
+def sut_block_host():
+    """Provides the URI host for the block server under test, for a client
+       script: the RIOT SUT, or the stand-in at standin_addr()."""
+    if block_standin:
+        return '[{0}]:{1}'.format(standin_addr()[0], proto_port(standin_addr()[1]))
+    return '[{0}]'.format(net.sut_addr)
+
+def _start_pkt_block_server():
+    folder = os.path.join(os.environ.get('RIOTAPPSBASE', None), 'gcoap-block-server')
+
+    term_cmd = riot_term_cmd(folder)
+    term_resp = 'gcoap block handler'
 
-    cmd = '{0}coap-client {1} -N -m get -T 5a -U {2}://[fd00:bbbb::2]{3}'
-    cmd_text = cmd.format(cmd_folder, dtls_arg, proto_params['uri_proto'], request_path)
+    host = ExpectHost(folder, term_cmd)
+    term = host.connect()
+    term.expect(term_resp)
 
-    host = ExpectHost(folder, cmd_text)
+    # set ULA
+    pid = '5' if proto_params['is_dtls'] else '6'
+    cmd = 'ifconfig {0} add unicast {1}/64'.format(pid, net.sut_addr)
+    host.send_recv(cmd, 'success:')
+    return host
+
+@pytest.fixture
+def pkt_block_server(host_pool):
+    """
+    Provides a block server that uses Packet API functions to build the
+    response. Or, if BLOCK_SERVER is 'standin', provides standin_server.py;
+    use sut_block_host() for its address.
+    """
+    if block_standin:
+        host = start_block_standin(*standin_addr())
+        yield host
+        host.disconnect(True)
+        return
+
+    host = host_pool.acquire('pkt_block_server', _start_pkt_block_server,
+                             lambda h: check_shell(h, net.sut_addr), riot_iface())
     yield host
 
+    # teardown
+    host_pool.release(host)
+
+@contextlib.contextmanager
+def udp_responder(handle):
+    """
+    Runs a Python UDP endpoint on ::1, in a thread, for tests of a client that
+    do not require RIOT. Use in a fixture, like:
+
+        with udp_responder(respond) as port:
+            yield port
+
+    :param handle: Function called from the thread for each datagram
+                   received, with args (socket, data, remote address); may
+                   reply with socket.sendto()
+    :return: port for the endpoint
+    """
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sock.bind(('::1', 0))
+
+    def serve():
+        while True:
+            try:
+                data, remote = sock.recvfrom(2048)
+            except OSError:
+                # closed
+                return
+            try:
+                handle(sock, data, remote)
+            except Exception:
+                logging.exception('Responder failed for {0}'.format(data))
+
+    threading.Thread(target=serve, daemon=True).start()
+    try:
+        yield sock.getsockname()[1]
+    finally:
+        sock.close()
+
+def run_bench_script(tmp_path, cmd, timeout):
+    """
+    Runs a benchmark script from this folder to completion, like block_bench.py,
+    with '-j' for a JSON Lines results file in tmp_path. Logs its output.
+
+    :param string cmd: Command line without '-j', like './block_bench.py -r HOST'
+    :param int timeout: Seconds to wait for the script to finish
+    :return: list of result records
+    """
+    results = ResultReader(str(tmp_path / 'bench.jsonl'))
+    host = ExpectHost(os.path.dirname(os.path.abspath(__file__)),
+                      '{0} -j {1}'.format(cmd, results.path))
+    term = host.connect()
+    term.expect(pexpect.EOF, timeout)
+    logging.info(term.before)
+    return results.read()
+
 @pytest.fixture(scope='session')
-def libcoap_port():
-    """Provides default value for libcoap_server fixture port."""
-    return '5683'
+def net_segment():
+    """Provides the NetSegment for this test worker."""
+    return net
 
 @pytest.fixture(scope='session')
-def libcoap_ignore_count():
-    """Provides default value for libcoap_server fixture port. This value is
-       the count of requests the server will ignore. This ability is useful
-       for testing confirmable retries."""
-    return 0
+def libcoap_port(net_segment):
+    """Provides default value for libcoap_server fixture port."""
+    return str(net_segment.port)
 
 @pytest.fixture
-def libcoap_server(libcoap_port, libcoap_ignore_count):
+def libcoap_server(net_segment, libcoap_port):
     """Runs a libcoap example server process, and provides a pexpect spawn
-       object to interact with it."""
+       object to interact with it. Binds to the remote address for the worker's
+       network segment."""
     folder = os.environ.get('LIBCOAP_BASE', None)
     if proto_params['is_dtls']:
         dtls_arg = '-k {0}'.format(proto_params['psk_key'])
     else:
         dtls_arg = ''
-        
-    ignore_low = 1 + proto_params['session_setup_msgs']
-    ignore_high = libcoap_ignore_count + proto_params['session_setup_msgs']
-    ignore_range_arg = '-l {0}-{1}'.format(ignore_low, ignore_high) if libcoap_ignore_count else ''
 
-    cmd = '{0}coap-server -p {1} {2} {3}'.format('examples/' if folder else '',
-                                             libcoap_port, dtls_arg, ignore_range_arg)
+    cmd = '{0}coap-server -A {1} -p {2} {3}'.format('examples/' if folder else '',
+                                                net_segment.remote_addr,
+                                                libcoap_port, dtls_arg)
+
+    # wait for a server from an earlier test to release the port
+    resources = ['udp/{0}'.format(proto_port(libcoap_port))]
+    reaper.wait_free(resources)
+    host = ExpectHost(folder, cmd, resources=resources)
+    term = host.connect()
+    yield host
+
+    # teardown
+    host.disconnect(True)
+
+@pytest.fixture
+def rd_server():
+    """Runs an aiocoap Resource Directory server as an ExpectHost, bound to
+       the remote address for the worker's network segment."""
+    folder = os.environ.get('AIOCOAP_BASE', None)
+
+    resources = ['udp/{0}'.format(net.port)]
+    reaper.wait_free(resources)
+    host = ExpectHost(folder, './aiocoap-rd --bind {0}'.format(rd_host()),
+                      resources=resources)
+    term = host.connect()
+    wait_ready(lambda: coap_ping(net.remote_addr, net.port), 'aiocoap-rd')
+    yield host
+
+    # teardown
+    host.disconnect(True)
 
-    host = ExpectHost(folder, cmd)
+def rd_host():
+    """Provides the RD server host for a URI, including port."""
+    return '[{0}]:{1}'.format(net.remote_addr, net.port)
+
+@pytest.fixture(scope='session')
+def impair_spec():
+    """Provides default value for impair_proxy fixture impairments, as
+       (client to server, server to client) specs. See impair_proxy.py."""
+    return ('', '')
+
+def drop_requests(count):
+    """Provides an impair_proxy spec that drops the first count requests from a
+       client, after any DTLS session setup messages. Useful for testing
+       confirmable retries."""
+    setup = proto_params['session_setup_msgs']
+    return 'drop={0}-{1}'.format(1 + setup, count + setup)
+
+@pytest.fixture
+def impair_proxy(net_segment, impair_spec, tmp_path):
+    """
+    Runs impair_proxy.py between a client and a server at the remote address
+    for the worker's network segment. Listens at the worker's port, and
+    forwards to the alternative port, so use with a server on alt_port, like
+    libcoap_server with libcoap_port overridden. Writes the packet log to
+    impair.jsonl in tmp_path, and the packets, as the client sees them, to
+    impair.pcap. The IMPAIR_SEED environment variable seeds random
+    impairments.
+    """
+    listen    = proto_port(net_segment.port)
+    upstream  = proto_port(net_segment.alt_port)
+    up, down  = impair_spec
+    cmd = './impair_proxy.py -l [{0}]:{1} -u [{0}]:{2} -s {3} -j {4} -w {5}'.format(
+          net_segment.remote_addr, listen, upstream, os.environ.get('IMPAIR_SEED', '0'),
+          tmp_path / 'impair.jsonl', tmp_path / 'impair.pcap')
+    if up:
+        cmd += ' -U ' + up
+    if down:
+        cmd += ' -D ' + down
+
+    resources = ['udp/{0}'.format(listen)]
+    reaper.wait_free(resources)
+    host = ExpectHost(os.path.dirname(os.path.abspath(__file__)), cmd,
+                      resources=resources)
     term = host.connect()
+    wait_ready(lambda: banner(term, 'Proxy ready'), 'impair proxy')
     yield host
 
     # teardown
-    host.disconnect()
+    host.disconnect(True)
+
+# Set the PCAP_DIR environment variable to a directory to capture the packets
+# of each test there, with the packet_capture fixture. Capture requires the
+# CAP_NET_RAW capability; see pcap_tap.py.
+pcap_dir = os.environ.get('PCAP_DIR', '0')
+
+@pytest.fixture(autouse=True)
+def packet_capture(request, net_segment):
+    """
+    Captures the UDP packets to or from the worker's ports during each test,
+    with pcap_tap.py, to a pcap file in PCAP_DIR named for the test, like
+    'block1_server_test.py_test_block1_64_.pcap'. Captures on the SUT's tap
+    interface, or on loopback in loopback mode; set PCAP_IFACES for others,
+    like 'tap0,tap1'. Analyze the file with coap_trace.py, or Wireshark.
+
+    Does not capture unless PCAP_DIR is set. If the tap is not permitted, logs
+    a warning, and the test runs without capture.
+
+    :return: path to the pcap file, or None if not capturing
+    """
+    if pcap_dir == '0':
+        yield None
+        return
+
+    ifaces = os.environ.get('PCAP_IFACES') or net_segment.tap or 'lo'
+    # plain UDP ports, and the DTLS port one more than each
+    ports  = sorted({p + d for p in (net_segment.port, net_segment.alt_port,
+                                     net_segment.sut_port, standin_addr()[1])
+                     for d in (0, 1)})
+    os.makedirs(pcap_dir, exist_ok=True)
+    path = os.path.join(pcap_dir, re.sub(r'[^\w.-]', '_', request.node.nodeid) + '.pcap')
+
+    cmd  = './pcap_tap.py {0} -p {1} -w {2}'.format(
+           ' '.join('-i ' + i for i in ifaces.split(',')), ','.join(map(str, ports)), path)
+    host = ExpectHost(os.path.dirname(os.path.abspath(__file__)), cmd)
+    term = host.connect()
+    try:
+        wait_ready(lambda: banner(term, 'Tap ready'), 'packet tap')
+    except pexpect.EOF:
+        logging.warning('No packet capture: {0}'.format(term.before.strip()))
+        yield None
+        return
+    yield path
+
+    # teardown; the tap writes the packets it has received when stopped
+    host.disconnect(True)
 
 #
 # hooks
@@ -232,3 +966,32 @@ def pytest_addoption(parser):
     # for request_response_test.py
     parser.addini('request_response_repeat', 'number of times to repeat the test',
                   default='1')
+
+def pytest_configure(config):
+    """Adds the RIOT timing parameters for TIME_SCALE to CFLAGS, for the app
+       builds. Not on import, since scripts import this module too."""
+    if time_cflags(time_scale) not in os.environ.get('CFLAGS', ''):
+        os.environ['CFLAGS'] = ' '.join(filter(None, [os.environ.get('CFLAGS'),
+                                                      time_cflags(time_scale)]))
+
+def pytest_collection_finish(session):
+    """Builds the RIOT apps for the collected tests up front, in parallel."""
+    if session.config.option.collectonly or not build_cache.enabled \
+            or build_cache.board != 'native':
+        return
+
+    folders = set()
+    for item in session.items:
+        for name in getattr(item, 'fixturenames', ()):
+            app = riot_apps.get('{0}::{1}'.format(item.module.__name__, name),
+                                riot_apps.get(name))
+            if app and os.environ.get(app[0]):
+                folders.add(os.path.join(os.environ[app[0]], app[1]))
+    if folders:
+        build_cache.build_all(folders)
+
+def pytest_unconfigure(config):
+    """Waits for hosts stopping in the background, so none outlive the
+       session."""
+    if not reaper.wait_idle(30):
+        logging.warning('Hosts still stopping at end of session')
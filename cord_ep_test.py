@@ -12,68 +12,57 @@ import os
 import re
 import time
 
-from conftest import ExpectHost
+from conftest import ExpectHost, net, rd_host, riot_iface, riot_term_cmd, riot_time, scaled
+from readiness import coap_ping, wait_ready
 
 #
 # fixtures and utility functions
 #
 
 @pytest.fixture
-def cord_cli():
-    """Runs the RIOT cord_ep example process as an ExpectHost."""
-    base_folder = os.environ.get('RIOTBASE', None)
+def cord_cli(host_pool):
+    """Runs the RIOT cord_ep example process as an ExpectHost. Not pooled, so
+       each test sees the example's startup output."""
+    folder = os.path.join(os.environ.get('RIOTBASE', None), 'examples/cord_ep')
+    host_pool.claim(riot_iface())
 
-    host = ExpectHost(os.path.join(base_folder, 'examples/cord_ep'), 'make term')
+    host = ExpectHost(folder, riot_term_cmd(folder), resources=[riot_iface()])
     term = host.connect()
     term.expect('CoRE RD client example!')
 
     # set ULA
-    host.send_recv('ifconfig 7 add unicast fd00:bbbb::2/64',
+    host.send_recv('ifconfig 7 add unicast {0}/64'.format(net.sut_addr),
                    'success:')
     yield host
 
     # teardown
-    host.disconnect()
+    host.disconnect(True)
 
 
-@pytest.fixture
-def rd_server():
-    """Runs an aiocoap Resource Directory server as an ExpectHost."""
-    folder = os.environ.get('AIOCOAP_BASE', None)
-
-    host = ExpectHost(folder, './aiocoap-rd')
-    term = host.connect()
-    # allow a couple of seconds for initialization
-    time.sleep(2)
-    yield host
-
-    # teardown
-    host.disconnect()
-
 #
 # tests
 #
 
 def test_discover(rd_server, cord_cli):
-    cord_cli.send_recv('cord_ep discover [fd00:bbbb::1]',
+    cord_cli.send_recv('cord_ep discover {0}'.format(rd_host()),
                        'registration interface is')
 
 def test_register(rd_server, cord_cli):
-    cord_cli.send_recv('cord_ep register [fd00:bbbb::1]',
+    cord_cli.send_recv('cord_ep register {0}'.format(rd_host()),
                        'registration successful')
 
-    # verify automatic re-registration
-    cord_cli.term.expect('successfully updated client registration', 60)
+    # verify automatic re-registration, which must come within the lifetime
+    cord_cli.term.expect('successfully updated client registration', riot_time['CORD_LT'])
 
     # cancel
     cord_cli.send_recv('cord_ep remove',
                        'dropped client registration')
 
 def test_update(rd_server, cord_cli):
-    cord_cli.send_recv('cord_ep register [fd00:bbbb::1]',
+    cord_cli.send_recv('cord_ep register {0}'.format(rd_host()),
                        'registration successful')
 
-    time.sleep(10)
+    time.sleep(scaled(10))
     # update
     cord_cli.send_recv('cord_ep update',
                        'RD update successful')
@@ -83,12 +72,12 @@ def test_update(rd_server, cord_cli):
                        'dropped client registration')
 
 @pytest.mark.parametrize('request_path', ['/sense/temp', '/node/info'])
-def test_server(cord_cli, libcoap_client, request_path):
+def test_server(cord_cli, coap_client, request_path):
     """Test expected output from cord_cli resources"""
-    # allow a couple of seconds for cord_cli to initialize
-    time.sleep(2)
+    addr = net.sut_addr
+    wait_ready(lambda: coap_ping(addr), 'cord_cli')
 
-    output = libcoap_client.run()
+    output = coap_client.get(coap_client.uri('[{0}]'.format(addr), request_path)).payload
     logging.info('output {0}'.format(output))
 
     if request_path == '/sense/temp':
@@ -17,9 +17,9 @@ import logging
 import os
 import pexpect
 import re
-import time
 
-from conftest import ExpectHost
+from conftest import ExpectHost, reaper, riot_iface, riot_term_cmd, riot_time
+from readiness import coap_ping, wait_ready
 
 logging.basicConfig(level=logging.INFO)
 
@@ -28,49 +28,35 @@ logging.basicConfig(level=logging.INFO)
 #
 
 @pytest.fixture
-def cord_cli():
-    """Runs the RIOT cord_epsim example process as an ExpectHost."""
-    base_folder = os.environ.get('RIOTBASE', None)
+def cord_cli(host_pool):
+    """Runs the RIOT cord_epsim example process as an ExpectHost. Not pooled, so
+       each test sees the example's startup output."""
+    folder = os.path.join(os.environ.get('RIOTBASE', None), 'examples/cord_epsim')
+    host_pool.claim(riot_iface())
 
-    host = ExpectHost(os.path.join(base_folder, 'examples/cord_epsim'), 'make term')
+    host = ExpectHost(folder, riot_term_cmd(folder), resources=[riot_iface()])
     term = host.connect()
     term.expect('Simplified CoRE RD registration example')
     yield host
 
     # teardown
-    host.disconnect()
+    host.disconnect(True)
 
 
 @pytest.fixture
 def rd_server():
-    """Runs an aiocoap Resource Directory server as an ExpectHost."""
+    """Runs an aiocoap Resource Directory server as an ExpectHost. Uses the
+       default port, since cord_epsim is compiled with the RD address."""
     folder = os.environ.get('AIOCOAP_BASE', None)
 
-    host = ExpectHost(folder, './aiocoap-rd')
+    reaper.wait_free(['udp/5683'])
+    host = ExpectHost(folder, './aiocoap-rd', resources=['udp/5683'])
     term = host.connect()
-    # allow a couple of seconds for initialization
-    time.sleep(2)
+    wait_ready(lambda: coap_ping('::1'), 'aiocoap-rd')
     yield host
 
     # teardown
-    host.disconnect()
-
-
-@pytest.fixture
-def libcoap_client(request_path):
-    """Runs a libcoap example client as an ExpectHost to retrieve a response.
-       Overrides fixture with the same name in conftest.py to allow
-       specification of address.
-    """
-    folder = os.environ.get('LIBCOAP_BASE', None)
-    cmd_folder = folder + '/examples/' if folder else ''
-    addr   = os.environ.get('TAP_LLADDR_SUT', None)
-
-    cmd = '{0}coap-client -N -m get -T 5a -U coap://[{1}]{2}'
-    cmd_text = cmd.format(cmd_folder, addr, request_path)
-
-    host = ExpectHost(folder, cmd_text)
-    yield host
+    host.disconnect(True)
 
 
 @pytest.fixture
@@ -87,27 +73,30 @@ def test_run(rd_server, cord_cli):
     # must read to end of output from startup
     cord_cli.term.expect('RD address:.*$')
 
-    # attempting to re-register
-    cord_cli.term.expect('updating registration with RD.*$', 60)
+    # attempting to re-register, within the lifetime
+    cord_cli.term.expect('updating registration with RD.*$', riot_time['CORD_LT'])
 
-    # not expecting warning, which indicates failed to contact server
+    # not expecting warning, which indicates failed to contact server; it
+    # would come by the next update
     with pytest.raises(pexpect.TIMEOUT):
-        cord_cli.term.expect('warning: registration already in progress', 60)
+        cord_cli.term.expect('warning: registration already in progress',
+                             riot_time['CORD_LT'])
 
 def test_no_server(cord_cli):
     """Test expected failure when no rd server"""
     # must read to end of output from startup
     cord_cli.term.expect('RD address:.*$')
 
-    cord_cli.term.expect('warning: registration already in progress', 60)
+    cord_cli.term.expect('warning: registration already in progress',
+                         riot_time['CORD_LT'])
 
 @pytest.mark.parametrize('request_path', ['/riot/foo', '/riot/info'])
-def test_server(cord_cli, libcoap_client, request_path):
+def test_server(cord_cli, coap_client, request_path):
     """Test expected output from cord_cli resources"""
-    # allow a couple of seconds for cord_cli to initialize
-    time.sleep(2)
+    addr = os.environ.get('TAP_LLADDR_SUT', None)
+    wait_ready(lambda: coap_ping(addr), 'cord_cli')
 
-    output = libcoap_client.run()
+    output = coap_client.get(coap_client.uri('[{0}]'.format(addr), request_path)).payload
     logging.info('output {0}'.format(output))
 
     if request_path == '/riot/foo':
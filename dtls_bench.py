@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Benchmarks the cost of DTLS sessions for a CoAP server, like gcoap built with
+TRANSPORT_PROTOCOL=DTLS, or standin_server.py.
+
+Runs these benchmarks, and prints a report for each:
+
+handshake  For each of ITERATIONS fresh client contexts, the time to first
+           response, which includes the PSK handshake, and the time for a
+           second request on the established session. Handshake cost is the
+           difference.
+overhead   Round trip time for QTY sequential requests on an established DTLS
+           session, vs. plain UDP to the same resource at -u UDP_HOST. Only
+           run if UDP_HOST is given, since a RIOT build serves either UDP or
+           DTLS, not both.
+peers      For each count of concurrent peers, like gcoap's DTLS_PEER_MAX and
+           beyond, each peer handshakes concurrently; reports handshakes/sec.
+           Then each peer repeats its request in connection order. A request
+           that fails, or takes longer than half the median first response,
+           needed a new session, so the server had evicted the peer.
+
+Each peer is a separate aiocoap context, with its own local port.
+
+Usage:
+    usage: dtls_bench.py -r HOST [-u UDP_HOST] [-p PATH] [-i ITERATIONS]
+                         [-q QTY] [-P PEERS] [-w TIMEOUT] [-j FILE]
+    usage: dtls_bench.py -h
+
+    optional arguments:
+      -h, --help     show this help message and exit
+      -r HOST        remote host for coaps URI, like [fd00:bbbb::2]
+      -u UDP_HOST    remote host for coap URI to compare with plain UDP
+      -p PATH        path for URI; /cli/stats by default
+      -i ITERATIONS  count of handshakes; 20 by default
+      -q QTY         count of requests for overhead; 100 by default
+      -P PEERS       comma separated counts of concurrent peers; 1,2,4 by default
+      -w TIMEOUT     seconds to wait for a response; 10 by default
+      -j FILE        write a JSON Lines record with each benchmark result; see
+                     coap_results.py
+
+Example:
+
+$ ./dtls_bench.py -r [::1]:5684 -u [::1]:5683 -P 1,2,4
+handshake: 20 sessions; handshake p50 12.410 p90 ... ms
+first response: p50 13.002 p90 ... ms
+...
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+from argparse import ArgumentParser
+from aiocoap import *
+from coap_results import ResultWriter
+from coap_stats import Histogram, format_latency, summary_fields
+from conftest import proto_params
+
+logging.basicConfig(level=logging.WARNING)
+
+# Credentials match those for gcoap; see proto_params in conftest.py
+PSK_KEY = proto_params.get('psk_key', 'secretPSK')
+PSK_ID  = proto_params.get('psk_id', 'Client_identity')
+
+async def new_context(host):
+    """Creates a client context with DTLS credentials for the host."""
+    context = await Context.create_client_context()
+    context.client_credentials.load_from_dict({
+        'coaps://{0}/*'.format(host): {'dtls': {'psk': {'ascii': PSK_KEY},
+                                                'client-identity': {'ascii': PSK_ID}}}})
+    return context
+
+async def timed_get(context, uri, timeout):
+    """GETs the URI.
+
+    :return: round trip time in seconds
+    :raises: asyncio.TimeoutError, or an aiocoap error
+    """
+    start = time.monotonic()
+    request = Message(code=GET, uri=uri)
+    await asyncio.wait_for(context.request(request).response, timeout)
+    return time.monotonic() - start
+
+def report(results, name, line, **fields):
+    print('{0}: {1}'.format(name, line), flush=True)
+    results.write(bench=name, **fields)
+
+async def bench_handshake(host, path, iterations, timeout, results):
+    uri = 'coaps://{0}{1}'.format(host, path)
+    handshake, first = Histogram(), Histogram()
+    failed = 0
+    for i in range(iterations):
+        context = await new_context(host)
+        try:
+            first_rtt  = await timed_get(context, uri, timeout)
+            second_rtt = await timed_get(context, uri, timeout)
+        except Exception as e:
+            logging.warning('Handshake failed: %r'%e)
+            failed += 1
+        else:
+            first.record(first_rtt * 1e6)
+            handshake.record(max(first_rtt - second_rtt, 0) * 1e6)
+        finally:
+            await context.shutdown()
+
+    report(results, 'handshake', '{0} sessions, {1} failed; {2}'.format(
+           handshake.count, failed, format_latency(handshake)),
+           failed=failed, **summary_fields(handshake))
+    report(results, 'first_response', format_latency(first), **summary_fields(first))
+    return first
+
+async def bench_overhead(host, udp_host, path, qty, timeout, results):
+    hists = {}
+    for scheme, target in (('coap', udp_host), ('coaps', host)):
+        uri     = '{0}://{1}{2}'.format(scheme, target, path)
+        context = await new_context(host)
+        hist    = hists[scheme] = Histogram()
+        try:
+            # establish session
+            await timed_get(context, uri, timeout)
+            for i in range(qty):
+                hist.record(await timed_get(context, uri, timeout) * 1e6)
+        finally:
+            await context.shutdown()
+        report(results, scheme + '_rtt', format_latency(hist), **summary_fields(hist))
+
+    overhead = (hists['coaps'].value_at(50) - hists['coap'].value_at(50)) / 1000
+    report(results, 'dtls_overhead', 'p50 {0:.3f} ms per request'.format(overhead),
+           p50=overhead)
+
+async def bench_peers(host, path, peers, timeout, results):
+    uri      = 'coaps://{0}{1}'.format(host, path)
+    contexts = [await new_context(host) for i in range(peers)]
+    try:
+        start  = time.monotonic()
+        firsts = await asyncio.gather(*[timed_get(c, uri, timeout) for c in contexts],
+                                      return_exceptions=True)
+        elapsed = time.monotonic() - start
+        ok = [rtt for rtt in firsts if not isinstance(rtt, Exception)]
+        rate = len(ok) / elapsed if elapsed else 0
+
+        # revisit peers in connection order; a fresh handshake means eviction
+        threshold = statistics.median(ok) / 2 if ok else 0
+        evicted = failed = 0
+        repeat  = Histogram()
+        for context in contexts:
+            try:
+                rtt = await timed_get(context, uri, timeout)
+            except Exception:
+                failed += 1
+                continue
+            repeat.record(rtt * 1e6)
+            evicted += rtt > threshold
+    finally:
+        for context in contexts:
+            await context.shutdown()
+
+    report(results, 'peers',
+           '{0} peers; {1} connected, {2:.1f} handshakes/s; repeat: {3} evicted, '
+           '{4} failed, {5}'.format(peers, len(ok), rate, evicted, failed,
+                                    format_latency(repeat)),
+           peers=peers, connected=len(ok), handshake_rate=rate, evicted=evicted,
+           failed=failed, **summary_fields(repeat))
+
+async def main(host, udp_host=None, path='/cli/stats', iterations=20, qty=100,
+               peers=(1, 2, 4), timeout=10, resultsFile=None):
+    results = ResultWriter(resultsFile)
+    await bench_handshake(host, path, iterations, timeout, results)
+    if udp_host:
+        await bench_overhead(host, udp_host, path, qty, timeout, results)
+    for count in peers:
+        await bench_peers(host, path, count, timeout, results)
+    results.close()
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-r', dest='host', required=True,
+                        help='remote host for coaps URI')
+    parser.add_argument('-u', dest='udp_host',
+                        help='remote host for coap URI, to compare with plain UDP')
+    parser.add_argument('-p', dest='path', default='/cli/stats',
+                        help='URI path for resource')
+    parser.add_argument('-i', dest='iterations', type=int, default=20,
+                        help='count of handshakes')
+    parser.add_argument('-q', dest='qty', type=int, default=100,
+                        help='count of requests for overhead')
+    parser.add_argument('-P', dest='peers', default='1,2,4',
+                        help='comma separated counts of concurrent peers')
+    parser.add_argument('-w', dest='timeout', type=float, default=10,
+                        help='seconds to wait for a response')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='JSON Lines file for benchmark results')
+
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(main(args.host, args.udp_host,
+                                                     args.path, args.iterations,
+                                                     args.qty,
+                                                     [int(p) for p in args.peers.split(',')],
+                                                     args.timeout, args.resultsFile))
@@ -0,0 +1,70 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Benchmarks DTLS session cost with dtls_bench.py, for gcoap and for the Python
+stand-in server. Logs the benchmark reports.
+"""
+
+import importlib.util
+import logging
+import os
+import pytest
+
+from conftest import net, proto_params, proto_port, run_bench_script, standin_addr
+
+logging.basicConfig(level=logging.INFO)
+
+pytestmark = pytest.mark.benchmark
+
+#
+# fixtures and utility functions
+#
+
+def run_bench(tmp_path, args):
+    """Runs dtls_bench.py to completion.
+
+    :return: dict of result records, by benchmark name; 'peers' is a list
+    """
+    records = {'peers': []}
+    for record in run_bench_script(tmp_path, './dtls_bench.py {0}'.format(args), 600):
+        if record['bench'] == 'peers':
+            records['peers'].append(record)
+        else:
+            records[record['bench']] = record
+    return records
+
+#
+# tests
+#
+
+@pytest.mark.skipif(importlib.util.find_spec('DTLSSocket') is None,
+                    reason='aiocoap DTLS requires DTLSSocket')
+def test_standin(standin_server, tmp_path):
+    """DTLS handshake, overhead vs. UDP, and concurrent peers, for the stand-in
+       server. No peer limit, so no peer is evicted."""
+    addr, port = standin_addr()
+    records = run_bench(tmp_path, '-r [{0}]:{1} -u [{0}]:{2} -i 10 -q 50 -P 1,4,8'.format(
+                                  addr, port + 1, port))
+    assert records['handshake']['failed'] == 0
+    assert 'dtls_overhead' in records
+    for record in records['peers']:
+        assert record['connected'] == record['peers']
+        assert record['failed'] == 0
+
+@pytest.mark.skipif(not proto_params['is_dtls'], reason='requires DTLS build')
+def test_gcoap(gcoap_example, tmp_path):
+    """DTLS handshake and concurrent peers for gcoap, up to one beyond
+       DTLS_PEER_MAX. A peer beyond the max may evict a session, but every
+       peer within the max connects."""
+    peer_max = int(os.environ.get('DTLS_PEER_MAX', '1'))
+    peers    = ','.join(str(p) for p in range(1, peer_max + 2))
+    records  = run_bench(tmp_path, '-r [{0}]:{1} -i 10 -P {2}'.format(
+                                   net.sut_addr, proto_port(net.sut_port), peers))
+    assert records['handshake']['failed'] == 0
+    for record in records['peers']:
+        if record['peers'] <= peer_max:
+            assert record['connected'] == record['peers']
@@ -0,0 +1,271 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Bounded memory capture of host terminal output.
+
+A single background thread reads the output of all captured hosts as soon as
+it is available. So a host never blocks on a full pty, even when a test is not
+expecting output. The thread writes the output to a rotating log file per
+host, and queues it in a bounded ring buffer for pattern matching.
+
+CaptureSpawn is a pexpect spawn that reads from the ring buffer rather than
+the pty. It limits the window pexpect searches for a match, and the text
+pexpect retains before a match. So the cost of an expect() remains constant
+regardless of how long a host has been running.
+"""
+
+import codecs
+import collections
+import logging
+import os
+import pexpect
+import selectors
+import threading
+
+
+class RotatingLog():
+    """Log file that rotates to numbered backups when it reaches a maximum
+       size, like logging.handlers.RotatingFileHandler for raw output."""
+
+    def __init__(self, path, max_bytes=1024*1024, backups=3):
+        self.path      = path
+        self.max_bytes = max_bytes
+        self.backups   = backups
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file     = open(path, 'wb')
+
+    def write(self, data):
+        if self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists('{0}.{1}'.format(self.path, i)):
+                os.replace('{0}.{1}'.format(self.path, i),
+                           '{0}.{1}'.format(self.path, i + 1))
+        if self.backups:
+            os.replace(self.path, self.path + '.1')
+        self._file = open(self.path, 'wb')
+
+
+class _Reader(threading.Thread):
+    """Reads output from all registered spawns, with a selector."""
+
+    def __init__(self):
+        super().__init__(name='host-capture', daemon=True)
+        self._selector = selectors.DefaultSelector()
+        self._lock     = threading.Lock()
+        # (spawn, fd, register?, done event) requests for the reader thread
+        self._requests = []
+        self._wake_r, self._wake_w = os.pipe()
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def register(self, spawn, fd):
+        self._request(spawn, fd, True)
+
+    def unregister(self, spawn, fd, timeout=5):
+        """Stops reading fd, and waits for the reader thread to acknowledge, so
+           the caller may close it."""
+        if threading.current_thread() is self:
+            self._handle_request(spawn, fd, False)
+        else:
+            self._request(spawn, fd, False).wait(timeout)
+
+    def _request(self, spawn, fd, register):
+        done = threading.Event()
+        with self._lock:
+            self._requests.append((spawn, fd, register, done))
+        os.write(self._wake_w, b'\0')
+        return done
+
+    def run(self):
+        while True:
+            for key, _ in self._selector.select():
+                try:
+                    self._handle_event(key)
+                except Exception:
+                    logging.exception('Host capture failed for fd {0}'.format(key.fd))
+
+    def _handle_event(self, key):
+        if key.fd == self._wake_r:
+            os.read(self._wake_r, 4096)
+            self._handle_requests()
+            return
+
+        spawn = key.data
+        try:
+            data = os.read(key.fd, 65536)
+        except OSError:
+            # EIO on Linux when the child exits
+            data = b''
+        if data:
+            spawn._on_data(data)
+        else:
+            self._selector.unregister(key.fd)
+            spawn._on_eof()
+
+    def _handle_requests(self):
+        with self._lock:
+            requests, self._requests = self._requests, []
+        for spawn, fd, register, done in requests:
+            try:
+                self._handle_request(spawn, fd, register)
+            except Exception:
+                logging.exception('Host capture request failed for fd {0}'.format(fd))
+            finally:
+                done.set()
+
+    def _handle_request(self, spawn, fd, register):
+        key = self._selector.get_map().get(fd)
+        if register:
+            # fd may be reused from a spawn closed without unregister
+            if key:
+                self._selector.unregister(fd)
+            self._selector.register(fd, selectors.EVENT_READ, spawn)
+        elif key and key.data is spawn:
+            self._selector.unregister(fd)
+
+_reader = None
+_reader_lock = threading.Lock()
+
+def _get_reader():
+    global _reader
+    with _reader_lock:
+        if not _reader:
+            _reader = _Reader()
+            _reader.start()
+    return _reader
+
+
+class CaptureSpawn(pexpect.spawn):
+    """
+    pexpect spawn with bounded memory, streaming capture of output. Use like
+    pexpect.spawnu, with these additional parameters:
+
+    :param string log_path: Path for the rotating output log; '{pid}' is
+                            replaced with the process ID. If None, output is
+                            not logged.
+    :param int ring_size: Maximum count of characters queued in memory, not
+                          yet read by expect(). Older output is dropped.
+    """
+    # max characters searched for a match, ending with the newest output
+    SEARCH_WINDOW = 16 * 1024
+    # max characters retained in 'before' for a match
+    BEFORE_MAX    = 64 * 1024
+
+    def __init__(self, command, log_path=None, ring_size=256*1024, **kwargs):
+        kwargs.setdefault('encoding', 'utf-8')
+        kwargs.setdefault('searchwindowsize', self.SEARCH_WINDOW)
+        self._cond      = threading.Condition()
+        self._ring      = collections.deque()
+        self._ring_len  = 0
+        self._ring_size = ring_size
+        self._eof       = False
+        self._callbacks = []
+        # count of characters dropped from the ring, and received in total
+        self.dropped    = 0
+        self.received   = 0
+        super().__init__(command, **kwargs)
+
+        self._capture_decoder = codecs.getincrementaldecoder(self.encoding)(
+                                    self.codec_errors)
+        self._log_file = None
+        if log_path:
+            self._log_file = RotatingLog(log_path.format(pid=self.pid))
+        # pexpect sets child_fd to -1 on close; unregister with the original
+        self._fd     = self.child_fd
+        self._reader = _get_reader()
+        self._reader.register(self, self._fd)
+
+    def read_nonblocking(self, size=1, timeout=-1):
+        """Reads up to size characters from the ring buffer, waiting up to
+           timeout seconds for output."""
+        if timeout == -1:
+            timeout = self.timeout
+        # pexpect accumulates output before a match; trim from the front
+        if self._before.tell() > 2 * self.BEFORE_MAX:
+            tail = self._before.getvalue()[-self.BEFORE_MAX:]
+            self._before = self.buffer_type()
+            self._before.write(tail)
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._ring or self._eof, timeout):
+                raise pexpect.TIMEOUT('Timeout exceeded.')
+            if not self._ring:
+                self.flag_eof = True
+                raise pexpect.EOF('End Of File (EOF).')
+
+            chunk = self._ring.popleft()
+            if len(chunk) > size:
+                self._ring.appendleft(chunk[size:])
+                chunk = chunk[:size]
+            self._ring_len -= len(chunk)
+
+        self._log(chunk, 'read')
+        return chunk
+
+    def add_data_callback(self, callback):
+        """Registers a one-shot function to call, from the reader thread, when
+           output or EOF is available. Calls it immediately if available now."""
+        with self._cond:
+            if not (self._ring or self._eof):
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_data_callback(self, callback):
+        """Removes a callback from add_data_callback(), if not yet called."""
+        with self._cond:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def close(self, force=True):
+        self._reader.unregister(self, self._fd)
+        super().close(force)
+
+    def _on_data(self, data):
+        if self._log_file:
+            self._log_file.write(data)
+        text = self._capture_decoder.decode(data)
+        if not text:
+            return
+        with self._cond:
+            self._ring.append(text)
+            self._ring_len += len(text)
+            self.received  += len(text)
+            while self._ring_len > self._ring_size:
+                old = self._ring.popleft()
+                self._ring_len -= len(old)
+                if not self.dropped:
+                    logging.warning('Dropping unread output from pid {0}'.format(self.pid))
+                self.dropped += len(old)
+            self._notify()
+
+    def _on_eof(self):
+        if self._log_file:
+            self._log_file.close()
+        with self._cond:
+            self._eof = True
+            self._notify()
+
+    def _notify(self):
+        """Wakes waiters; must hold the condition lock."""
+        self._cond.notify_all()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            # one failed callback, like for a closed event loop, must not
+            # prevent the others
+            try:
+                callback()
+            except Exception:
+                logging.exception('Data callback failed for pid {0}'.format(self.pid))
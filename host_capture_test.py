@@ -0,0 +1,70 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests bounded memory capture of host output. Uses ordinary shell processes as
+hosts, so does not require RIOT.
+"""
+
+import os
+import pexpect
+import pytest
+
+from host_capture import CaptureSpawn
+
+#
+# tests
+#
+
+def test_long_output(tmp_path):
+    """Expect on a host with a lot of output, retaining bounded memory."""
+    log_path = str(tmp_path / 'host-{pid}.log')
+    cmd = 'sh -c "yes riot-output-line | head -n 200000; echo marker-$((40+2))"'
+    term = CaptureSpawn(cmd, log_path=log_path, ring_size=64*1024, timeout=10)
+
+    term.expect('marker-42')
+    assert len(term.before) <= 2 * CaptureSpawn.BEFORE_MAX
+    assert term.received > 3 * 1000 * 1000
+    term.expect(pexpect.EOF)
+
+    # log rotates; current plus 3 backups, each no larger than 1 MB
+    path = log_path.format(pid=term.pid)
+    sizes = [os.path.getsize(path)] + [os.path.getsize('{0}.{1}'.format(path, i))
+                                       for i in range(1, 4)]
+    assert max(sizes) <= 1024 * 1024
+    with open(path, 'rb') as f:
+        assert f.read().rstrip().endswith(b'marker-42')
+
+def test_unread_output():
+    """Host does not block on output no one expects, and unread output beyond
+       the ring size is dropped."""
+    term = CaptureSpawn('sh -c "yes riot-output-line | head -n 100000; sleep 0.5"',
+                        ring_size=16*1024, timeout=10)
+    # host exits only if its output is consumed
+    term.expect(pexpect.EOF)
+    assert term.dropped > 0
+
+def test_incremental():
+    """Each expect continues from the end of the previous match."""
+    term = CaptureSpawn('sh -c "for i in 1 2 3; do echo line-$i; done; cat"',
+                        timeout=2)
+    for i in (1, 2, 3):
+        term.expect(r'line-(\d)')
+        assert term.match.group(1) == str(i)
+    with pytest.raises(pexpect.TIMEOUT):
+        term.expect('line-', timeout=0.2)
+    term.sendline('line-4')
+    term.expect('line-4')
+    term.close()
+
+def test_close_reuse():
+    """After hosts are closed, a new host's output still is captured."""
+    for i in range(20):
+        term = CaptureSpawn('cat', timeout=2)
+        term.close()
+    term = CaptureSpawn('sh -c "echo after-close; cat"', timeout=2)
+    term.expect('after-close')
+    term.close()
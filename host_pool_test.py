@@ -0,0 +1,36 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests the pool of long running hosts. Uses ordinary shell processes as hosts,
+so does not require RIOT.
+"""
+
+from conftest import ExpectHost, HostPool, reaper
+
+#
+# fixtures and utility functions
+#
+
+def start_sleeper():
+    host = ExpectHost(None, 'sleep 30')
+    host.connect()
+    return host
+
+#
+# tests
+#
+
+def test_release_all():
+    """Without reuse, releasing the hosts from acquire_all() stops each of
+       them."""
+    pool  = HostPool(reuse=False)
+    hosts = pool.acquire_all([('client', start_sleeper, None, 'test-tap0'),
+                              ('server', start_sleeper, None, 'test-tap1')])
+    pool.release(*hosts)
+
+    reaper.wait_free(['test-tap0', 'test-tap1'], timeout=5)
+    assert not any(host.term.isalive() for host in hosts)
@@ -0,0 +1,161 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Background shutdown of host processes.
+
+Stopping a host synchronously delays the next test until the process exits
+and its resources -- a tap interface or a UDP port -- are free again. Instead,
+hand the host to the Reaper, which stops it gracefully with SIGTERM, and then
+SIGKILL after a grace period. The Reaper tracks the resources each host holds,
+so the next fixture waits only for the resources it needs, and only as long
+as they remain held.
+
+Resources are named by strings, like 'tap0' for an interface, or 'udp/5683'
+for a local UDP port.
+"""
+
+import collections
+import logging
+import os
+import signal
+import threading
+import time
+
+from readiness import port_bound
+
+
+class _Shutdown():
+    """State of a host being shut down."""
+
+    def __init__(self, term, resources, grace):
+        self.term      = term
+        self.resources = resources
+        self.deadline  = time.monotonic() + grace
+        self.killed    = False
+
+
+class Reaper():
+    """
+    Shuts down host processes in a background thread, and tracks release of
+    the resources they hold. Shuts down any number of hosts concurrently.
+    """
+
+    def __init__(self, grace=1.0, poll_interval=0.02):
+        """
+        :param float grace: Seconds to wait after SIGTERM before SIGKILL
+        """
+        self.grace         = grace
+        self.poll_interval = poll_interval
+        self._cond         = threading.Condition()
+        self._held         = collections.Counter()
+        self._active       = []
+        self._thread       = None
+
+    def reap(self, term, resources=()):
+        """
+        Starts shutdown of a host process group. Returns immediately.
+
+        :param term: pexpect spawn object for the host
+        :param resources: Names of resources held by the host
+        """
+        try:
+            os.killpg(term.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+        with self._cond:
+            self._held.update(resources)
+            self._active.append(_Shutdown(term, tuple(resources), self.grace))
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='host-reaper',
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait_free(self, resources, timeout=30):
+        """
+        Waits until no host being shut down holds any of the resources. For a
+        UDP port resource, also waits until no process has the port bound.
+
+        :param float timeout: Max seconds to wait
+        :return: Seconds waited
+        :raises TimeoutError: if a resource remains held
+        """
+        start    = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: not any(self._held[r] for r in resources),
+                                       timeout):
+                raise TimeoutError('Resources still held: {0}'.format(resources))
+
+        ports = [int(r[4:]) for r in resources if r.startswith('udp/')]
+        while any(port_bound(port) for port in ports):
+            if time.monotonic() >= deadline:
+                raise TimeoutError('Ports still bound: {0}'.format(ports))
+            time.sleep(self.poll_interval)
+        return time.monotonic() - start
+
+    def wait_idle(self, timeout=None):
+        """Waits until all hosts have been shut down.
+
+        :return: True if idle; False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._active, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._active)
+                active = list(self._active)
+
+            done = [s for s in active if self._poll(s)]
+            if done:
+                with self._cond:
+                    for s in done:
+                        self._active.remove(s)
+                        self._held.subtract(s.resources)
+                    self._cond.notify_all()
+            else:
+                time.sleep(self.poll_interval)
+
+    def _poll(self, shutdown):
+        """Advances shutdown of a host.
+
+        :return: True if the host is finished
+        """
+        term = shutdown.term
+        # reaps the direct child if it has exited
+        term.isalive()
+        try:
+            os.killpg(term.pid, 0)
+        except ProcessLookupError:
+            self._close(term)
+            return True
+
+        if time.monotonic() >= shutdown.deadline:
+            if shutdown.killed:
+                # group only has zombies left, which init has not reaped
+                logging.warning('Host pid {0} not fully stopped'.format(term.pid))
+                self._close(term)
+                return True
+            try:
+                os.killpg(term.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            shutdown.killed   = True
+            shutdown.deadline = time.monotonic() + self.grace
+        return False
+
+    def _close(self, term):
+        """Closes the host pty, without the sleep pexpect uses to wait for a
+           process it expects to be running."""
+        term.ptyproc.delayafterclose = 0
+        try:
+            term.close(force=False)
+        except Exception:
+            logging.exception('Error closing host pid {0}'.format(term.pid))
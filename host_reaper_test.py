@@ -0,0 +1,61 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests background shutdown of hosts. Uses ordinary shell processes as hosts, so
+does not require RIOT.
+"""
+
+import pytest
+import socket
+import time
+
+from conftest import ExpectHost
+from host_reaper import Reaper
+
+#
+# tests
+#
+
+def test_graceful():
+    """Host that exits on SIGTERM frees its resource without SIGKILL."""
+    reaper = Reaper(grace=5)
+    host   = ExpectHost(None, 'sleep 30', resources=['tap9'])
+    host.connect()
+
+    start = time.monotonic()
+    reaper.reap(host.term, host.resources)
+    assert time.monotonic() - start < 0.1
+    reaper.wait_free(['tap9'], timeout=2)
+    assert not host.term.isalive()
+    assert host.term.signalstatus == 15
+    assert reaper.wait_idle(1)
+
+def test_forced():
+    """Host that ignores SIGTERM is killed after the grace period. Waits only
+       for the resource requested."""
+    reaper = Reaper(grace=0.3)
+    stubborn = ExpectHost(None, "sh -c \"trap '' TERM; echo trapped; sleep 30\"",
+                          resources=['tap8'])
+    stubborn.connect().expect('trapped')
+    other = ExpectHost(None, 'sleep 30', resources=['tap9'])
+    other.connect()
+
+    reaper.reap(stubborn.term, stubborn.resources)
+    reaper.reap(other.term, other.resources)
+    assert reaper.wait_free(['tap9'], timeout=2) < 0.3
+    assert reaper.wait_free(['tap8'], timeout=2) >= 0.2
+    assert stubborn.term.signalstatus == 9
+
+def test_port():
+    """Waits for a UDP port to be unbound, and times out if it remains bound."""
+    reaper = Reaper()
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        sock.bind(('::', 0))
+        port = sock.getsockname()[1]
+        with pytest.raises(TimeoutError):
+            reaper.wait_free(['udp/{0}'.format(port)], timeout=0.1)
+    reaper.wait_free(['udp/{0}'.format(port)], timeout=0.1)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+UDP proxy that impairs the link between a client and a server, to measure a
+CoAP implementation under loss, delay and reordering. Listens at LISTEN, and
+forwards each datagram to UPSTREAM. Uses a separate upstream socket for each
+client endpoint, so responses return to the client that sent the request.
+Transparent to DTLS.
+
+Impairments are given for each direction, 'up' from client to server and
+'down' from server to client, as a comma separated spec of name=value items:
+
+loss=P       drop a packet with probability P
+delay=S      delay each packet S seconds
+jitter=S     add a random delay of up to S seconds
+rate=B       limit bandwidth to B bytes per second, queuing packets
+dup=P        send a packet twice with probability P
+reorder=P    delay a packet by an extra 50 ms with probability P, so later
+             packets overtake it
+drop=LIST    drop packets by number from the start of each client's session,
+             like 1-2 for the first two, or 1:4 for the first and fourth
+
+For example, 'loss=0.1,delay=0.02,jitter=0.01'. Random choices are seeded, so
+a run may be repeated exactly for the same packets.
+
+Writes a JSON Lines record for each packet; see coap_results.py. A record
+includes these fields, and the message fields from a CoAP header, if any:
+
+:t:       Wall clock time the packet was received, in seconds since the epoch
+:dir:     'up' or 'down'
+:client:  Client endpoint, like '[fd00:bbbb::2]:5683'
+:num:     Packet number in the client's session, for the direction
+:size:    Datagram length in bytes
+:action:  'forward', 'drop', or 'duplicate'
+:delay:   Seconds from receipt until sent
+
+Also writes the packets to a pcap file, with -w, as the client sees them:
+each packet from the client when the proxy receives it, and each packet to the
+client when the proxy sends it. So a dropped response is absent. See
+coap_trace.py to analyze the file.
+
+Prints 'Proxy ready' when listening.
+
+Usage:
+    usage: impair_proxy.py -l LISTEN -u UPSTREAM [-U SPEC] [-D SPEC] [-s SEED]
+                           [-j FILE] [-w FILE]
+    usage: impair_proxy.py -h
+
+    optional arguments:
+      -h, --help   show this help message and exit
+      -l LISTEN    address to listen, like [fd00:bbbb::1]:5683
+      -u UPSTREAM  server address, like [fd00:bbbb::1]:5693
+      -U SPEC      impairments from client to server
+      -D SPEC      impairments from server to client
+      -s SEED      seed for random impairments; 0 by default
+      -j FILE      write a JSON Lines record for each packet
+      -w FILE      write the packets to a pcap file
+
+Example:
+
+Drops the first two requests from each client, like a server that ignores
+them, and delays responses by 20 ms.
+
+$ ./impair_proxy.py -l [fd00:bbbb::1]:5683 -u [fd00:bbbb::1]:5693 -U drop=1-2 -D delay=0.02
+Proxy ready
+"""
+
+import asyncio
+import random
+import signal
+import socket
+import time
+from argparse import ArgumentParser
+
+import coap_msg
+from coap_results import ResultWriter
+from pcap_file import PcapWriter
+from readiness import split_host
+
+class Impairment():
+    """
+    Impairments for one direction of the proxy. See the module description
+    for the parameters.
+
+    :param drop: Collection of packet numbers to drop, from 1
+    """
+    REORDER_DELAY = 0.05
+
+    def __init__(self, loss=0, delay=0, jitter=0, rate=0, dup=0, reorder=0,
+                 drop=(), seed=0):
+        self.loss    = loss
+        self.delay   = delay
+        self.jitter  = jitter
+        self.rate    = rate
+        self.dup     = dup
+        self.reorder = reorder
+        self.drop    = frozenset(drop)
+        self._rng    = random.Random(seed)
+        # loop time when the link is free to send the next packet, for rate
+        self._free   = 0
+
+    def plan(self, num, size, now):
+        """
+        Decides the fate of a packet.
+
+        :param int num: Packet number in the session
+        :param float now: Loop time the packet was received
+        :return: list of loop times to send the packet; empty to drop it
+        """
+        # always draw the same values, so a packet's fate does not depend on
+        # the fate of earlier packets
+        lost, jitter, dup, reorder = (self._rng.random(), self._rng.random(),
+                                      self._rng.random(), self._rng.random())
+        if num in self.drop or lost < self.loss:
+            return []
+
+        sent = now
+        if self.rate:
+            # queue behind earlier packets, then take time to send
+            self._free = sent = max(now, self._free) + size / self.rate
+        when = sent + self.delay + jitter * self.jitter
+        if reorder < self.reorder:
+            when += self.REORDER_DELAY
+        return [when, when] if dup < self.dup else [when]
+
+
+def parse_spec(text, seed=0):
+    """Creates an Impairment from a spec like 'loss=0.1,delay=0.02'."""
+    kwargs = {}
+    for item in filter(None, text.split(',')):
+        name, value = item.split('=')
+        if name == 'drop':
+            nums = set()
+            for part in value.split(':'):
+                low, _, high = part.partition('-')
+                nums.update(range(int(low), int(high or low) + 1))
+            kwargs['drop'] = nums
+        elif name in ('loss', 'delay', 'jitter', 'rate', 'dup', 'reorder'):
+            kwargs[name] = float(value)
+        else:
+            raise ValueError('Unknown impairment: {0}'.format(name))
+    return Impairment(seed=seed, **kwargs)
+
+def format_endpoint(sockaddr):
+    return '[{0}]:{1}'.format(sockaddr[0], sockaddr[1])
+
+
+class Session():
+    """Upstream socket and packet counts for a client endpoint."""
+
+    def __init__(self, client, sock):
+        self.client = client
+        self.sock   = sock
+        self.counts = {'up': 0, 'down': 0}
+
+
+class ImpairProxy():
+    """
+    Forwards datagrams between clients and the upstream server, with
+    impairments, using the running event loop.
+
+    :param up: Impairment from client to server
+    :param down: Impairment from server to client
+    :param results: ResultWriter for the packet log
+    :param capture: PcapWriter for the packets, as the client sees them
+    """
+
+    def __init__(self, upstream, up, down, results=None, capture=None):
+        self._upstream = socket.getaddrinfo(*upstream, type=socket.SOCK_DGRAM)[0]
+        self._impair   = {'up': up, 'down': down}
+        self._results  = results or ResultWriter()
+        self._capture  = capture
+        self._sessions = {}
+        self._loop     = None
+        self._sock     = None
+
+    def start(self, listen):
+        """Binds the listen address, like (addr, port), and starts forwarding."""
+        info = socket.getaddrinfo(*listen, type=socket.SOCK_DGRAM)[0]
+        self._loop = asyncio.get_event_loop()
+        self._sock = socket.socket(info[0], socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+        self._sock.bind(info[4])
+        self._loop.add_reader(self._sock, self._from_client)
+
+    @property
+    def address(self):
+        """Provides the bound listen address, as (addr, port)."""
+        return self._sock.getsockname()[:2]
+
+    def close(self):
+        for sock in [self._sock] + [s.sock for s in self._sessions.values()]:
+            self._loop.remove_reader(sock)
+            sock.close()
+        self._sessions.clear()
+
+    def _from_client(self):
+        try:
+            data, client = self._sock.recvfrom(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        if self._capture:
+            self._capture.write_udp(client, self.address, data)
+        session = self._sessions.get(client)
+        if session is None:
+            sock = socket.socket(self._upstream[0], socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.connect(self._upstream[4])
+            session = self._sessions[client] = Session(client, sock)
+            self._loop.add_reader(sock, self._from_server, session)
+        self._forward(session, 'up', data, lambda d: session.sock.send(d))
+
+    def _from_server(self, session):
+        try:
+            data = session.sock.recv(65536)
+        except (BlockingIOError, InterruptedError, ConnectionRefusedError):
+            return
+        self._forward(session, 'down', data, lambda d: self._to_client(session, d))
+
+    def _to_client(self, session, data):
+        self._sock.sendto(data, session.client)
+        if self._capture:
+            self._capture.write_udp(self.address, session.client, data)
+
+    def _forward(self, session, direction, data, send):
+        session.counts[direction] += 1
+        num   = session.counts[direction]
+        now   = self._loop.time()
+        times = self._impair[direction].plan(num, len(data), now)
+        for when in times:
+            self._loop.call_at(when, self._send, send, data)
+
+        record = {'t': time.time(), 'dir': direction,
+                  'client': format_endpoint(session.client), 'num': num,
+                  'size': len(data), 'action': 'drop'}
+        if times:
+            record['action'] = 'duplicate' if len(times) > 1 else 'forward'
+            record['delay']  = times[0] - now
+        try:
+            msg = coap_msg.decode(data)
+            record.update(mtype=msg.mtype, code=coap_msg.code_text(msg.code),
+                          mid=msg.mid, token=msg.token.hex())
+        except ValueError:
+            pass
+        self._results.write(**record)
+
+    def _send(self, send, data):
+        try:
+            send(data)
+        except OSError:
+            # like a lossy link, do not fail on an unreachable endpoint
+            pass
+
+
+async def main(listen, upstream, up, down, resultsFile=None, pcapFile=None):
+    results = ResultWriter(resultsFile)
+    capture = PcapWriter(pcapFile) if pcapFile else None
+    proxy   = ImpairProxy(upstream, up, down, results, capture)
+    proxy.start(listen)
+
+    loop    = asyncio.get_event_loop()
+    stopped = loop.create_future()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, lambda: stopped.done() or stopped.set_result(None))
+    print('Proxy ready', flush=True)
+
+    # forward until stopped
+    try:
+        await stopped
+    finally:
+        proxy.close()
+        results.close()
+        if capture:
+            capture.close()
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-l', dest='listen', required=True,
+                        help='address to listen, like [fd00:bbbb::1]:5683')
+    parser.add_argument('-u', dest='upstream', required=True,
+                        help='server address, like [fd00:bbbb::1]:5693')
+    parser.add_argument('-U', dest='up', default='',
+                        help='impairments from client to server')
+    parser.add_argument('-D', dest='down', default='',
+                        help='impairments from server to client')
+    parser.add_argument('-s', dest='seed', type=int, default=0,
+                        help='seed for random impairments')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='JSON Lines file for a record of each packet')
+    parser.add_argument('-w', dest='pcapFile',
+                        help='pcap file for the packets')
+
+    args = parser.parse_args()
+
+    # different seeds per direction, so they are not correlated
+    asyncio.get_event_loop().run_until_complete(main(split_host(args.listen),
+                                                     split_host(args.upstream),
+                                                     parse_spec(args.up, args.seed),
+                                                     parse_spec(args.down, args.seed + 1),
+                                                     args.resultsFile, args.pcapFile))
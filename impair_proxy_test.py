@@ -0,0 +1,156 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests the impairment proxy with a Python echo endpoint on the loopback
+interface. Does not require RIOT.
+"""
+
+import asyncio
+import os
+import pexpect
+import pytest
+import signal
+import socket
+import threading
+
+import coap_msg
+from coap_results import ResultReader, ResultWriter
+from coap_trace import Trace
+from conftest import ExpectHost, udp_responder
+from impair_proxy import ImpairProxy, Impairment, parse_spec
+from pcap_file import PcapWriter
+
+#
+# fixtures and utility functions
+#
+
+@pytest.fixture
+def echo_server():
+    """Runs a UDP endpoint on ::1 that echoes each datagram.
+
+    :return: port for the endpoint
+    """
+    with udp_responder(lambda sock, data, remote: sock.sendto(data, remote)) as port:
+        yield port
+
+@pytest.fixture
+def run_proxy(echo_server, tmp_path):
+    """Provides a function to run a proxy to the echo server, in a thread with
+       its own event loop. The proxy writes its packet log to proxy.jsonl, and
+       the packets to proxy.pcap, in tmp_path.
+
+    :return: function(up, down) that returns the proxy listen port
+    """
+    loop    = asyncio.new_event_loop()
+    results = ResultWriter(str(tmp_path / 'proxy.jsonl'))
+    capture = PcapWriter(str(tmp_path / 'proxy.pcap'))
+    proxies = []
+
+    def run(up, down):
+        proxy = ImpairProxy(('::1', echo_server), up, down, results, capture)
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            proxy.start(('::1', 0))
+            started.set()
+            loop.run_forever()
+            loop.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait(2)
+        proxies.append(proxy)
+        return proxy.address[1]
+
+    yield run
+
+    # teardown
+    for proxy in proxies:
+        loop.call_soon_threadsafe(proxy.close)
+    loop.call_soon_threadsafe(loop.stop)
+    results.close()
+    capture.close()
+
+def exchange(port, payloads, timeout=0.3):
+    """Sends each payload to the port, and collects the datagrams received."""
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        for payload in payloads:
+            sock.sendto(payload, ('::1', port))
+        received = []
+        try:
+            while True:
+                received.append(sock.recv(2048))
+        except socket.timeout:
+            return received
+
+#
+# tests
+#
+
+def test_spec():
+    impair = parse_spec('loss=0.25,delay=0.02,drop=1-2:5')
+    assert impair.loss == 0.25 and impair.delay == 0.02
+    assert impair.drop == {1, 2, 5}
+    with pytest.raises(ValueError):
+        parse_spec('lose=0.1')
+
+def test_seeded():
+    """Loss is repeatable for a seed, and near the requested rate."""
+    plans = []
+    for j in range(2):
+        impair = Impairment(loss=0.5, seed=3)
+        plans.append([bool(impair.plan(i, 10, 0)) for i in range(1, 201)])
+    assert plans[0] == plans[1]
+    assert 70 < plans[0].count(False) < 130
+
+def test_rate():
+    """Packets queue behind each other at the rate limit, then are delayed."""
+    impair = Impairment(delay=0.1, rate=1000)
+    assert impair.plan(1, 100, 0) == pytest.approx([0.2])
+    assert impair.plan(2, 100, 0) == pytest.approx([0.3])
+    assert impair.plan(3, 100, 5) == pytest.approx([5.2])
+
+def test_proxy(run_proxy, tmp_path):
+    """Drops the first two requests upstream, and duplicates responses."""
+    port = run_proxy(parse_spec('drop=1-2'), parse_spec('dup=1'))
+    msgs = [coap_msg.encode(coap_msg.CON, coap_msg.GET, mid) for mid in range(4)]
+    assert exchange(port, msgs) == [msgs[2], msgs[2], msgs[3], msgs[3]]
+
+    records = ResultReader(str(tmp_path / 'proxy.jsonl')).read()
+    assert sorted((r['dir'], r['mid'], r['action']) for r in records) == [
+           ('down', 2, 'duplicate'), ('down', 3, 'duplicate'), ('up', 0, 'drop'),
+           ('up', 1, 'drop'), ('up', 2, 'forward'), ('up', 3, 'forward')]
+
+    # as the client sees them
+    trace = Trace.load(str(tmp_path / 'proxy.pcap'))
+    proxy = '[::1]:{0}'.format(port)
+    assert sorted((trace.endpoints[m[2]] == proxy, m[5]) for m in trace.messages) == [
+           (False, 2), (False, 2), (False, 3), (False, 3),
+           (True, 0), (True, 1), (True, 2), (True, 3)]
+
+def test_stop(echo_server, tmp_path):
+    """The proxy script closes its packet log and capture when terminated."""
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        sock.bind(('::1', 0))
+        port = sock.getsockname()[1]
+    host = ExpectHost(os.path.dirname(os.path.abspath(__file__)),
+                      './impair_proxy.py -l [::1]:{0} -u [::1]:{1} -j {2} -w {3}'.format(
+                      port, echo_server, tmp_path / 'proxy.jsonl', tmp_path / 'proxy.pcap'))
+    term = host.connect()
+    term.expect('Proxy ready')
+    msg = coap_msg.encode(coap_msg.NON, coap_msg.GET, 1)
+    assert exchange(port, [msg]) == [msg]
+
+    term.kill(signal.SIGTERM)
+    term.expect(pexpect.EOF, 5)
+    term.wait()
+    assert term.exitstatus == 0
+
+    records = ResultReader(str(tmp_path / 'proxy.jsonl')).read()
+    assert [r['dir'] for r in records] == ['up', 'down']
+    assert len(Trace.load(str(tmp_path / 'proxy.pcap')).messages) == 2
@@ -0,0 +1,88 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests allocation of network segments to parallel test workers. Uses Python
+stand-in endpoints on the loopback interface, so does not require RIOT.
+"""
+
+import pytest
+import socket
+import threading
+
+import coap_msg
+from conftest import NetAllocator
+from readiness import coap_ping, wait_ready
+
+#
+# fixtures and utility functions
+#
+
+WORKERS = 8
+
+def run_standin(port, stop):
+    """Runs a UDP endpoint on ::1 that answers a CoAP ping, until stop is set."""
+    with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+        sock.bind(('::1', port))
+        sock.settimeout(0.05)
+        while not stop.is_set():
+            try:
+                data, remote = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            msg = coap_msg.decode(data)
+            sock.sendto(coap_msg.encode(coap_msg.RST, coap_msg.EMPTY, msg.mid),
+                        remote)
+
+#
+# tests
+#
+
+@pytest.mark.parametrize('mode', ['tap', 'loopback'])
+def test_disjoint(mode):
+    """Segments for different workers share no interface, network or port."""
+    segments = [NetAllocator(mode).segment(i) for i in range(WORKERS)]
+
+    ports = [p for seg in segments for p in (seg.port, seg.port + 1, seg.alt_port,
+                                             seg.alt_port + 1)]
+    if mode == 'loopback':
+        ports += [p for seg in segments for p in (seg.sut_port, seg.sut_port + 1)]
+    assert len(ports) == len(set(ports))
+
+    if mode == 'tap':
+        assert segments[0].prefix == 'fd00:bbbb::'
+        assert segments[0].tap == 'tap0' and segments[0].tap_remote == 'tap1'
+        taps = [t for seg in segments for t in (seg.tap, seg.tap_remote)]
+        assert len(taps) == len(set(taps))
+        assert len({seg.prefix for seg in segments}) == WORKERS
+
+def test_parallel_loopback():
+    """Stand-in endpoints for all workers run concurrently without conflict."""
+    segments = [NetAllocator('loopback').segment(i) for i in range(WORKERS)]
+    stop     = threading.Event()
+    threads  = [threading.Thread(target=run_standin, args=(port, stop))
+                for seg in segments for port in (seg.port, seg.alt_port, seg.sut_port)]
+    for thread in threads:
+        thread.start()
+    try:
+        results = [None] * WORKERS
+
+        def worker(i):
+            seg = segments[i]
+            for port in (seg.port, seg.alt_port, seg.sut_port):
+                wait_ready(lambda: coap_ping(seg.sut_addr, port), timeout=2)
+            results[i] = True
+
+        clients = [threading.Thread(target=worker, args=(i,)) for i in range(WORKERS)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        assert all(results)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
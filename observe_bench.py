@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Benchmarks Observe fan-out for a CoAP server, like gcoap's /cli/stats or
+standin_server.py. Registers COUNT observers of a resource, triggers UPDATES
+updates of the resource at RATE per second, and measures notification latency
+for each observer, missed notifications, and how many registrations the
+server accepts, like the limits set by gcoap's GCOAP_OBS_CLIENTS_MAX and
+GCOAP_OBS_REGISTRATIONS_MAX.
+
+Observers are spread over SOCKETS local UDP sockets, so a server sees
+SOCKETS distinct endpoints. Each observer has its own token. A server refuses
+a registration by responding without an Observe option.
+
+An update is triggered by a NON GET of TRIGGER_PATH on the same server, which
+updates /cli/stats for standin_server.py. gcoap updates /cli/stats only when
+it sends a request from its shell, so observe_bench_test.py drives gcoap by
+calling run_bench() with its own trigger.
+
+Latency for a notification is the time since the most recent trigger, so
+the update period must be longer than the slowest notification. A
+notification that does not follow a new trigger is counted as a duplicate.
+Uses its own minimal client over plain UDP sockets, built on coap_endpoint.py,
+so it does not support DTLS.
+
+Usage:
+    usage: observe_bench.py -r HOST [-p PATH] [-n COUNT] [-s SOCKETS]
+                            [-u TRIGGER_PATH] [-U UPDATES] [-R RATE]
+                            [-w TIMEOUT] [-j FILE]
+    usage: observe_bench.py -h
+
+    optional arguments:
+      -h, --help       show this help message and exit
+      -r HOST          remote host, like [fd00:bbbb::2] or [::1]:5683
+      -p PATH          path of observed resource; /cli/stats by default
+      -n COUNT         count of observers; 10 by default
+      -s SOCKETS       count of local sockets for observers; COUNT by default
+      -u TRIGGER_PATH  path to GET to trigger an update; /cli/stats by default
+      -U UPDATES       count of updates; 20 by default
+      -R RATE          updates per second; 2 by default
+      -w TIMEOUT       seconds to wait for a response, and for the last
+                       notifications; 2 by default
+      -j FILE          write a JSON Lines record for each observer, and for the
+                       summary; see coap_results.py
+
+Example:
+
+$ ./observe_bench.py -r [::1]:5687 -n 200 -s 20 -U 10 -R 5
+Registered 200 of 200 observers on 20 sockets in 0.213 s; 0 refused, 0 timed out
+Updates: 10 at 5.0/s; received 2000 of 2000 notifications, missed 0 (0.0%), 0 duplicate
+Latency p50 2.113 p90 3.820 p99 4.501 p99.9 4.622 max 4.622 ms
+Per observer: missed max 0; p50 min 0.402 max 4.313 ms
+"""
+
+import asyncio
+import os
+import random
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+
+import coap_msg
+from coap_endpoint import CoapEndpoint
+from coap_results import ResultWriter
+from coap_stats import Histogram, format_latency, summary_fields
+from conftest import proto_params
+from readiness import split_host
+
+class Observer():
+    """Registration state and notification statistics for one observer."""
+
+    def __init__(self, index, endpoint):
+        self.index    = index
+        self.endpoint = endpoint
+        self.token    = os.urandom(4)
+        # 'registered', 'refused', 'timeout', or a response code text
+        self.status   = None
+        self.notifications = 0
+        self.duplicates    = 0
+        self.last_update   = 0
+        self.latency  = Histogram()
+
+
+class ObserverEndpoint(CoapEndpoint):
+    """
+    Local socket for a group of observers. Sends their requests, and records a
+    notification for an observer's token. A notification for an unknown token
+    is reset, so the server removes a stale registration.
+    """
+
+    def __init__(self, bench):
+        super().__init__()
+        self.bench     = bench
+        self.observers = {}
+
+    def unmatched(self, msg):
+        observer = self.observers.get(msg.token)
+        if observer is None:
+            return False
+        self.bench.notified(observer)
+        return True
+
+    async def observe(self, observer, path, observe, timeout):
+        """
+        Sends a CON GET with the Observe option for the observer, and waits for
+        the response.
+
+        :param int observe: 0 to register, 1 to cancel
+        :return: response Message, or None if no response
+        """
+        options = coap_msg.path_options(path)
+        options.append((coap_msg.OBSERVE, coap_msg.encode_uint(observe)))
+        return await self.request(coap_msg.GET, options, timeout=timeout,
+                                  token=observer.token)
+
+
+class CoapTrigger():
+    """Triggers an update with a NON GET of a path on the server."""
+
+    def __init__(self, addr, port, path):
+        info = socket.getaddrinfo(addr, port, type=socket.SOCK_DGRAM)[0]
+        self._sock    = socket.socket(info[0], socket.SOCK_DGRAM)
+        self._remote  = info[4]
+        self._options = coap_msg.path_options(path)
+        self._mid     = random.getrandbits(16)
+
+    def __call__(self):
+        self._mid = (self._mid + 1) & 0xFFFF
+        self._sock.sendto(coap_msg.encode(coap_msg.NON, coap_msg.GET, self._mid,
+                                          os.urandom(2), self._options), self._remote)
+
+    def close(self):
+        self._sock.close()
+
+
+class ObserveBench():
+    """Tracks the current update, and records notifications against it."""
+
+    def __init__(self):
+        self.update       = 0
+        self.trigger_time = None
+
+    def notified(self, observer):
+        if self.trigger_time is None:
+            # before the first trigger, or after the last
+            return
+        if observer.last_update >= self.update:
+            observer.duplicates += 1
+            return
+        observer.last_update    = self.update
+        observer.notifications += 1
+        observer.latency.record((time.monotonic() - self.trigger_time) * 1e6)
+
+
+async def run_bench(addr, port, trigger, path='/cli/stats', count=10, sockets=None,
+                    updates=20, rate=2.0, timeout=2.0, resultsFile=None):
+    """
+    Registers observers, triggers updates, and reports notification statistics.
+
+    :param trigger: Callable to trigger an update of the resource; may return
+                    an awaitable
+    :param int sockets: Count of local sockets for observers; count if None
+    :return: list of Observer
+    """
+    loop      = asyncio.get_event_loop()
+    bench     = ObserveBench()
+    results   = ResultWriter(resultsFile)
+    family    = socket.getaddrinfo(addr, port, type=socket.SOCK_DGRAM)[0][0]
+    endpoints = []
+    for i in range(min(sockets or count, count)):
+        _, endpoint = await loop.create_datagram_endpoint(lambda: ObserverEndpoint(bench),
+                                                          remote_addr=(addr, port),
+                                                          family=family)
+        endpoints.append(endpoint)
+
+    observers = []
+    try:
+        # register
+        start = time.monotonic()
+        for i in range(count):
+            observer = Observer(i, endpoints[i % len(endpoints)])
+            observer.endpoint.observers[observer.token] = observer
+            observers.append(observer)
+            response = await observer.endpoint.observe(observer, path, 0, timeout)
+            if response is None:
+                observer.status = 'timeout'
+            elif response.code != coap_msg.CONTENT:
+                observer.status = coap_msg.code_text(response.code)
+            elif coap_msg.get_option(response, coap_msg.OBSERVE) is None:
+                observer.status = 'refused'
+            else:
+                observer.status = 'registered'
+        reg_time   = time.monotonic() - start
+        registered = [o for o in observers if o.status == 'registered']
+        refused    = sum(o.status == 'refused' for o in observers)
+        timeouts   = sum(o.status == 'timeout' for o in observers)
+        print('Registered {0} of {1} observers on {2} sockets in {3:.3f} s; {4} refused, '
+              '{5} timed out'.format(len(registered), count, len(endpoints), reg_time,
+                                     refused, timeouts), flush=True)
+
+        # trigger updates
+        period = 1 / rate
+        start  = time.monotonic()
+        for i in range(updates):
+            bench.update       = i + 1
+            bench.trigger_time = time.monotonic()
+            result = trigger()
+            if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                await result
+            await asyncio.sleep(max(start + (i + 1) * period - time.monotonic(), 0))
+        # wait for the last notifications
+        await asyncio.sleep(max(timeout - period, 0))
+        bench.trigger_time = None
+
+        # cancel registrations, so a server reused by a later test is not
+        # notifying stale observers
+        for observer in registered:
+            await observer.endpoint.observe(observer, path, 1, timeout)
+    finally:
+        for endpoint in endpoints:
+            endpoint.transport.close()
+
+    latency  = Histogram()
+    for observer in registered:
+        latency.merge(observer.latency)
+    expected = updates * len(registered)
+    missed   = expected - latency.count
+    dups     = sum(o.duplicates for o in registered)
+    print('Updates: {0} at {1:.1f}/s; received {2} of {3} notifications, missed {4} '
+          '({5:.1f}%), {6} duplicate'.format(updates, rate, latency.count, expected,
+                                             missed, 100 * missed / expected if expected else 0,
+                                             dups), flush=True)
+    print('Latency {0}'.format(format_latency(latency)), flush=True)
+    if registered:
+        p50s = [o.latency.value_at(50) for o in registered if o.latency.count]
+        print('Per observer: missed max {0}; p50 min {1} max {2} ms'.format(
+              max(updates - o.notifications for o in registered),
+              '{0:.3f}'.format(min(p50s) / 1000) if p50s else '-',
+              '{0:.3f}'.format(max(p50s) / 1000) if p50s else '-'), flush=True)
+
+    for observer in observers:
+        results.write(bench='observer', index=observer.index, status=observer.status,
+                      notifications=observer.notifications,
+                      missed=updates - observer.notifications
+                             if observer.status == 'registered' else None,
+                      duplicates=observer.duplicates, **summary_fields(observer.latency))
+    results.write(bench='fanout', observers=count, sockets=len(endpoints),
+                  registered=len(registered), refused=refused, timeouts=timeouts,
+                  registration_time=reg_time, updates=updates, rate=rate,
+                  expected=expected, received=latency.count, missed=missed,
+                  duplicates=dups, **summary_fields(latency))
+    results.close()
+    return observers
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-r', dest='host', required=True,
+                        help='remote host, like [fd00:bbbb::2]')
+    parser.add_argument('-p', dest='path', default='/cli/stats',
+                        help='path of observed resource')
+    parser.add_argument('-n', dest='count', type=int, default=10,
+                        help='count of observers')
+    parser.add_argument('-s', dest='sockets', type=int,
+                        help='count of local sockets for observers')
+    parser.add_argument('-u', dest='trigger_path', default='/cli/stats',
+                        help='path to GET to trigger an update')
+    parser.add_argument('-U', dest='updates', type=int, default=20,
+                        help='count of updates')
+    parser.add_argument('-R', dest='rate', type=float, default=2.0,
+                        help='updates per second')
+    parser.add_argument('-w', dest='timeout', type=float, default=2.0,
+                        help='seconds to wait for a response')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='JSON Lines file for a record of each observer')
+
+    args = parser.parse_args()
+    if proto_params['is_dtls']:
+        sys.exit('observe_bench.py supports plain UDP only')
+
+    addr, port = split_host(args.host)
+    trigger    = CoapTrigger(addr, port, args.trigger_path)
+    try:
+        asyncio.get_event_loop().run_until_complete(run_bench(addr, port, trigger,
+                                                              args.path, args.count,
+                                                              args.sockets, args.updates,
+                                                              args.rate, args.timeout,
+                                                              args.resultsFile))
+    finally:
+        trigger.close()
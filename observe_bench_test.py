@@ -0,0 +1,131 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests Observe fan-out with observe_bench.py. The first test uses a Python
+observable responder, so does not require RIOT. The benchmarks run against
+the Python stand-in server, and gcoap.
+"""
+
+import asyncio
+import logging
+import os
+import pytest
+
+import coap_msg
+from coap_results import ResultReader
+from conftest import net, proto_params, proto_port, run_bench_script, standin_addr
+from conftest import udp_responder
+from observe_bench import CoapTrigger, run_bench
+
+logging.basicConfig(level=logging.INFO)
+
+#
+# fixtures and utility functions
+#
+
+@pytest.fixture
+def observe_responder():
+    """
+    Runs a UDP endpoint on ::1 with an observable /cli/stats resource. Accepts
+    at most 4 registrations, and refuses more by responding without the
+    Observe option, like gcoap's registration limits. A GET without Observe
+    updates the resource, and notifies each observer.
+
+    :return: port for the endpoint
+    """
+    observers = {}
+    state = {'count': 0, 'mid': 0}
+
+    def respond(sock, data, remote):
+        msg = coap_msg.decode(data)
+        if msg.code == coap_msg.EMPTY:
+            return
+        observe = coap_msg.get_option(msg, coap_msg.OBSERVE)
+        options = []
+        if observe == b'' and (len(observers) < 4 or (remote, msg.token) in observers):
+            observers[(remote, msg.token)] = True
+            options = [(coap_msg.OBSERVE, coap_msg.encode_uint(state['count']))]
+        elif observe == b'\x01':
+            observers.pop((remote, msg.token), None)
+        elif observe is None:
+            state['count'] += 1
+
+        mtype = coap_msg.ACK if msg.mtype == coap_msg.CON else coap_msg.NON
+        sock.sendto(coap_msg.encode(mtype, coap_msg.CONTENT, msg.mid, msg.token,
+                                    options, str(state['count']).encode()), remote)
+        if observe is None:
+            for obs_remote, token in list(observers):
+                state['mid'] = (state['mid'] + 1) & 0xFFFF
+                sock.sendto(coap_msg.encode(coap_msg.NON, coap_msg.CONTENT,
+                                            state['mid'], token,
+                                            [(coap_msg.OBSERVE,
+                                              coap_msg.encode_uint(state['count']))],
+                                            str(state['count']).encode()), obs_remote)
+
+    with udp_responder(respond) as port:
+        yield port
+
+#
+# tests
+#
+
+def test_limit(observe_responder, tmp_path):
+    """Observers beyond the server's limit are refused. Each registered
+       observer receives a notification for every update."""
+    results = ResultReader(str(tmp_path / 'bench.jsonl'))
+    trigger = CoapTrigger('::1', observe_responder, '/cli/stats')
+    observers = asyncio.run(run_bench('::1', observe_responder, trigger, count=6,
+                                      sockets=3, updates=5, rate=20, timeout=0.2,
+                                      resultsFile=results.path))
+    trigger.close()
+
+    assert [o.status for o in observers] == ['registered'] * 4 + ['refused'] * 2
+    for observer in observers[:4]:
+        assert observer.notifications == 5
+        assert observer.latency.count == 5
+
+    summary = results.read()[-1]
+    assert summary['bench'] == 'fanout'
+    assert summary['registered'] == 4 and summary['refused'] == 2
+    assert summary['missed'] == 0 and summary['duplicates'] == 0
+    assert summary['count'] == 20
+
+@pytest.mark.benchmark
+def test_standin(standin_server, tmp_path):
+    """Hundreds of observers for the stand-in server, which does not limit
+       registrations."""
+    count   = int(os.environ.get('OBSERVE_BENCH_COUNT', '200'))
+    records = run_bench_script(tmp_path, './observe_bench.py -r [{0}]:{1} -n {2} -s {3} '
+                                         '-U 10 -R 5'.format(*standin_addr(), count,
+                                                             max(count // 10, 1)), 300)
+
+    summary = records[-1]
+    assert summary['registered'] == count
+    assert summary['missed'] == 0
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(proto_params['is_dtls'], reason='observe_bench.py requires UDP')
+def test_gcoap(gcoap_example, libcoap_server, libcoap_port, tmp_path):
+    """Observers for gcoap /cli/stats. gcoap updates /cli/stats when it sends a
+       request, so each trigger sends a request from the gcoap shell to the
+       libcoap server. At least one observer registers, and is notified."""
+    count   = int(os.environ.get('OBSERVE_BENCH_COUNT', '8'))
+    results = ResultReader(str(tmp_path / 'bench.jsonl'))
+    cmd     = 'coap get -c {0} {1} /time'.format(net.remote_addr,
+                                                 proto_port(int(libcoap_port)))
+
+    observers = asyncio.run(run_bench(net.sut_addr, net.sut_port,
+                                      lambda: gcoap_example.term.sendline(cmd),
+                                      count=count, updates=10, rate=2,
+                                      resultsFile=results.path))
+    gcoap_example.drain()
+    logging.info('Registered {0} of {1} observers'.format(
+                 sum(o.status == 'registered' for o in observers), count))
+
+    summary = results.read()[-1]
+    assert summary['registered'] >= 1
+    assert summary['received'] > 0
@@ -16,14 +16,45 @@ notification to aiocoap.
 Expected result: aiocoap prints response code 2.05 and payload for initial
 response to Observe request, and for following notification.
 
+With -d or -N, consumes the notification stream rather than stopping after the
+first notification. Tracks Observe values for freshness, like RFC 7641, and
+also the count in the /cli/stats payload, which increments for each change of
+the resource. So the summary counts state changes skipped because the
+resource changed faster than notifications were delivered. Prints a summary
+when the stream ends:
+
+Stream: 120 notifications in 10.0 s, 12.0/s; 100 NON, 20 CON
+Observe: 118 fresh, 1 reordered, 1 duplicate, 0 gaps
+State: 37 changes skipped
+Inter-arrival p50 ... ms
+
+With more than one target, from -r given more than once or -p with more than
+one path, observes each path on each host concurrently in the one context,
+until DURATION has elapsed or a total of COUNT notifications. Re-registers a
+target if its observation ends, or if no notification arrives within its
+Max-Age. Prints a summary for each target, and for all targets, like:
+
+coap://[fd00:bbbb::2]/cli/stats: 60 notifications; 0 reordered, 0 duplicate; 1 registrations; registration p50 1.402 ms; inter-arrival p50 166.015 ms
+coap://[::1]:5687/cli/stats: 58 notifications; 0 reordered, 0 duplicate; 2 registrations; registration p50 0.981 ms; inter-arrival p50 170.111 ms
+Observed 2 targets: 118 notifications in 10.0 s, 11.8/s; 1 re-registrations; client CPU 0.085 s, 720 us per notification
+
 Usage:
-    usage: observe_client.py -r HOST [-c FILE]
+    usage: observe_client.py -r HOST [-r HOST ...] [-p PATHS] [-c FILE] [-j FILE]
+                             [-d DURATION] [-N COUNT]
     usage: observe_client.py -h
 
     optional arguments:
       -h, --help  show this help message and exit
-      -r HOST     remote host for URI
+      -r HOST     remote host for URI; repeat for more hosts
+      -p PATHS    comma separated paths to observe on each host; /cli/stats
+                  by default
       -c FILE     DTLS credentials file, name format: *.json
+      -j FILE     write a JSON Lines record for each response and
+                  notification, and for the stream summary; see
+                  coap_results.py
+      -d DURATION consume notifications for DURATION seconds
+      -N COUNT    consume COUNT notifications, or until DURATION; for all
+                  targets together
 
 2019-12-19 Added support here for DTLS use, but waiting on aiocoap DTLS server
 support. See https://github.com/chrysn/aiocoap/issues/98.
@@ -48,16 +79,25 @@ Loop ended, wait 10 sec
 """
 
 import asyncio
+import collections
 import datetime
 import json
 import logging
+import os
+import time
 from argparse import ArgumentParser
+from coap_results import ResultWriter
+from coap_stats import Histogram, ObserveSequence, format_latency, summary_fields
 from conftest import proto_params
 from pathlib import Path
+from readiness import coap_ping, split_host, wait_ready_async
 
 import aiocoap.resource as resource
 from aiocoap import *
 
+# seconds to wait before a target is registered again
+REREGISTER_DELAY = 1.0
+
 class TimeResource(resource.Resource):
     """Handle GET for clock time."""
 
@@ -69,7 +109,165 @@ class TimeResource(resource.Resource):
         return msg
 
 
-async def main(host, credentialsFile):
+async def observe_stream(req, results, sent, duration=None, count=None):
+    """
+    Consumes notifications until count are received, duration has elapsed,
+    or the observation ends. Prints a summary.
+
+    :return: ObserveSequence for the Observe values
+    """
+    sequence = ObserveSequence()
+    state    = ObserveSequence()
+    mtypes   = collections.Counter()
+    start    = time.monotonic()
+
+    async def consume():
+        async for resp in req.observation:
+            now = time.monotonic()
+            if resp.opt.observe is None:
+                # final response; server ended the observation
+                break
+            sequence.record(resp.opt.observe, now)
+            mtypes[resp.mtype.name] += 1
+            try:
+                state.record(int(resp.payload), now)
+            except ValueError:
+                pass
+            results.exchange(resp, sent, event='notification', observe=resp.opt.observe)
+            if count and sequence.received >= count:
+                break
+
+    try:
+        await asyncio.wait_for(consume(), duration)
+    except asyncio.TimeoutError:
+        pass
+    except Exception as e:
+        logging.warning('Observation ended: %r'%e)
+    elapsed = time.monotonic() - start
+
+    print('Stream: {0} notifications in {1:.1f} s, {2:.1f}/s; {3}'.format(
+          sequence.received, elapsed, sequence.received / elapsed if elapsed else 0,
+          ', '.join('{0} {1}'.format(n, t) for t, n in sorted(mtypes.items())) or 'none'))
+    print('Observe: {0} fresh, {1} reordered, {2} duplicate, {3} gaps'.format(
+          sequence.fresh, sequence.reordered, sequence.duplicates, sequence.gaps))
+    if state.received:
+        print('State: {0} changes skipped'.format(state.gaps))
+    print('Inter-arrival {0}'.format(format_latency(sequence.interarrival)), flush=True)
+    results.write(event='summary', elapsed=elapsed, state_gaps=state.gaps,
+                  mtypes=dict(mtypes), **sequence.counters(),
+                  **summary_fields(sequence.interarrival))
+    return sequence
+
+class Target():
+    """Observation of a resource on a host, and its statistics."""
+
+    def __init__(self, host, path):
+        self.host = host
+        self.uri  = '{0}://{1}{2}'.format(proto_params['uri_proto'], host, path)
+        self.sequence      = ObserveSequence()
+        # microseconds from request to registration response
+        self.registration  = Histogram()
+        self.registrations = 0
+
+
+async def observe_target(context, target, results, on_notification):
+    """
+    Maintains the observation of a target until cancelled. Registers again if
+    the observation ends, or if no notification arrives within the Max-Age of
+    the previous one.
+    """
+    while True:
+        target.registrations += 1
+        target.sequence.restart()
+        sent = time.monotonic()
+        req  = context.request(Message(code=GET, uri=target.uri, observe=0))
+        try:
+            resp = await req.response
+            target.registration.record((time.monotonic() - sent) * 1e6)
+            results.exchange(resp, sent, event='response', uri=target.uri)
+            if resp.opt.observe is None:
+                raise ValueError('not observable, {0}'.format(resp.code))
+
+            notifications = req.observation.__aiter__()
+            while True:
+                # allow for network delay beyond Max-Age
+                resp = await asyncio.wait_for(notifications.__anext__(),
+                                              (resp.opt.max_age or 60) + 5)
+                if resp.opt.observe is None:
+                    raise ValueError('observation ended, {0}'.format(resp.code))
+                target.sequence.record(resp.opt.observe)
+                results.exchange(resp, sent, event='notification', uri=target.uri,
+                                 observe=resp.opt.observe)
+                on_notification()
+        except asyncio.CancelledError:
+            req.observation.cancel()
+            raise
+        except Exception as e:
+            logging.warning('Lost observation of %s: %r', target.uri, e)
+        req.observation.cancel()
+        await asyncio.sleep(REREGISTER_DELAY)
+
+async def observe_all(context, targets, results, duration=None, count=None):
+    """
+    Observes all targets concurrently until count notifications are received
+    in total, or duration has elapsed. Then cancels the registrations, and
+    prints a summary.
+    """
+    done  = asyncio.Event()
+    total = collections.Counter()
+
+    def on_notification():
+        total['notifications'] += 1
+        if count and total['notifications'] >= count:
+            done.set()
+
+    start = time.monotonic()
+    cpu   = time.process_time()
+    tasks = [asyncio.ensure_future(observe_target(context, t, results, on_notification))
+             for t in targets]
+    try:
+        await asyncio.wait_for(done.wait(), duration)
+    except asyncio.TimeoutError:
+        pass
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.monotonic() - start
+    cpu     = time.process_time() - cpu
+
+    # cancel registrations at the servers
+    async def cancel(target):
+        req = context.request(Message(code=GET, uri=target.uri, observe=1))
+        await asyncio.wait_for(req.response, 10)
+    await asyncio.gather(*[cancel(t) for t in targets], return_exceptions=True)
+
+    for target in targets:
+        seq = target.sequence
+        print('{0}: {1} notifications; {2} reordered, {3} duplicate; {4} registrations; '
+              'registration p50 {5}; inter-arrival p50 {6}'.format(
+              target.uri, seq.received, seq.reordered, seq.duplicates,
+              target.registrations, format_p50(target.registration),
+              format_p50(seq.interarrival)))
+        results.write(event='target', uri=target.uri, registrations=target.registrations,
+                      registration_p50=target.registration.value_at(50),
+                      **seq.counters(), **summary_fields(seq.interarrival))
+
+    received = sum(t.sequence.received for t in targets)
+    reregistrations = sum(t.registrations - 1 for t in targets)
+    print('Observed {0} targets: {1} notifications in {2:.1f} s, {3:.1f}/s; '
+          '{4} re-registrations; client CPU {5:.3f} s, {6:.0f} us per notification'.format(
+          len(targets), received, elapsed, received / elapsed if elapsed else 0,
+          reregistrations, cpu, cpu * 1e6 / received if received else 0), flush=True)
+    results.write(event='aggregate', targets=len(targets), received=received,
+                  elapsed=elapsed, reregistrations=reregistrations, cpu=cpu)
+
+def format_p50(hist):
+    p50 = hist.value_at(50)
+    return '-' if p50 is None else '{0:.3f} ms'.format(p50 / 1000)
+
+async def main(hosts, credentialsFile, resultsFile=None, duration=None, count=None,
+               paths=('/cli/stats',)):
+    results = ResultWriter(resultsFile)
     # setup server resources
     # As of 2019-12, not using server resources because DTLS server mode not
     # supported.
@@ -77,40 +275,78 @@ async def main(host, credentialsFile):
     root.add_resource(('time',), TimeResource())
 
     context = await Context.create_server_context(root)
+    try:
+        await observe_hosts(context, hosts, credentialsFile, results, duration, count,
+                            paths)
+    finally:
+        results.close()
+        await context.shutdown()
+
+async def observe_hosts(context, hosts, credentialsFile, results, duration, count,
+                        paths):
     if proto_params['is_dtls']:
         context.client_credentials.load_from_dict(json.load(credentialsFile.open('rb')))
+    else:
+        # DTLS server ignores a plain CoAP ping; rely on handshake retries
+        for host in hosts:
+            addr, port = split_host(host, proto_params['port'])
+            await wait_ready_async(lambda: coap_ping(addr, port), host)
+    print('Client ready', flush=True)
 
-    uri = '{0}://{1}/cli/stats'.format(proto_params['uri_proto'], host)
+    targets = [Target(host, path) for host in hosts for path in paths]
+    if len(targets) > 1:
+        await observe_all(context, targets, results, duration, count)
+        return
+
+    uri = targets[0].uri
     msg = Message(code=GET, uri=uri, observe=0)
+    sent = time.monotonic()
     req = context.request(msg)
 
     resp = await req.response
+    results.exchange(resp, sent, event='response')
     print('First response: %s\n%r'%(resp, resp.payload))
 
-    async for resp in req.observation:
-        # We expect some other process to send another request, which generates
-        # an observe notification.
-        print('Next result: %s\n%r'%(resp, resp.payload))
-
+    if duration or count:
+        await observe_stream(req, results, sent, duration, count)
         req.observation.cancel()
-        break
+    else:
+        async for resp in req.observation:
+            # We expect some other process to send another request, which
+            # generates an observe notification.
+            # rtt is time since registration
+            results.exchange(resp, sent, event='notification', observe=resp.opt.observe)
+            print('Next result: %s\n%r'%(resp, resp.payload))
+
+            req.observation.cancel()
+            break
 
     # Send msg to cancel observation
-    uri = '{0}://{1}/cli/stats'.format(proto_params['uri_proto'], host)
     msg = Message(code=GET, uri=uri, observe=1)
     req = context.request(msg)
     resp = await req.response
     print('Final result: %s\n%r'%(resp, resp.payload))
 
-if __name__ == "__main__":
-    # read command line
-    parser = ArgumentParser()
-    parser.add_argument('-r', dest='host', required=True,
-                        help='remote host for URI')
+def command(argv=None):
+    """Reads the command line, and provides the main() coroutine for it. Also
+       used by scenario_daemon.py."""
+    parser = ArgumentParser(prog=os.path.basename(__file__))
+    parser.add_argument('-r', dest='hosts', action='append', required=True,
+                        help='remote host for URI; repeat for more hosts')
+    parser.add_argument('-p', dest='paths', default='/cli/stats',
+                        help='comma separated paths to observe on each host')
     parser.add_argument('-c', dest='credentialsFile', type=Path,
                         help='DTLS credentials file, name format: *.json')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='JSON Lines file for a record of each response')
+    parser.add_argument('-d', dest='duration', type=float,
+                        help='seconds to consume notifications')
+    parser.add_argument('-N', dest='count', type=int,
+                        help='count of notifications to consume')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    return main(args.hosts, args.credentialsFile, args.resultsFile, args.duration,
+                args.count, args.paths.split(','))
 
-    asyncio.get_event_loop().run_until_complete(main(args.host,
-                                                     args.credentialsFile))
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(command())
@@ -12,10 +12,12 @@ Observe cancellation.
 import pytest
 import logging
 import os
-import time
+import re
 
 from conftest import ExpectHost
-from conftest import proto_params
+from conftest import net, proto_params, proto_port, standin_addr
+from observe_bench import CoapTrigger
+from readiness import banner, wait_ready
 
 pwd = os.getcwd()
 #logging.basicConfig(level=logging.INFO, filename='run.log')
@@ -25,36 +27,46 @@ pwd = os.getcwd()
 #
 
 @pytest.fixture
-def aiocoap_client():
+def observe_args():
+    """Provides additional arguments for observe_client.py."""
+    return ''
+
+@pytest.fixture
+def aiocoap_client(client_cmd, observe_args):
     """Registers an observe client and waits for a notification."""
 
     # server handles same quantity of messages as client sends
     dtls_arg = '-c dtls-credentials.json' if proto_params['is_dtls'] else ''
-    cmd = './observe_client.py -r [fd00:bbbb::2] {0}'.format(dtls_arg)
+    cmd = client_cmd('observe_client.py', '-r {0} {1} {2}'.format(net.sut_host(),
+                                                                  dtls_arg, observe_args))
 
     #host = ExpectHost(pwd, cmd, putenv={'PYTHONPATH' : '/home/kbee/dev/aiocoap/repo'})
     host = ExpectHost(pwd, cmd)
     term = host.connect()
-    # allow a couple of seconds for initialization
-    time.sleep(2)
+    wait_ready(lambda: banner(term, 'Client ready'), 'aiocoap client')
     yield host
 
     # teardown
-    host.disconnect()
+    host.disconnect(True)
+
+@pytest.fixture(scope='session')
+def libcoap_port(net_segment):
+    """Runs libcoap_server on the alternative port, since observe_client.py
+       uses the default port for its own /time resource."""
+    return str(net_segment.alt_port)
 
 #
 # tests
 #
 
-@pytest.mark.parametrize('libcoap_port', ['5685'])
 def test_observe(gcoap_example, aiocoap_client, libcoap_server):
     """Verify registration, notification, and cancellation."""
     # Registration OK; expecting 2 options -- Observer and Content-Format
     aiocoap_client.term.expect(r'First response:.*2\.05.*2 option')
 
     # send query to update stats and trigger notification
-    dest_port = '5686' if proto_params['is_dtls'] else '5685'
-    gcoap_example.send_recv('coap get -c fd00:bbbb::1 {0} /time'.format(dest_port),
+    cmd = 'coap get -c {0} {1} /time'.format(net.remote_addr, proto_port(net.alt_port))
+    gcoap_example.send_recv(cmd,
                             r'Success')
 
     # Notification OK; expecting 2 options -- Observer and Content-Format
@@ -62,3 +74,42 @@ def test_observe(gcoap_example, aiocoap_client, libcoap_server):
 
     # Observe cancellation OK; expecting only 1 option -- Content-Format
     aiocoap_client.term.expect(r'Final result:.*2\.05.*1 option')
+
+@pytest.mark.parametrize('observe_args', ['-d 5'])
+def test_observe_stream(gcoap_example, aiocoap_client, libcoap_server):
+    """Consume the notification stream while the resource changes faster than
+       gcoap may notify. gcoap notifies the latest state, so a skipped change
+       is not an error, but a notification must not be stale."""
+    aiocoap_client.term.expect(r'First response:.*2\.05')
+
+    # send requests without waiting for responses, to update stats quickly
+    cmd = 'coap get {0} {1} /time'.format(net.remote_addr, proto_port(net.alt_port))
+    for i in range(20):
+        gcoap_example.term.sendline(cmd)
+
+    aiocoap_client.term.expect(r'Stream: (\d+) notifications')
+    assert int(aiocoap_client.term.match.group(1)) > 0
+    aiocoap_client.term.expect(r'Observe: \d+ fresh, (\d+) reordered, (\d+) duplicate')
+    assert aiocoap_client.term.match.group(1) == '0'
+    assert aiocoap_client.term.match.group(2) == '0'
+    aiocoap_client.term.expect(r'Final result:.*2\.05.*1 option')
+    gcoap_example.drain()
+
+@pytest.mark.skipif(proto_params['is_dtls'], reason='stand-in target requires UDP')
+@pytest.mark.parametrize('observe_args',
+                         ['-r [{0}]:{1} -d 5'.format(*standin_addr())])
+def test_observe_multi(gcoap_example, standin_server, aiocoap_client, libcoap_server):
+    """Observe gcoap and the stand-in server concurrently, from one context.
+       Each target is notified of its updates."""
+    trigger = CoapTrigger(*standin_addr(), '/cli/stats')
+    cmd = 'coap get {0} {1} /time'.format(net.remote_addr, proto_port(net.alt_port))
+    for i in range(5):
+        gcoap_example.send_recv(cmd, r'Success')
+        trigger()
+    trigger.close()
+
+    for target in (net.sut_host(), '[{0}]:{1}'.format(*standin_addr())):
+        aiocoap_client.term.expect(r'{0}/cli/stats: (\d+) notifications'.format(
+                                   re.escape(target)))
+        assert int(aiocoap_client.term.match.group(1)) > 0
+    aiocoap_client.term.expect(r'Observed 2 targets: (\d+) notifications')
@@ -0,0 +1,105 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Payload sources for large transfers. A source provides any range of its
+payload on demand, so a client may send a multi-megabyte payload block by
+block in constant memory, and hash it as it goes.
+
+Each source has a 'size' attribute, and a read(offset, length) method that
+returns bytes. Use open_payload() to create a source from a payload spec.
+"""
+
+import hashlib
+import mmap
+import struct
+
+class BytesPayload():
+    """Payload from a bytes object in memory."""
+
+    def __init__(self, data):
+        self._data = data
+        self.size  = len(data)
+
+    def read(self, offset, length):
+        return self._data[offset:offset+length]
+
+    def close(self):
+        pass
+
+
+class FilePayload():
+    """Payload from a file, memory mapped so only the pages read are loaded."""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._file.seek(0, 2)
+        self.size  = self._file.tell()
+        # cannot map an empty file
+        self._map  = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+                     if self.size else b''
+
+    def read(self, offset, length):
+        return self._map[offset:offset+length]
+
+    def close(self):
+        if self.size:
+            self._map.close()
+        self._file.close()
+
+
+class SeededPayload():
+    """
+    Deterministic pseudo-random payload of a given size. Content depends only
+    on the seed, not on how it is read, so sender and receiver may generate it
+    independently. Generated in 32 byte units, as the SHA256 digest of the seed
+    and unit index.
+    """
+    UNIT = 32
+
+    def __init__(self, size, seed=0):
+        self.size  = size
+        self._seed = struct.pack('!Q', seed)
+
+    def read(self, offset, length):
+        end   = min(offset + length, self.size)
+        if offset >= end:
+            return b''
+        first = offset // self.UNIT
+        last  = (end - 1) // self.UNIT
+        data  = b''.join(hashlib.sha256(self._seed + struct.pack('!Q', i)).digest()
+                         for i in range(first, last + 1))
+        start = offset - first * self.UNIT
+        return data[start:start + end - offset]
+
+    def close(self):
+        pass
+
+
+def open_payload(path=None, size=None, seed=0, default=b''):
+    """
+    Creates a payload source from a spec.
+
+    :param string path: File for the payload; takes precedence
+    :param int size: Size for a SeededPayload
+    :param int seed: Seed for a SeededPayload
+    :param bytes default: Payload if neither path nor size given
+    """
+    if path:
+        return FilePayload(path)
+    if size is not None:
+        return SeededPayload(size, seed)
+    return BytesPayload(default)
+
+def payload_digest(source, chunk_size=64*1024):
+    """Computes the SHA256 digest of a payload source in constant memory.
+
+    :return: hex digest string, in upper case like a RIOT /sha256 response
+    """
+    digest = hashlib.sha256()
+    for offset in range(0, source.size, chunk_size):
+        digest.update(source.read(offset, chunk_size))
+    return digest.hexdigest().upper()
@@ -0,0 +1,50 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests payload sources for large transfers. Does not require RIOT.
+"""
+
+import hashlib
+
+from payload_source import open_payload, payload_digest
+
+#
+# tests
+#
+
+def read_blocks(source, block_size):
+    return b''.join(source.read(offset, block_size)
+                    for offset in range(0, source.size, block_size))
+
+def test_seeded():
+    """Content is independent of read pattern, and varies with seed."""
+    source = open_payload(size=5000, seed=7)
+    whole  = source.read(0, source.size)
+    assert len(whole) == 5000
+    for block_size in (16, 33, 1024):
+        assert read_blocks(source, block_size) == whole
+    assert source.read(4990, 100) == whole[4990:]
+    assert open_payload(size=5000, seed=8).read(0, 5000) != whole
+    assert payload_digest(source, 1000) == hashlib.sha256(whole).hexdigest().upper()
+
+def test_file(tmp_path):
+    path = tmp_path / 'payload.bin'
+    data = bytes(range(256)) * 10
+    path.write_bytes(data)
+
+    source = open_payload(str(path), size=10)
+    assert source.size == len(data)
+    assert read_blocks(source, 64) == data
+    source.close()
+
+    (tmp_path / 'empty.bin').write_bytes(b'')
+    source = open_payload(str(tmp_path / 'empty.bin'))
+    assert source.size == 0 and source.read(0, 16) == b''
+    source.close()
+
+def test_default():
+    assert open_payload(default=b'abc').read(1, 16) == b'bc'
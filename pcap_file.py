@@ -0,0 +1,156 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Minimal pcap file writing and reading, using only the Python standard
+library, for packets captured by pcap_tap.py and impair_proxy.py. Wireshark
+and tcpdump read the files.
+
+PcapWriter writes the classic pcap format, with link type LINKTYPE_RAW, so
+each packet is an IPv4 or IPv6 datagram without a link layer header. A UDP
+datagram observed above the IP layer, like by a proxy, is wrapped in IP and
+UDP headers with udp_packet().
+
+For reading, parse_header() provides what a reader needs to walk the records
+of a capture in memory itself, like coap_trace.py does for speed. Reads
+captures with Ethernet, Linux cooked, and raw IP link types, in either byte
+order, with microsecond or nanosecond timestamps. Does not read pcapng.
+"""
+
+import socket
+import struct
+import time
+from collections import namedtuple
+
+# link types
+LINKTYPE_ETHERNET  = 1
+LINKTYPE_RAW       = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4      = 228
+LINKTYPE_IPV6      = 229
+
+# Length of the link layer header before the IP header, by link type. The
+# EtherType of an Ethernet or Linux cooked packet is in the last two bytes.
+LINK_HEADER = {LINKTYPE_ETHERNET: 14, LINKTYPE_RAW: 0, LINKTYPE_LINUX_SLL: 16,
+               LINKTYPE_IPV4: 0, LINKTYPE_IPV6: 0}
+
+MAGIC_USEC   = 0xa1b2c3d4
+MAGIC_NSEC   = 0xa1b23c4d
+MAGIC_PCAPNG = 0x0a0d0d0a
+
+_file_header = struct.Struct('<IHHiIII')
+_record      = struct.Struct('<IIII')
+_ipv6        = struct.Struct('!IHBB16s16s')
+_ipv4        = struct.Struct('!BBHHHBBH4s4s')
+_udp         = struct.Struct('!HHHH')
+
+PcapHeader = namedtuple('PcapHeader', ['linktype', 'record', 'time_scale'])
+PcapHeader.__doc__ = """Properties of a pcap file from its header. 'record'
+                        is the struct.Struct for a record header, in the
+                        file's byte order, with fields (seconds, fraction,
+                        captured length, original length). 'time_scale' is
+                        seconds per unit of the fraction."""
+
+
+def _checksum(data):
+    """Internet checksum, RFC 1071."""
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!{0}H'.format(len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+def udp_packet(src, dst, payload):
+    """
+    Wraps a UDP payload in UDP and IP headers, with valid checksums.
+
+    :param src: Source (address, port), like ('fd00:bbbb::1', 5683); IPv6 if
+                the address includes ':'
+    :param dst: Destination (address, port)
+    :return: bytes for the IP packet
+    """
+    length = 8 + len(payload)
+    if ':' in src[0]:
+        family, proto_len = socket.AF_INET6, struct.pack('!I3xB', length, 17)
+    else:
+        family, proto_len = socket.AF_INET, struct.pack('!xBH', 17, length)
+    src_addr = socket.inet_pton(family, src[0].split('%')[0])
+    dst_addr = socket.inet_pton(family, dst[0].split('%')[0])
+
+    header = _udp.pack(src[1], dst[1], length, 0)
+    check  = _checksum(src_addr + dst_addr + proto_len + header + payload) or 0xFFFF
+    udp    = _udp.pack(src[1], dst[1], length, check) + payload
+    if family == socket.AF_INET6:
+        return _ipv6.pack(0x60000000, length, 17, 64, src_addr, dst_addr) + udp
+
+    ip = _ipv4.pack(0x45, 0, 20 + length, 0, 0x4000, 64, 17, 0, src_addr, dst_addr)
+    return ip[:10] + struct.pack('!H', _checksum(ip)) + ip[12:] + udp
+
+def parse_header(data):
+    """
+    Reads the header of a pcap file.
+
+    :param data: Start of the file, at least 24 bytes
+    :return: PcapHeader
+    :raises ValueError: if data is not a supported pcap file
+    """
+    if len(data) < _file_header.size:
+        raise ValueError('pcap file too short')
+    for order in '<>':
+        magic = struct.unpack_from(order + 'I', data)[0]
+        if magic in (MAGIC_USEC, MAGIC_NSEC):
+            break
+    else:
+        if magic == MAGIC_PCAPNG:
+            raise ValueError('pcapng not supported; save as pcap')
+        raise ValueError('not a pcap file')
+
+    linktype = struct.unpack_from(order + 'I', data, 20)[0] & 0x0FFFFFFF
+    if linktype not in LINK_HEADER:
+        raise ValueError('Unsupported link type: {0}'.format(linktype))
+    return PcapHeader(linktype, struct.Struct(order + 'IIII'),
+                      1e-9 if magic == MAGIC_NSEC else 1e-6)
+
+
+class PcapWriter():
+    """
+    Writes IP packets to a pcap file, with LINKTYPE_RAW. By default each
+    packet is flushed as it is written, so the file is complete even if the
+    writer is killed.
+
+    :param string path: Path to the file
+    :param bool autoflush: False to buffer writes, for a large file
+    """
+    SNAPLEN = 65535
+
+    def __init__(self, path, autoflush=True):
+        self._file      = open(path, 'wb')
+        self._autoflush = autoflush
+        self._file.write(_file_header.pack(MAGIC_USEC, 2, 4, 0, 0, self.SNAPLEN,
+                                           LINKTYPE_RAW))
+        self._file.flush()
+
+    def write(self, packet, t=None):
+        """
+        Writes an IP packet.
+
+        :param float t: Time the packet was captured, in seconds since the
+                        epoch; current time if None
+        """
+        t = time.time() if t is None else t
+        secs, usecs = divmod(int(round(t * 1e6)), 1000000)
+        self._file.write(_record.pack(secs, usecs, len(packet), len(packet)))
+        self._file.write(packet)
+        if self._autoflush:
+            self._file.flush()
+
+    def write_udp(self, src, dst, payload, t=None):
+        """Writes a UDP datagram, as for udp_packet(), captured at time t."""
+        self.write(udp_packet(src, dst, payload), t)
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Captures the UDP packets to or from a set of ports, on network interfaces, to
+a pcap file; see pcap_file.py. Used by the packet_capture fixture. Reads each
+interface with a Linux packet socket, so requires the CAP_NET_RAW capability,
+like when run as root, or by a Python interpreter granted it:
+
+    $ sudo setcap cap_net_raw+ep $(readlink -f $(which python3))
+
+Exits with an error if not permitted. Timestamps are from the kernel's receipt
+of each packet. On a loopback interface, records a packet once, like tcpdump,
+rather than as both sent and received. Writes each packet as it is captured.
+On SIGTERM, writes the packets already received, and exits.
+
+Prints 'Tap ready' when capturing.
+
+Usage:
+    usage: pcap_tap.py -i IFACE [-i IFACE ...] -w FILE [-p PORTS]
+    usage: pcap_tap.py -h
+
+    optional arguments:
+      -h, --help  show this help message and exit
+      -i IFACE    network interface to capture, like tap0; repeat for more
+      -w FILE     pcap file to write
+      -p PORTS    only UDP packets to or from these ports, like 5683,5684;
+                  all UDP packets by default
+
+Example:
+
+$ sudo ./pcap_tap.py -i tap0 -p 5683,5684 -w request_response.pcap
+Tap ready
+"""
+
+import asyncio
+import signal
+import socket
+import struct
+import sys
+import time
+from argparse import ArgumentParser
+
+from pcap_file import PcapWriter
+
+ETH_P_ALL       = 0x0003
+ETH_P_IP        = 0x0800
+ETH_P_IPV6      = 0x86DD
+PACKET_OUTGOING = 4
+ARPHRD_LOOPBACK = 772
+# Linux value; not defined by the socket module
+SO_TIMESTAMPNS  = 35
+
+_timespec = struct.Struct('@qq')
+
+
+def udp_ports(packet):
+    """Provides the (source port, destination port) of an IP packet, or None
+       if not UDP."""
+    version = packet[0] >> 4
+    if version == 6 and len(packet) >= 44 and packet[6] == 17:
+        return struct.unpack_from('!HH', packet, 40)
+    if version == 4 and len(packet) >= 28 and packet[9] == 17:
+        header = (packet[0] & 0x0F) * 4
+        if len(packet) >= header + 4:
+            return struct.unpack_from('!HH', packet, header)
+    return None
+
+
+class PacketTap():
+    """
+    Captures UDP packets from packet sockets, using the running event loop.
+
+    :param ifaces: Names of the interfaces to capture
+    :param ports: Collection of UDP ports; if empty, captures all UDP packets
+    :param writer: PcapWriter for the packets
+    """
+
+    def __init__(self, ifaces, ports, writer):
+        self.ifaces  = ifaces
+        self.ports   = frozenset(ports)
+        self.count   = 0
+        self._writer = writer
+        self._socks  = []
+        self._loop   = None
+
+    def start(self):
+        """Opens a socket for each interface, and starts capturing.
+
+        :raises OSError: if not permitted, or an interface does not exist
+        """
+        self._loop = asyncio.get_event_loop()
+        for iface in self.ifaces:
+            sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM,
+                                 socket.htons(ETH_P_ALL))
+            self._socks.append(sock)
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            sock.bind((iface, 0))
+            sock.setblocking(False)
+            self._loop.add_reader(sock, self._read, sock)
+
+    def drain(self):
+        """Reads the packets already received on each socket."""
+        for sock in self._socks:
+            self._read(sock)
+
+    def close(self):
+        for sock in self._socks:
+            self._loop.remove_reader(sock)
+            sock.close()
+        self._socks = []
+
+    def _read(self, sock):
+        while True:
+            try:
+                data, ancdata, _, addr = sock.recvmsg(65535,
+                                                      socket.CMSG_SPACE(_timespec.size))
+            except (BlockingIOError, InterruptedError):
+                return
+            _, proto, pkttype, hatype = addr[:4]
+            if proto not in (ETH_P_IP, ETH_P_IPV6):
+                continue
+            if hatype == ARPHRD_LOOPBACK and pkttype == PACKET_OUTGOING:
+                continue
+            ports = udp_ports(data)
+            if ports is None or (self.ports and self.ports.isdisjoint(ports)):
+                continue
+
+            t = None
+            for level, kind, value in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                    secs, nsecs = _timespec.unpack_from(value)
+                    t = secs + nsecs * 1e-9
+            self._writer.write(data, t if t is not None else time.time())
+            self.count += 1
+
+
+async def main(ifaces, ports, path):
+    writer = PcapWriter(path)
+    tap    = PacketTap(ifaces, ports, writer)
+    try:
+        tap.start()
+    except OSError as e:
+        tap.close()
+        writer.close()
+        sys.exit('Tap not available on {0}: {1}'.format(','.join(ifaces), e))
+
+    loop    = asyncio.get_event_loop()
+    stopped = loop.create_future()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, lambda: stopped.done() or stopped.set_result(None))
+    print('Tap ready', flush=True)
+
+    # capture until stopped
+    try:
+        await stopped
+        tap.drain()
+    finally:
+        tap.close()
+        writer.close()
+    print('Captured {0} packets'.format(tap.count), flush=True)
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-i', dest='ifaces', action='append', required=True,
+                        help='network interface to capture, like tap0; repeat for more')
+    parser.add_argument('-w', dest='path', required=True,
+                        help='pcap file to write')
+    parser.add_argument('-p', dest='ports', default='',
+                        help='only UDP packets to or from these ports, like 5683,5684')
+
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(main(
+            args.ifaces, [int(p) for p in filter(None, args.ports.split(','))],
+            args.path))
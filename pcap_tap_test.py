@@ -0,0 +1,69 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests packet capture with pcap_tap.py on the loopback interface. Requires the
+CAP_NET_RAW capability, like when run as root; skipped otherwise. Does not
+require RIOT.
+"""
+
+import asyncio
+import pytest
+import socket
+
+import coap_msg
+from coap_trace import Trace
+from pcap_file import PcapWriter
+from pcap_tap import PacketTap, udp_ports
+
+#
+# tests
+#
+
+def test_ports():
+    packet = bytes(6) + b'\x11' + bytes(33) + b'\x16\x33\x9c\x40'
+    assert udp_ports(b'\x60' + packet[1:]) == (5683, 40000)
+    assert udp_ports(b'\x60' + packet[1:6] + b'\x06' + packet[7:]) is None
+
+def test_tap(tmp_path):
+    """Captures an exchange on loopback once, but not a packet for another
+       port."""
+    path   = str(tmp_path / 'tap.pcap')
+    writer = PcapWriter(path)
+    loop   = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    server.bind(('::1', 0))
+    port   = server.getsockname()[1]
+    tap    = PacketTap(['lo'], [port], writer)
+    try:
+        try:
+            tap.start()
+        except PermissionError:
+            pytest.skip('requires CAP_NET_RAW')
+
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as client:
+            client.settimeout(1)
+            client.sendto(coap_msg.encode(coap_msg.CON, coap_msg.GET, 1, b'\x01'),
+                          ('::1', port))
+            data, remote = server.recvfrom(2048)
+            server.sendto(coap_msg.encode(coap_msg.ACK, coap_msg.CONTENT, 1, b'\x01'),
+                          remote)
+            client.recv(2048)
+            client.sendto(b'other', ('::1', port + 1))
+        loop.run_until_complete(asyncio.sleep(0.1))
+        tap.drain()
+    finally:
+        tap.close()
+        writer.close()
+        server.close()
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert tap.count == 2
+    exchange = Trace.load(path).exchanges()[0]
+    assert exchange.server == '[::1]:{0}'.format(port)
+    assert 0 < exchange.latency() < 1
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Simulates many CoRE Resource Directory endpoints, to measure how an RD server,
+like aiocoap-rd, scales with the size of its registry. Each simulated endpoint
+has a distinct name, and registers links like the RIOT cord_ep example's
+/sense/temp and /node/info resources, with LIFETIME.
+
+Grows the registry in steps, to each of SIZES endpoints. At each step,
+registers the new endpoints, with up to CONCURRENCY requests outstanding, and
+then for DURATION seconds sends registration updates and endpoint lookups
+concurrently, each on a fixed schedule at its rate. Updates go round robin
+over the registered endpoints, so each endpoint updates every SIZE / RATE
+seconds; keep that shorter than LIFETIME. A lookup is for a random
+registered endpoint, and is counted as missing if the response does not
+include it. At the end, removes the registrations.
+
+Finds the registration and endpoint lookup interfaces from the server's
+/.well-known/core, with rt=core.rd and rt=core.rd-lookup-ep.
+
+Prints a table with a row per step:
+
+size     registered endpoints
+reg/s    registrations per second for the step
+reg      registration latency p50, in ms
+update   update latency p50 and p99, in ms
+lookup   lookup latency p50 and p99, in ms
+errors   requests with no response or an error code
+missing  lookups that did not find the endpoint
+
+Uses its own minimal client over plain UDP sockets, built on coap_endpoint.py,
+so it does not support DTLS.
+
+Usage:
+    usage: rd_ep_sim.py -r HOST [-N SIZES] [-l LIFETIME] [-d DURATION]
+                        [-U RATE] [-L RATE] [-n CONCURRENCY] [-s SOCKETS]
+                        [-e PREFIX] [-w TIMEOUT] [-j FILE]
+    usage: rd_ep_sim.py -h
+
+    optional arguments:
+      -h, --help      show this help message and exit
+      -r HOST         RD server host, like [fd00:bbbb::1]:5683
+      -N SIZES        comma separated registry sizes; 10,100,1000 by default
+      -l LIFETIME     registration lifetime, in seconds; 3600 by default
+      -d DURATION     seconds of updates and lookups at each size; 5 by
+                      default
+      -U RATE         updates per second; 20 by default
+      -L RATE         lookups per second; 20 by default
+      -n CONCURRENCY  max requests outstanding; 16 by default
+      -s SOCKETS      count of local sockets for endpoints; 8 by default
+      -e PREFIX       prefix for endpoint names; random by default
+      -w TIMEOUT      seconds to wait for a response; 5 by default
+      -j FILE         write a JSON Lines record for each step; see
+                      coap_results.py
+
+Example:
+
+$ ./rd_ep_sim.py -r [fd00:bbbb::1]:5683 -N 100,1000 -d 10
+ size    reg/s     reg  update p50     p99  lookup p50     p99  errors  missing
+  100    812.4   1.104       1.302   2.811       1.505   3.012       0        0
+ 1000    790.1   1.188       1.411   3.106       3.870   6.225       0        0
+Removed 1000 of 1000 registrations in 1.3 s
+"""
+
+import asyncio
+import itertools
+import random
+import re
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+
+import coap_msg
+from coap_endpoint import CoapEndpoint
+from coap_results import ResultWriter
+from coap_stats import Histogram, summary_fields
+from conftest import proto_params
+from readiness import split_host
+
+# content format for application/link-format
+LINK_FORMAT = 40
+
+# table row
+ROW = '{0:>5} {1:>8} {2:>7} {3:>11} {4:>7} {5:>11} {6:>7} {7:>7} {8:>8}'
+
+_link = re.compile(r'<([^>]*)>((?:;[^;,]*)*)')
+
+def parse_links(text):
+    """
+    Parses a CoRE link-format document.
+
+    :return: list of (target, {attribute: value}) tuples; an attribute
+             without a value is True
+    """
+    links = []
+    for target, params in _link.findall(text):
+        attrs = {}
+        for param in filter(None, params.split(';')):
+            name, sep, value = param.partition('=')
+            attrs[name.strip()] = value.strip('"') if sep else True
+        links.append((target, attrs))
+    return links
+
+def endpoint_links(name):
+    """Provides the link-format payload for an endpoint, like cord_ep."""
+    return '</sense/temp>;rt="temperature";if="sensor";ct=0,' \
+           '</node/info>;ct=0;title="{0}"'.format(name).encode()
+
+def query_option(name, value):
+    return (coap_msg.URI_QUERY, '{0}={1}'.format(name, value).encode())
+
+
+class SimEndpoint():
+    """Registration state for a simulated endpoint."""
+
+    def __init__(self, name, sock):
+        self.name     = name
+        self.socket   = sock
+        # Location-Path values from the registration response
+        self.location = None
+
+
+class RdSimulator():
+    """
+    Simulated endpoints for an RD server, and the latency of their requests.
+
+    :param sockets: list of CoapEndpoint
+    """
+
+    def __init__(self, sockets, prefix, lifetime=3600, timeout=5.0):
+        self.sockets   = sockets
+        self.prefix    = prefix
+        self.lifetime  = lifetime
+        self.timeout   = timeout
+        self.endpoints = []
+        self.reg_path    = '/resourcedirectory'
+        self.lookup_path = '/endpoint-lookup/'
+
+    async def discover(self):
+        """Finds the registration and endpoint lookup interfaces from
+           /.well-known/core; keeps the defaults if not found."""
+        options = coap_msg.path_options('/.well-known/core')
+        options.append(query_option('rt', 'core.rd*'))
+        response = await self.sockets[0].request(coap_msg.GET, options,
+                                                 timeout=self.timeout)
+        if response is None or response.code != coap_msg.CONTENT:
+            return
+        for target, attrs in parse_links(response.payload.decode(errors='replace')):
+            types = str(attrs.get('rt', '')).split()
+            if 'core.rd' in types:
+                self.reg_path = target
+            elif 'core.rd-lookup-ep' in types:
+                self.lookup_path = target
+
+    async def register(self, endpoint):
+        """:return: True if registered"""
+        options = coap_msg.path_options(self.reg_path)
+        options.extend([query_option('ep', endpoint.name),
+                        query_option('lt', self.lifetime),
+                        (coap_msg.CONTENT_FORMAT, coap_msg.encode_uint(LINK_FORMAT))])
+        response = await endpoint.socket.request(coap_msg.POST, options,
+                                                 endpoint_links(endpoint.name),
+                                                 self.timeout)
+        if response is None or response.code != coap_msg.CREATED:
+            return False
+        endpoint.location = [v for n, v in response.options
+                             if n == coap_msg.LOCATION_PATH]
+        return True
+
+    async def update(self, endpoint):
+        """:return: True if updated"""
+        options  = [(coap_msg.URI_PATH, v) for v in endpoint.location]
+        response = await endpoint.socket.request(coap_msg.POST, options,
+                                                 timeout=self.timeout)
+        return response is not None and response.code == coap_msg.CHANGED
+
+    async def lookup(self, endpoint):
+        """:return: response Message, or None"""
+        options = coap_msg.path_options(self.lookup_path)
+        options.append(query_option('ep', endpoint.name))
+        return await self.sockets[0].request(coap_msg.GET, options,
+                                             timeout=self.timeout)
+
+    async def remove(self, endpoint):
+        """:return: True if removed"""
+        options  = [(coap_msg.URI_PATH, v) for v in endpoint.location]
+        response = await endpoint.socket.request(coap_msg.DELETE, options,
+                                                 timeout=self.timeout)
+        return response is not None and response.code == coap_msg.DELETED
+
+
+async def paced(rate, duration, action, concurrency):
+    """
+    Runs action() on a fixed schedule at a rate for a duration, with up to
+    concurrency outstanding. Latency counts from the scheduled time, so a
+    slow server does not hide its delay by slowing the schedule.
+
+    :param action: Coroutine function; returns True on success
+    :return: (Histogram of latency in usec for successes, count of failures)
+    """
+    loop    = asyncio.get_event_loop()
+    slots   = asyncio.Semaphore(concurrency)
+    hist    = Histogram()
+    errors  = 0
+    pending = set()
+
+    async def run(intended):
+        nonlocal errors
+        try:
+            if await action():
+                hist.record((loop.time() - intended) * 1e6)
+            else:
+                errors += 1
+        finally:
+            slots.release()
+
+    if rate <= 0:
+        return hist, 0
+    start = loop.time()
+    sent  = 0
+    while sent / rate < duration:
+        intended = start + sent / rate
+        await asyncio.sleep(max(0, intended - loop.time()))
+        await slots.acquire()
+        task = asyncio.ensure_future(run(intended))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        sent += 1
+    if pending:
+        await asyncio.wait(pending)
+    return hist, errors
+
+def format_ms(hist, percentile):
+    value = hist.value_at(percentile)
+    return '{0:.3f}'.format(value / 1000) if value is not None else '-'
+
+async def run_sim(addr, port, sizes, lifetime=3600, duration=5, update_rate=20,
+                  lookup_rate=20, concurrency=16, sockets=8, prefix=None, timeout=5.0,
+                  resultsFile=None):
+    """
+    Grows the registry to each size, measures updates and lookups, and prints
+    the table.
+
+    :return: list of the record written for each step
+    """
+    loop    = asyncio.get_event_loop()
+    results = ResultWriter(resultsFile)
+    prefix  = prefix or 'sim{0:04x}'.format(random.getrandbits(16))
+    family  = socket.getaddrinfo(addr, port, type=socket.SOCK_DGRAM)[0][0]
+    socks   = []
+    for i in range(sockets):
+        _, sock = await loop.create_datagram_endpoint(CoapEndpoint,
+                                                      remote_addr=(addr, port),
+                                                      family=family)
+        socks.append(sock)
+
+    sim   = RdSimulator(socks, prefix, lifetime, timeout)
+    steps = []
+    try:
+        await sim.discover()
+        print(ROW.format('size', 'reg/s', 'reg', 'update p50', 'p99', 'lookup p50',
+                         'p99', 'errors', 'missing'), flush=True)
+        for size in sizes:
+            # register up to size
+            added = [SimEndpoint('{0}-{1:05d}'.format(prefix, i), socks[i % len(socks)])
+                     for i in range(len(sim.endpoints), size)]
+            reg_hist   = Histogram()
+            reg_errors = 0
+            slots      = asyncio.Semaphore(concurrency)
+
+            async def register(endpoint):
+                nonlocal reg_errors
+                async with slots:
+                    start = time.monotonic()
+                    if await sim.register(endpoint):
+                        reg_hist.record((time.monotonic() - start) * 1e6)
+                        sim.endpoints.append(endpoint)
+                    else:
+                        reg_errors += 1
+
+            start = time.monotonic()
+            await asyncio.gather(*[register(e) for e in added])
+            reg_time = time.monotonic() - start
+
+            # updates and lookups, concurrently
+            registered = list(sim.endpoints)
+            next_update = itertools.cycle(registered)
+            missing = 0
+
+            async def update():
+                return await sim.update(next(next_update))
+
+            async def lookup():
+                nonlocal missing
+                endpoint = random.choice(registered)
+                response = await sim.lookup(endpoint)
+                if response is None or response.code != coap_msg.CONTENT:
+                    return False
+                if endpoint.name.encode() not in response.payload:
+                    missing += 1
+                return True
+
+            if registered:
+                (upd_hist, upd_errors), (look_hist, look_errors) = await asyncio.gather(
+                    paced(update_rate, duration, update, concurrency),
+                    paced(lookup_rate, duration, lookup, concurrency))
+            else:
+                upd_hist, upd_errors, look_hist, look_errors = Histogram(), 0, Histogram(), 0
+
+            errors = reg_errors + upd_errors + look_errors
+            print(ROW.format(
+                  len(registered), '{0:.1f}'.format(len(added) / reg_time if reg_time else 0),
+                  format_ms(reg_hist, 50), format_ms(upd_hist, 50),
+                  format_ms(upd_hist, 99), format_ms(look_hist, 50),
+                  format_ms(look_hist, 99), errors, missing), flush=True)
+
+            record = {'bench': 'rd', 'size': len(registered), 'added': len(added),
+                      'registration_time': reg_time, 'registration_errors': reg_errors,
+                      'update_errors': upd_errors, 'lookup_errors': look_errors,
+                      'missing': missing, 'lifetime': lifetime}
+            for name, hist in (('registration', reg_hist), ('update', upd_hist),
+                               ('lookup', look_hist)):
+                record.update({'{0}_{1}'.format(name, k): v
+                               for k, v in summary_fields(hist).items()})
+            results.write(**record)
+            steps.append(record)
+    finally:
+        # remove registrations, so a server reused by a later test starts empty
+        start   = time.monotonic()
+        slots   = asyncio.Semaphore(concurrency)
+
+        async def remove(endpoint):
+            async with slots:
+                return await sim.remove(endpoint)
+
+        removed = await asyncio.gather(*[remove(e) for e in sim.endpoints])
+        print('Removed {0} of {1} registrations in {2:.1f} s'.format(
+              sum(removed), len(sim.endpoints), time.monotonic() - start), flush=True)
+        for sock in socks:
+            sock.transport.close()
+        results.close()
+    return steps
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-r', dest='host', required=True,
+                        help='RD server host, like [fd00:bbbb::1]:5683')
+    parser.add_argument('-N', dest='sizes', default='10,100,1000',
+                        help='comma separated registry sizes')
+    parser.add_argument('-l', dest='lifetime', type=int, default=3600,
+                        help='registration lifetime, in seconds')
+    parser.add_argument('-d', dest='duration', type=float, default=5,
+                        help='seconds of updates and lookups at each size')
+    parser.add_argument('-U', dest='update_rate', type=float, default=20,
+                        help='updates per second')
+    parser.add_argument('-L', dest='lookup_rate', type=float, default=20,
+                        help='lookups per second')
+    parser.add_argument('-n', dest='concurrency', type=int, default=16,
+                        help='max requests outstanding')
+    parser.add_argument('-s', dest='sockets', type=int, default=8,
+                        help='count of local sockets for endpoints')
+    parser.add_argument('-e', dest='prefix',
+                        help='prefix for endpoint names')
+    parser.add_argument('-w', dest='timeout', type=float, default=5.0,
+                        help='seconds to wait for a response')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='JSON Lines file for a record of each step')
+
+    args = parser.parse_args()
+    if proto_params['is_dtls']:
+        sys.exit('rd_ep_sim.py supports plain UDP only')
+
+    addr, port = split_host(args.host)
+    steps = asyncio.get_event_loop().run_until_complete(run_sim(
+                addr, port, [int(s) for s in args.sizes.split(',')], args.lifetime,
+                args.duration, args.update_rate, args.lookup_rate, args.concurrency,
+                args.sockets, args.prefix, args.timeout, args.resultsFile))
+    sys.exit(0 if all(s['registration_errors'] == 0 and s['missing'] == 0
+                      for s in steps) else 1)
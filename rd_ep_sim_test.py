@@ -0,0 +1,114 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests Resource Directory scaling with rd_ep_sim.py. The first tests use a
+Python RD responder, so do not require RIOT or aiocoap. The benchmark runs
+against aiocoap-rd.
+"""
+
+import asyncio
+import logging
+import os
+import pytest
+import urllib.parse
+
+import coap_msg
+from coap_results import ResultReader
+from conftest import proto_params, rd_host, run_bench_script, udp_responder
+from rd_ep_sim import parse_links, run_sim
+
+logging.basicConfig(level=logging.INFO)
+
+#
+# fixtures and utility functions
+#
+
+@pytest.fixture
+def rd_responder():
+    """
+    Runs a UDP endpoint on ::1 with a minimal Resource Directory. Advertises
+    the registration interface at /rd and endpoint lookup at /rd-lookup/ep,
+    rather than the aiocoap-rd paths, to exercise discovery.
+
+    :return: (port for the endpoint, dictionary of registered endpoint name
+             to links)
+    """
+    registry  = {}
+    locations = {}
+
+    def respond(sock, data, remote):
+        msg   = coap_msg.decode(data)
+        path  = '/'.join(v.decode() for n, v in msg.options if n == coap_msg.URI_PATH)
+        query = dict(urllib.parse.parse_qsl('&'.join(
+                    v.decode() for n, v in msg.options if n == coap_msg.URI_QUERY)))
+        options, payload = [], b''
+        if path == '.well-known/core':
+            code    = coap_msg.CONTENT
+            payload = b'</rd>;rt="core.rd";ct=40,</rd-lookup/ep>;rt="core.rd-lookup-ep"'
+        elif path == 'rd' and msg.code == coap_msg.POST:
+            code = coap_msg.CREATED
+            loc  = 'reg/{0}'.format(len(locations) + 1)
+            locations[loc] = query['ep']
+            registry[query['ep']] = msg.payload
+            options = [(coap_msg.LOCATION_PATH, v.encode()) for v in loc.split('/')]
+        elif path in locations and msg.code == coap_msg.POST:
+            code = coap_msg.CHANGED
+        elif path in locations and msg.code == coap_msg.DELETE:
+            code = coap_msg.DELETED
+            del registry[locations.pop(path)]
+        elif path == 'rd-lookup/ep':
+            code = coap_msg.CONTENT
+            if query.get('ep') in registry:
+                payload = '<coap://[::1]>;ep="{0}"'.format(query['ep']).encode()
+        else:
+            code = 0x84
+        sock.sendto(coap_msg.encode(coap_msg.ACK, code, msg.mid, msg.token, options,
+                                    payload), remote)
+
+    with udp_responder(respond) as port:
+        yield port, registry
+
+#
+# tests
+#
+
+def test_links():
+    links = parse_links('</rd>;rt="core.rd";ct=40,</rd-lookup/ep>;rt="core.rd-lookup-ep";obs')
+    assert links == [('/rd', {'rt': 'core.rd', 'ct': '40'}),
+                     ('/rd-lookup/ep', {'rt': 'core.rd-lookup-ep', 'obs': True})]
+
+def test_sim(rd_responder, tmp_path):
+    """Registers to each size, finds each endpoint by lookup, and removes
+       the registrations at the end."""
+    port, registry = rd_responder
+    results = ResultReader(str(tmp_path / 'sim.jsonl'))
+    steps   = asyncio.run(run_sim('::1', port, [5, 20], duration=0.3, update_rate=50,
+                                  lookup_rate=50, sockets=3, prefix='test',
+                                  resultsFile=results.path))
+
+    assert [s['size'] for s in steps] == [5, 20]
+    assert [s['added'] for s in steps] == [5, 15]
+    for step in steps:
+        assert step['registration_errors'] == 0
+        assert step['update_errors'] == 0 and step['lookup_errors'] == 0
+        assert step['missing'] == 0
+        assert step['update_count'] == 15 and step['lookup_count'] == 15
+    assert results.read() == steps
+    assert registry == {}
+
+@pytest.mark.benchmark
+@pytest.mark.skipif(proto_params['is_dtls'], reason='rd_ep_sim.py requires UDP')
+def test_rd_scaling(rd_server, tmp_path):
+    """Registration, update and lookup latency as the aiocoap-rd registry
+       grows. Set RD_SIM_SIZES for the registry sizes."""
+    sizes   = os.environ.get('RD_SIM_SIZES', '10,100,1000')
+    steps   = run_bench_script(tmp_path, './rd_ep_sim.py -r {0} -N {1} -d 5'.format(
+                                         rd_host(), sizes), 600)
+    assert [s['size'] for s in steps] == [int(s) for s in sizes.split(',')]
+    for step in steps:
+        assert step['registration_errors'] == 0
+        assert step['missing'] == 0
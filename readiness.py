@@ -0,0 +1,147 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Readiness probes for hosts under test. Rather than sleep a fixed time for a
+host to initialize, poll a probe with a short backoff and return as soon as
+the host answers.
+
+Probes are functions that return True when the host is ready. They must
+return quickly, so wait_ready() can enforce its time limit. The READY_TIMEOUT
+environment variable sets the default limit, in seconds.
+"""
+
+import asyncio
+import errno
+import logging
+import os
+import pexpect
+import random
+import re
+import socket
+import time
+
+import coap_msg
+
+def ready_timeout():
+    """Provides the default ceiling on time to wait for readiness, in seconds."""
+    return float(os.environ.get('READY_TIMEOUT', '10'))
+
+def wait_ready(probe, desc='host', timeout=None, interval=0.02, max_interval=0.5):
+    """
+    Polls a probe function until it succeeds, with exponential backoff between
+    attempts.
+
+    :param probe: Function with no arguments; returns True when ready
+    :param string desc: Description of the host for logging
+    :param float timeout: Ceiling on wait, in seconds; defaults to
+                          ready_timeout()
+    :return: Seconds elapsed until ready
+    :raises TimeoutError: if probe does not succeed within the timeout
+    """
+    if timeout is None:
+        timeout = ready_timeout()
+    start    = time.monotonic()
+    deadline = start + timeout
+    while not probe():
+        now = time.monotonic()
+        if now >= deadline:
+            raise TimeoutError('{0} not ready after {1} s'.format(desc, timeout))
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, max_interval)
+
+    elapsed = time.monotonic() - start
+    logging.info('{0} ready in {1:.3f} s'.format(desc, elapsed))
+    return elapsed
+
+async def wait_ready_async(probe, desc='host', timeout=None, interval=0.02,
+                           max_interval=0.5):
+    """
+    Like wait_ready(), for use in a coroutine. Runs each probe in the event
+    loop's default executor, and waits between attempts with asyncio.sleep(),
+    so the loop continues to run other tasks while waiting.
+
+    :return: Seconds elapsed until ready
+    :raises TimeoutError: if probe does not succeed within the timeout
+    """
+    if timeout is None:
+        timeout = ready_timeout()
+    loop     = asyncio.get_running_loop()
+    start    = time.monotonic()
+    deadline = start + timeout
+    while not await loop.run_in_executor(None, probe):
+        now = time.monotonic()
+        if now >= deadline:
+            raise TimeoutError('{0} not ready after {1} s'.format(desc, timeout))
+        await asyncio.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, max_interval)
+
+    elapsed = time.monotonic() - start
+    logging.info('{0} ready in {1:.3f} s'.format(desc, elapsed))
+    return elapsed
+
+def split_host(host, port=5683):
+    """
+    Splits a URI host like '[fd00:bbbb::2]' or '[fd00:bbbb::2]:5684' into
+    address and port.
+
+    :return: (address, port) tuple
+    """
+    match = re.fullmatch(r'\[(.+)\](?::(\d+))?', host)
+    if match:
+        return match.group(1), int(match.group(2) or port)
+    return host, port
+
+def _exchange(addr, port, msg, timeout):
+    """Sends a CoAP message and waits for a reply with the same message ID.
+
+    :return: Decoded reply Message, or None if no reply
+    """
+    try:
+        info = socket.getaddrinfo(addr, port, type=socket.SOCK_DGRAM)[0]
+    except socket.gaierror:
+        return None
+    mid = msg[2] << 8 | msg[3]
+    with socket.socket(info[0], socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(msg, info[4])
+            while True:
+                reply = coap_msg.decode(sock.recv(2048))
+                if reply.mid == mid:
+                    return reply
+        except (OSError, ValueError):
+            # includes socket.timeout, and ICMP port unreachable
+            return None
+
+def coap_ping(addr, port=5683, timeout=0.2):
+    """Probe that sends a CoAP ping, an empty CON message. Ready when the host
+       responds with a RST."""
+    msg   = coap_msg.encode(coap_msg.CON, coap_msg.EMPTY, random.getrandbits(16))
+    reply = _exchange(addr, port, msg, timeout)
+    return reply is not None and reply.mtype == coap_msg.RST
+
+def well_known_core(addr, port=5683, timeout=0.2):
+    """Probe that GETs /.well-known/core. Ready on any response."""
+    msg = coap_msg.encode(coap_msg.CON, coap_msg.GET, random.getrandbits(16),
+                          token=os.urandom(2),
+                          options=coap_msg.path_options('/.well-known/core'))
+    return _exchange(addr, port, msg, timeout) is not None
+
+def port_bound(port, addr='::', kind=socket.SOCK_DGRAM):
+    """Probe for a local server. Ready when some process has bound the port on
+       the address."""
+    with socket.socket(socket.AF_INET6, kind) as sock:
+        try:
+            sock.bind((addr, port))
+        except OSError as e:
+            return e.errno == errno.EADDRINUSE
+    return False
+
+def banner(term, pattern, timeout=0.1):
+    """Probe for a pexpect spawned host. Ready when the host outputs text that
+       matches the pattern."""
+    return term.expect([pattern, pexpect.TIMEOUT], timeout) == 0
@@ -0,0 +1,73 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests readiness probes against a Python stand-in endpoint on the loopback
+interface. Does not require RIOT.
+"""
+
+import asyncio
+import pytest
+
+import coap_msg
+from conftest import udp_responder
+from readiness import coap_ping, port_bound, split_host, wait_ready, wait_ready_async
+
+#
+# fixtures and utility functions
+#
+
+@pytest.fixture
+def ping_responder():
+    """Runs a UDP endpoint on ::1 that answers a CoAP ping with a RST.
+
+    :return: port for the endpoint
+    """
+    def respond(sock, data, remote):
+        msg = coap_msg.decode(data)
+        if msg.mtype == coap_msg.CON and msg.code == coap_msg.EMPTY:
+            sock.sendto(coap_msg.encode(coap_msg.RST, coap_msg.EMPTY, msg.mid), remote)
+
+    with udp_responder(respond) as port:
+        yield port
+
+#
+# tests
+#
+
+def test_split_host():
+    assert split_host('[fd00:bbbb::2]') == ('fd00:bbbb::2', 5683)
+    assert split_host('[fe80::2%tap0]:5684') == ('fe80::2%tap0', 5684)
+
+def test_coap_ping(ping_responder):
+    assert wait_ready(lambda: coap_ping('::1', ping_responder), timeout=2) < 1
+    assert port_bound(ping_responder, '::1')
+
+def test_not_ready(ping_responder):
+    with pytest.raises(TimeoutError):
+        wait_ready(lambda: coap_ping('::1', ping_responder + 1, 0.05),
+                   timeout=0.3)
+
+def test_ready_async(ping_responder):
+    """Event loop continues to run tasks while waiting for an unanswered
+       probe."""
+    async def wait():
+        ticks = 0
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        ticker = asyncio.ensure_future(tick())
+        with pytest.raises(TimeoutError):
+            await wait_ready_async(lambda: coap_ping('::1', ping_responder + 1, 0.1),
+                                   timeout=0.3)
+        assert await wait_ready_async(lambda: coap_ping('::1', ping_responder),
+                                      timeout=2) < 1
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(wait()) >= 10
@@ -7,69 +7,218 @@
 # directory for more details.
 """
 Repeat sending simple GET to RIOT instance. Logs each message received so they
-may be validated. Waits two seconds between sends.
+may be validated. Waits for the RIOT instance to answer a CoAP ping, prints
+'Client ready', and then waits an interval before each send; two seconds by
+default.
+
+With -R, runs as an open-loop load generator instead. Sends requests on a
+fixed schedule at the target rate, regardless of when responses arrive, with
+up to CONCURRENCY requests outstanding. Latency is measured from the time a
+request was scheduled, not from when it was sent, so a slow server does not
+hide its own delays by slowing the sender (coordinated omission). Runs for
+QTY requests or DURATION seconds, and then prints a report of throughput,
+loss, and latency percentiles.
 
 Expected result:
 
 Usage:
-    usage: repeat_send_client.py [-c FILE] -r HOST -p PATH -q QTY
+    usage: repeat_send_client.py [-c FILE] [-i INTERVAL] [-t {CON,NON}]
+                                 [-R RATE] [-n CONCURRENCY] [-d DURATION]
+                                 [-w TIMEOUT] [-j FILE] -r HOST -p PATH [-q QTY]
     usage: repeat_send_client.py -h
 
     optional arguments:
-      -h, --help     show this help message and exit
-      -p PATH        path for URI
-      -r HOST        remote host for URI
-      -q QTY         quantity of messages to handle
-      -c FILE        DTLS credentials file, name format: *.json
+      -h, --help      show this help message and exit
+      -p PATH         path for URI
+      -r HOST         remote host for URI
+      -q QTY          quantity of messages to handle
+      -i INTERVAL     seconds to wait before each send
+      -c FILE         DTLS credentials file, name format: *.json
+      -t {CON,NON}    message type for requests; CON by default
+      -R RATE         load mode; target requests per second
+      -n CONCURRENCY  load mode; max requests outstanding, 16 by default
+      -d DURATION     load mode; seconds to send requests, instead of QTY
+      -w TIMEOUT      load mode; seconds to wait for a response before
+                      counting it lost, 5 by default
+      -j FILE         write a JSON Lines record for each exchange; see
+                      coap_results.py
 
 Example:
 
 $ PYTHONPATH="/home/kbee/src/aiocoap" ./repeat_send_client.py -p /cli/stats -r [fd00:bbbb::2] -q 10
+
+$ ./repeat_send_client.py -p /cli/stats -r [fd00:bbbb::2] -t NON -R 200 -d 10
+Sent 2000 in 10.00 s; received 1987, lost 13 (0.65%)
+Throughput 198.4 responses/s
+Latency p50 1.204 p90 1.630 p99 2.301 p99.9 4.012 max 4.551 ms
 """
 
 import asyncio
+import collections
 import contextlib
 import json
 import logging
 import os
+import time
 from argparse import ArgumentParser
 from aiocoap import *
+from coap_results import ResultWriter
+from coap_stats import Histogram, format_latency
 from conftest import proto_params
 from pathlib import Path
+from readiness import coap_ping, split_host, wait_ready_async
 
 logfile = 'repeat_send_client.log'
-with contextlib.suppress(FileNotFoundError):
-    os.remove(logfile)
 
-logging.basicConfig(level=logging.INFO, filename=logfile)
-
-async def main(host, path, qty, credentialsFile=None):
+async def main(host, path, qty, credentialsFile=None, interval=2, mtype=CON,
+               rate=None, concurrency=16, duration=None, timeout=5,
+               resultsFile=None):
+    results = ResultWriter(resultsFile)
     context = await Context.create_client_context()
+    try:
+        await send_requests(context, host, path, qty, credentialsFile, interval,
+                            mtype, rate, concurrency, duration, timeout, results)
+    finally:
+        results.close()
+        await context.shutdown()
+
+async def send_requests(context, host, path, qty, credentialsFile, interval, mtype,
+                        rate, concurrency, duration, timeout, results):
     if proto_params['is_dtls']:
         context.client_credentials.load_from_dict(json.load(credentialsFile.open('rb')))
+    else:
+        # DTLS server ignores a plain CoAP ping; rely on handshake retries
+        addr, port = split_host(host, proto_params['port'])
+        await wait_ready_async(lambda: coap_ping(addr, port), host)
+    print('Client ready', flush=True)
+
+    uri = '{0}://{1}{2}'.format(proto_params['uri_proto'], host, path)
+    if rate:
+        await run_load(context, uri, mtype, rate, concurrency, qty, duration, timeout,
+                       results)
+        return
 
     for i in range(qty):
-        await asyncio.sleep(2)
-        request = Message(code=GET, uri='{0}://{1}{2}'.format(proto_params['uri_proto'],
-                                                              host, path))
+        await asyncio.sleep(interval)
+        request = Message(mtype=mtype, code=GET, uri=uri)
+        sent = time.monotonic()
         response = await context.request(request).response
 
+        results.exchange(response, sent)
         logging.info('Result: %s\n%r'%(response.code, response.payload))
 
-if __name__ == "__main__":
+async def run_load(context, uri, mtype, rate, concurrency, qty=None, duration=None,
+                   timeout=5, results=None):
+    """
+    Sends requests open-loop at a target rate, and prints a report.
+
+    :param float rate: Target requests per second
+    :param int concurrency: Max requests outstanding; when reached, a send
+                            waits for a slot, but its latency still counts
+                            from its scheduled time
+    :param int qty: Count of requests to send, or None to use duration
+    :param float duration: Seconds to send requests, or None to use qty
+    :param float timeout: Seconds to wait for a response before it is lost
+    :param ResultWriter results: Writes a record for each exchange, including
+                                 'latency' from the scheduled send time
+    :return: (count sent, Counter of results, Histogram of latency in usec)
+    """
+    results = results or ResultWriter()
+    loop    = asyncio.get_running_loop()
+    slots   = asyncio.Semaphore(concurrency)
+    hist    = Histogram()
+    counts  = collections.Counter()
+    pending = set()
+
+    async def send(intended):
+        sent, sent_time = time.monotonic(), time.time()
+        try:
+            request = Message(mtype=mtype, code=GET, uri=uri)
+            response = await asyncio.wait_for(context.request(request).response,
+                                              timeout)
+        except asyncio.TimeoutError:
+            counts['lost'] += 1
+            results.lost(sent_time)
+        except Exception as e:
+            logging.info('Request failed: %r'%e)
+            counts['lost'] += 1
+            results.lost(sent_time, error=repr(e))
+        else:
+            latency = loop.time() - intended
+            hist.record(latency * 1e6)
+            counts[str(response.code)] += 1
+            results.exchange(response, sent, sent_time, latency=latency)
+        finally:
+            slots.release()
+
+    start = loop.time()
+    sent  = 0
+    while (qty is None or sent < qty) and (duration is None or sent / rate < duration):
+        # schedule is fixed by the start time; never shifted by a slow response
+        intended = start + sent / rate
+        await asyncio.sleep(max(0, intended - loop.time()))
+        await slots.acquire()
+        task = asyncio.ensure_future(send(intended))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        sent += 1
+    send_time = loop.time() - start
+    if pending:
+        await asyncio.wait(pending)
+    elapsed = loop.time() - start
+
+    lost     = counts['lost']
+    received = sent - lost
+    report = ['Sent {0} in {1:.2f} s; received {2}, lost {3} ({4:.2f}%)'.format(
+                  sent, send_time, received, lost, 100 * lost / sent if sent else 0),
+              'Throughput {0:.1f} responses/s'.format(received / elapsed if elapsed else 0),
+              'Latency {0}'.format(format_latency(hist))]
+    for code, count in sorted(counts.items()):
+        if code != 'lost':
+            report.append('Response {0}: {1}'.format(code, count))
+    for line in report:
+        logging.info(line)
+        print(line, flush=True)
+    return sent, counts, hist
+
+def command(argv=None):
+    """Reads the command line, and provides the main() coroutine for it. Also
+       used by scenario_daemon.py."""
     logging.info('parsing args')
-    # read command line
-    parser = ArgumentParser()
+    parser = ArgumentParser(prog=os.path.basename(__file__))
     parser.add_argument('-r', dest='host', required=True,
                         help='remote host for URI')
     parser.add_argument('-p', dest='path', required=True,
                         help='URI path for resource')
-    parser.add_argument('-q', dest='qty', type=int, required=True,
+    parser.add_argument('-q', dest='qty', type=int,
                         help='quantity of messages to handle')
     parser.add_argument('-c', dest='credentialsFile', type=Path,
                         help='DTLS credentials file, name format: *.json')
+    parser.add_argument('-i', dest='interval', type=float, default=2,
+                        help='seconds to wait before each send')
+    parser.add_argument('-t', dest='mtype', choices=['CON', 'NON'], default='CON',
+                        help='message type for requests')
+    parser.add_argument('-R', dest='rate', type=float,
+                        help='load mode; target requests per second')
+    parser.add_argument('-n', dest='concurrency', type=int, default=16,
+                        help='load mode; max requests outstanding')
+    parser.add_argument('-d', dest='duration', type=float,
+                        help='load mode; seconds to send requests, instead of QTY')
+    parser.add_argument('-w', dest='timeout', type=float, default=5,
+                        help='load mode; seconds to wait for a response')
+    parser.add_argument('-j', dest='resultsFile',
+                        help='JSON Lines file for a record of each exchange')
+
+    args = parser.parse_args(argv)
+    if args.qty is None and not (args.rate and args.duration):
+        parser.error('requires -q, or -R with -d')
 
-    args = parser.parse_args()
+    return main(args.host, args.path, args.qty, args.credentialsFile, args.interval,
+                CON if args.mtype == 'CON' else NON, args.rate, args.concurrency,
+                args.duration, args.timeout, args.resultsFile)
 
-    asyncio.get_event_loop().run_until_complete(main(args.host, args.path, args.qty,
-                                                     args.credentialsFile))
+if __name__ == "__main__":
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(logfile)
+    logging.basicConfig(level=logging.INFO, filename=logfile)
+    asyncio.get_event_loop().run_until_complete(command())
@@ -11,13 +11,17 @@ Simple request and response tests to gcoap and nanocoap.
 import pytest
 import logging
 import os
+import pexpect
 import re
 import signal
 import time
 
+from coap_results import ResultReader, rtt_histogram
+from coap_stats import format_latency
 from collections import Counter
 from conftest import ExpectHost
-from conftest import proto_params
+from conftest import net, proto_params, proto_port
+from readiness import banner, wait_ready
 
 pwd = os.getcwd()
 logging.basicConfig(level=logging.INFO)
@@ -27,20 +31,27 @@ logging.basicConfig(level=logging.INFO)
 #
 
 @pytest.fixture
-def aiocoap_client():
-    """Runs an aiocoap client to query gcoap_example as a server."""
+def client_results(tmp_path):
+    """Provides a reader for the results file of a client script."""
+    return ResultReader(str(tmp_path / 'results.jsonl'))
+
+@pytest.fixture
+def aiocoap_client(client_cmd, qty_repeat, client_results):
+    """Runs an aiocoap client to query gcoap_example as a server. Writes a
+       record of each exchange for client_results."""
     # server handles same quantity of messages as client sends
-    cmdText = './repeat_send_client.py -r [fd00:bbbb::2] -p /cli/stats -q {0} {1}'
-    cmd = cmdText.format(10, '-c dtls-credentials.json' if proto_params['is_dtls'] else '')
+    argText = '-r {0} -p /cli/stats -q {1} -j {2} {3}'
+    cmd = client_cmd('repeat_send_client.py',
+                     argText.format(net.sut_host(), qty_repeat, client_results.path,
+                                    '-c dtls-credentials.json' if proto_params['is_dtls'] else ''))
 
     host = ExpectHost(pwd, cmd)
     term = host.connect()
-    # allow a couple of seconds for initialization
-    time.sleep(2)
+    wait_ready(lambda: banner(term, 'Client ready'), 'aiocoap client')
     yield host
 
     # teardown
-    host.disconnect()
+    host.disconnect(True)
 
 @pytest.fixture
 def qty_repeat(request):
@@ -55,8 +66,8 @@ def send_recv(client, is_confirm):
     :param boolean is_confirm: True if confirmable message
     """
     # expect like 'Nov 04 11:21:58'
-    cmdText = 'coap get {0} fd00:bbbb::1 {1} /time'.format('-c' if is_confirm else '',
-                                                            proto_params['port'])
+    cmdText = 'coap get {0} {1} {2} /time'.format('-c' if is_confirm else '',
+                                                  net.remote_addr, proto_port(net.port))
     client.send_recv(cmdText, r'\w+ \w+ \d+:\d+:')
 
 def send_recv_nano(client, server_addr):
@@ -67,7 +78,7 @@ def send_recv_nano(client, server_addr):
     :param string server_addr: server address
     """
     # expect like 'Nov 04 11:21:58'
-    client.send_recv('client get {0} 5683 /time'.format(server_addr),
+    client.send_recv('client get {0} {1} /time'.format(server_addr, net.port),
                      r'\w+ \w+ \d+:\d+:')
 
 #
@@ -80,13 +91,16 @@ def test_client_get(libcoap_server, gcoap_example):
     send_recv(gcoap_example, True)
 
 @pytest.mark.parametrize('request_path', ['/xyz'])
-def test_server_no_resource(gcoap_example, libcoap_client, request_path):
-    """Verify response when no matching resource.
+def test_server_no_resource(gcoap_example, coap_client, request_path):
+    """Verify response when no matching resource, for a burst of requests.
 
        This test is more about resources rather than request/response, but
        putting it here as a first step."""
-    output = libcoap_client.run()
-    assert re.search(b'4.04', output) is not None
+    uri = coap_client.uri(net.sut_host(), request_path)
+    start = time.monotonic()
+    responses = coap_client.get_many([uri] * 100)
+    logging.info('100 requests in {0:.3f} s'.format(time.monotonic() - start))
+    assert [r.code for r in responses] == ['4.04'] * 100
 
 def test_client_get_nano(libcoap_server, nanocoap_cli):
     """Single, simple GET request, confirmable only. nanocoap_cli does not
@@ -108,7 +122,8 @@ def test_client_get_repeat(libcoap_server, gcoap_example, qty_repeat):
         send_recv(gcoap_example, False)
         time.sleep(1)
 
-def test_client_server(libcoap_server, gcoap_example, qty_repeat, aiocoap_client):
+def test_client_server(libcoap_server, gcoap_example, qty_repeat, aiocoap_client,
+                       client_results):
     """
     Tests gcoap concurrently sending and receiving messages.
 
@@ -120,14 +135,34 @@ def test_client_server(libcoap_server, gcoap_example, qty_repeat, aiocoap_client
         send_recv(gcoap_example, False)
         time.sleep(1)
 
-    # wait for server to finish
-    while aiocoap_client.term.isalive():
-        time.sleep(2)
+    # validate gcoap server from responses received by aiocoap_client, as
+    # they arrive; generous timeout for the client's send interval
+    content = lambda record: record.get('code') == '2.05 Content'
+    client_results.wait_for(qty_repeat, content, timeout=60)
+    aiocoap_client.term.expect(pexpect.EOF, 10)
 
-    # validate gcoap server from count of responses received by aiocoap_client
-    qty = 0
-    with open(r'repeat_send_client.log') as log:
-        for line in log:
-            qty += (1 if re.search('2.05 Content', line) else 0)
+    client_results.read()
+    assert len(client_results.records) == qty_repeat
+    assert all(content(record) for record in client_results.records)
+    logging.info('gcoap server RTT: {0}'.format(
+                 format_latency(rtt_histogram(client_results.records))))
 
-    assert qty == qty_repeat
+def test_server_load(gcoap_example, client_cmd):
+    """
+    Offers gcoap's /cli/stats resource an open-loop load of non-confirmable
+    requests from repeat_send_client.py. Logs the report of throughput and
+    latency. Raise LOAD_RATE to find the rate gcoap sustains before it drops
+    requests.
+    """
+    rate = os.environ.get('LOAD_RATE', '20')
+    args = '-r {0} -p /cli/stats -t NON -R {1} -q 200 {2}'
+    host = ExpectHost(pwd, client_cmd('repeat_send_client.py', args.format(
+                               net.sut_host(), rate,
+                               '-c dtls-credentials.json' if proto_params['is_dtls'] else '')))
+    output = host.run().decode()
+    logging.info(output)
+
+    match = re.search(r'Sent (\d+) .* lost (\d+)', output)
+    assert match is not None
+    assert int(match.group(1)) == 200
+    assert int(match.group(2)) == 0
@@ -0,0 +1,206 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Cache of prebuilt native RIOT applications. Builds each app once, and then
+launches the cached ELF directly with the tap interface argument, rather than
+with 'make term', which re-evaluates the RIOT build system on every start.
+
+A cache entry is keyed by a hash of the app's source files, the build related
+environment variables, and the state of the RIOT repository. So an entry
+remains valid across test sessions until one of these inputs changes.
+
+Sessions and pytest-xdist workers share the cache and the app folders. A file
+lock in the cache directory serializes the builds of an app, so only the
+first to acquire the lock builds it, and the others use its ELF.
+"""
+
+import concurrent.futures
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+# Environment variables that affect the content of a build
+BUILD_ENV_KEYS = ('BOARD', 'CFLAGS', 'DTLS_PEER_MAX', 'DTLS_PSK', 'RD_ADDR',
+                  'USEMODULE', 'TRANSPORT_PROTOCOL')
+
+# RIOT timing parameters compressed by a time scale, as macro name and value
+# in seconds at full scale. The cord examples register with the minimum RD
+# lifetime, 60 s, and schedule updates from it.
+TIME_PARAMS = {'COAP_ACK_TIMEOUT': 2, 'CORD_LT': 60}
+
+
+def time_params(scale):
+    """Provides the timing parameters for a time scale, like 0.1. The macros
+       are whole seconds, so each value is rounded, to at least 1."""
+    return {name: max(1, round(value * scale)) for name, value in TIME_PARAMS.items()}
+
+def time_cflags(scale):
+    """Provides CFLAGS defines for the timing parameters at a time scale.
+       Empty at full scale, so a build is unchanged."""
+    if scale == 1:
+        return ''
+    return ' '.join('-D{0}={1}'.format(name, value)
+                    for name, value in sorted(time_params(scale).items()))
+
+
+def _build_app(folder, env, dest, lock_path):
+    """
+    Builds an app with make, and copies the resulting ELF to the cache. Runs
+    in a worker process. Holds the lock at lock_path while building, and
+    skips the build if the ELF was cached meanwhile.
+
+    :return: Path to cached ELF
+    :raises RuntimeError: if the build fails
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    with open(lock_path, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(dest):
+            return dest
+
+        result = subprocess.run(['make', 'all'], cwd=folder, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if result.returncode:
+            raise RuntimeError('Build failed for {0}:\n{1}'.format(folder,
+                               result.stdout.decode(errors='replace')[-2000:]))
+
+        board = env.get('BOARD', 'native')
+        elfs  = glob.glob(os.path.join(folder, 'bin', board, '*.elf'))
+        if len(elfs) != 1:
+            raise RuntimeError('Expected one ELF for {0}; found {1}'.format(folder, elfs))
+
+        # copy to a unique file then rename, so a concurrent reader never sees
+        # a partial file
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(dest))
+        os.close(fd)
+        try:
+            shutil.copy2(elfs[0], tmp)
+            os.replace(tmp, dest)
+        except OSError:
+            os.unlink(tmp)
+            raise
+    return dest
+
+
+class BuildCache():
+    """
+    Cache of native RIOT app ELF files. Use build_all() to build a set of apps
+    in parallel up front, and term_cmd() to get the command to start an app.
+
+    The RIOT_BUILD_CACHE environment variable sets the cache directory. Set it
+    to '0' to disable the cache, so apps start with 'make term'.
+    """
+
+    def __init__(self, cache_dir=None, board=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('RIOT_BUILD_CACHE',
+                        os.path.expanduser('~/.cache/riot-coap-pytest'))
+        self.enabled   = cache_dir != '0'
+        self.cache_dir = cache_dir
+        self.board     = board or os.environ.get('BOARD', 'native')
+        # key: app folder, value: path to cached ELF, verified this session
+        self._elfs     = {}
+        self._riot_state = None
+
+    def term_cmd(self, folder, port='tap0'):
+        """
+        Provides the command to start a RIOT app with a terminal. Builds the
+        app if not already cached.
+
+        :param string folder: App source folder
+        :param string port: Tap interface for the native instance
+        :return: string command, relative to the app folder
+        """
+        if self.board != 'native':
+            return 'make term'
+        if not self.enabled:
+            return 'make term PORT={0}'.format(port)
+
+        elf = self._elfs.get(folder)
+        if not elf:
+            elf = self.build_all([folder])[folder]
+        return '{0} {1}'.format(elf, port)
+
+    def build_all(self, folders, max_workers=None):
+        """
+        Ensures each app is built and cached. Builds stale apps in parallel
+        across a process pool.
+
+        :param folders: Iterable of app source folders
+        :return: dict of ELF path by app folder
+        """
+        pending = {}
+        for folder in set(folders) - set(self._elfs):
+            dest = self._elf_path(folder)
+            if os.path.exists(dest):
+                self._elfs[folder] = dest
+            else:
+                pending[folder] = dest
+
+        if pending:
+            env = os.environ.copy()
+            env['BOARD'] = self.board
+            logging.info('Building RIOT apps: {0}'.format(', '.join(pending)))
+            with concurrent.futures.ProcessPoolExecutor(max_workers) as pool:
+                futures = {folder: pool.submit(_build_app, folder, env, dest,
+                                               self._lock_path(folder))
+                           for folder, dest in pending.items()}
+                for folder, future in futures.items():
+                    self._elfs[folder] = future.result()
+
+        return {folder: self._elfs[folder] for folder in folders}
+
+    def key(self, folder):
+        """
+        Provides the cache key for an app, from its source files, build
+        environment, and the RIOT repository state.
+
+        :return: hex digest string
+        """
+        digest = hashlib.sha256()
+        digest.update(self.board.encode())
+        for name in BUILD_ENV_KEYS:
+            digest.update('{0}={1}\0'.format(name, os.environ.get(name, '')).encode())
+        digest.update(self._get_riot_state())
+
+        for root, dirs, files in os.walk(folder):
+            # exclude build output and hidden directories; sort for stable order
+            dirs[:] = sorted(d for d in dirs if d != 'bin' and not d.startswith('.'))
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode() + b'\0')
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+        return digest.hexdigest()
+
+    def _elf_path(self, folder):
+        name = os.path.basename(os.path.normpath(folder))
+        return os.path.join(self.cache_dir, self.key(folder)[:16], name + '.elf')
+
+    def _lock_path(self, folder):
+        """Lock for builds in an app folder, whatever the cache key."""
+        name = hashlib.sha256(os.path.abspath(folder).encode()).hexdigest()[:16]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return os.path.join(self.cache_dir, name + '.lock')
+
+    def _get_riot_state(self):
+        """Identifies the RIOT repository content as the HEAD commit plus any
+           uncommitted changes. Evaluated once per session."""
+        if self._riot_state is None:
+            self._riot_state = b''
+            base = os.environ.get('RIOTBASE', None)
+            if base:
+                for cmd in (['git', 'rev-parse', 'HEAD'], ['git', 'diff', 'HEAD']):
+                    result = subprocess.run(cmd, cwd=base, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL)
+                    self._riot_state += hashlib.sha256(result.stdout).digest()
+        return self._riot_state
@@ -0,0 +1,70 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests the RIOT app build cache with a stand-in app, whose Makefile only writes
+an ELF file, and the timing parameters for TIME_SCALE. Does not require RIOT.
+"""
+
+import concurrent.futures
+import os
+import pytest
+import subprocess
+import sys
+
+from riot_build import BuildCache, time_cflags, time_params
+
+#
+# fixtures and utility functions
+#
+
+@pytest.fixture
+def fake_app(tmp_path):
+    """Provides the folder for an app that takes a moment to build, and counts
+       its builds in the file 'builds'."""
+    folder = tmp_path / 'fake-app'
+    folder.mkdir()
+    (folder / 'Makefile').write_text('all:\n'
+                                     '\tsleep 0.5\n'
+                                     '\tmkdir -p bin/$(BOARD)\n'
+                                     '\techo elf > bin/$(BOARD)/fake-app.elf\n'
+                                     '\techo build >> ../builds\n')
+    return str(folder)
+
+#
+# tests
+#
+
+def test_concurrent_build(tmp_path, fake_app):
+    """Caches that share a directory, like for xdist workers, build an app
+       once."""
+    cache_dir = str(tmp_path / 'cache')
+    caches    = [BuildCache(cache_dir, 'native') for i in range(3)]
+    with concurrent.futures.ThreadPoolExecutor(len(caches)) as pool:
+        elfs = list(pool.map(lambda cache: cache.build_all([fake_app])[fake_app], caches))
+
+    assert len(set(elfs)) == 1
+    with open(elfs[0]) as f:
+        assert f.read() == 'elf\n'
+    with open(str(tmp_path / 'builds')) as f:
+        assert f.read().count('build') == 1
+    assert not [name for name in os.listdir(os.path.dirname(elfs[0]))
+                if name.endswith('.tmp')]
+
+def test_time_params():
+    """Scaled RIOT timing parameters are whole seconds, at least 1."""
+    assert time_params(1) == {'COAP_ACK_TIMEOUT': 2, 'CORD_LT': 60}
+    assert time_params(0.1) == {'COAP_ACK_TIMEOUT': 1, 'CORD_LT': 6}
+    assert time_cflags(1) == ''
+    assert time_cflags(0.1) == '-DCOAP_ACK_TIMEOUT=1 -DCORD_LT=6'
+
+def test_time_cflags_import():
+    """A script that imports conftest keeps its CFLAGS, with TIME_SCALE."""
+    env = dict(os.environ, TIME_SCALE='0.1', CFLAGS='-DTEST')
+    out = subprocess.check_output([sys.executable, '-c',
+                                   'import os, conftest; print(os.environ["CFLAGS"])'],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    assert out.decode().strip() == '-DTEST'
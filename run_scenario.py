@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Runs a client script in scenario_daemon.py, with the same arguments and
+output as running the script directly, and the same exit status. Imports only
+the standard library, so it starts in a few milliseconds. Prints the time to
+start the scenario in the daemon, and the time to run it, on stderr at the
+end:
+
+Scenario block1_client.py: startup 0.5 ms, run 151.2 ms
+
+Usage:
+    usage: run_scenario.py -s SOCKET SCRIPT [ARG ...]
+    usage: run_scenario.py -h
+
+    positional arguments:
+      SCRIPT      client script, like block1_client.py
+      ARG         arguments for the script
+
+    optional arguments:
+      -h, --help  show this help message and exit
+      -s SOCKET   path for the daemon's Unix socket
+
+Example:
+
+$ ./run_scenario.py -s /tmp/scenario.sock block1_client.py -r [fd00:bbbb::2] -b 64
+Expected: C496DF5946783990BEC5EFDC2999530EEB9175B83094BAE66170FF2431FC896E
+Result: 2.04 Changed
+b'C496DF5946783990BEC5EFDC2999530EEB9175B83094BAE66170FF2431FC896E'
+Scenario block1_client.py: startup 0.5 ms, run 151.2 ms
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+def run(path, script, argv, out=sys.stdout, err=sys.stderr):
+    """
+    Runs a scenario in the daemon, and writes its output as it arrives.
+
+    :param string path: Path for the daemon's Unix socket
+    :return: exit status of the scenario
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        request = {'script': script, 'argv': argv, 'cwd': os.getcwd()}
+        sock.sendall(json.dumps(request).encode() + b'\n')
+
+        for line in sock.makefile('rb'):
+            frame = json.loads(line)
+            if 'out' in frame:
+                out.write(frame['out'])
+                out.flush()
+            elif 'exit' in frame:
+                print('Scenario {0}: startup {1:.1f} ms, run {2:.1f} ms'.format(
+                      script, frame['startup'] * 1000, frame['run'] * 1000),
+                      file=err, flush=True)
+                return frame['exit']
+    print('Scenario {0}: daemon closed connection'.format(script), file=err)
+    return 1
+
+if __name__ == "__main__":
+    # read command line
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', dest='socket', required=True,
+                        help="path for the daemon's Unix socket")
+    parser.add_argument('script', metavar='SCRIPT',
+                        help='client script, like block1_client.py')
+    parser.add_argument('argv', metavar='ARG', nargs=argparse.REMAINDER,
+                        help='arguments for the script')
+
+    args = parser.parse_args()
+
+    try:
+        sys.exit(run(args.socket, args.script, args.argv))
+    except OSError as e:
+        sys.exit('Scenario daemon not available at {0}: {1}'.format(args.socket, e))
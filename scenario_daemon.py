@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Resident runner for the aiocoap client scripts, so a test does not pay for a
+new Python interpreter and the aiocoap imports on each run of a client.
+Imports block1_client.py, block2_client.py, observe_client.py and
+repeat_send_client.py once, and creates and closes an aiocoap client context
+to load the transports it uses. Then listens on a Unix socket for scenarios
+from run_scenario.py.
+
+A scenario is a run of one of the scripts, with the same command line
+arguments as the script itself. Each scenario runs in its own thread, with its
+own event loop, so scenarios run concurrently, and a script that blocks the
+loop, like for a readiness probe, does not delay the others. Output from the
+scenario thread, on stdout and stderr, streams back to run_scenario.py. When
+the scenario finishes, the daemon reports its exit status, and the time to
+start the scenario, from receipt of the request until the script's main()
+coroutine starts, separately from the time to run main(). If run_scenario.py
+exits first, like when a test kills it, the daemon cancels the scenario.
+
+The daemon configures logging for the scripts, which do so only when run by
+themselves. Log records at INFO level and above from a scenario stream back
+with its output, except for repeat_send_client.py, which logs to
+repeat_send_client.log like when run by itself. That file then accumulates the
+scenarios since the daemon started.
+
+Relative paths in arguments, like a credentials file, are relative to the
+daemon's working directory. So run_scenario.py requires the same working
+directory.
+
+Prints 'Daemon ready' when listening.
+
+Protocol, one JSON object per line:
+
+:request:  {"script": "block1_client.py", "argv": [...], "cwd": "/path"}
+:output:   {"out": "text"}
+:finish:   {"exit": 0, "startup": 0.0012, "run": 1.503}; times in seconds
+
+Usage:
+    usage: scenario_daemon.py -s SOCKET
+    usage: scenario_daemon.py -h
+
+    optional arguments:
+      -h, --help  show this help message and exit
+      -s SOCKET   path for the Unix socket
+
+Example:
+
+$ ./scenario_daemon.py -s /tmp/scenario.sock
+Daemon ready
+
+$ ./run_scenario.py -s /tmp/scenario.sock repeat_send_client.py -r [fd00:bbbb::2] -p /cli/stats -q 1
+Client ready
+Scenario repeat_send_client.py: startup 0.4 ms, run 2012.7 ms
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+
+class ThreadOutput():
+    """
+    Replacement for sys.stdout or sys.stderr that sends text written from a
+    scenario thread to the scenario's sink. Text from other threads goes to
+    the original stream.
+    """
+    _local = threading.local()
+
+    def __init__(self, base):
+        self.base = base
+
+    @classmethod
+    def set_sink(cls, sink):
+        """Sets the function that receives text written from this thread."""
+        cls._local.sink = sink
+
+    def write(self, text):
+        sink = getattr(self._local, 'sink', None)
+        if sink:
+            sink(text)
+            return len(text)
+        return self.base.write(text)
+
+    def flush(self):
+        if not getattr(self._local, 'sink', None):
+            self.base.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+def redirect_output():
+    """Installs ThreadOutput for sys.stdout and sys.stderr, if not already.
+       Install before a logging handler takes sys.stderr, so its output also
+       reaches the scenario."""
+    if not isinstance(sys.stdout, ThreadOutput):
+        sys.stdout = ThreadOutput(sys.stdout)
+    if not isinstance(sys.stderr, ThreadOutput):
+        sys.stderr = ThreadOutput(sys.stderr)
+
+def restore_output():
+    if isinstance(sys.stdout, ThreadOutput):
+        sys.stdout = sys.stdout.base
+    if isinstance(sys.stderr, ThreadOutput):
+        sys.stderr = sys.stderr.base
+
+def current_script():
+    """Provides the name of the script for the scenario running in this
+       thread, or None outside a scenario."""
+    return getattr(Scenario._local, 'script', None)
+
+def setup_logging(log_files, level=logging.INFO):
+    """
+    Configures the root logger for the daemon and its scenarios. Logs to
+    stderr, which streams to a scenario from its thread. A scenario for a
+    script in log_files logs to its file instead.
+
+    :param log_files: Dictionary of script name to log file path, like
+                      {'repeat_send_client.py': 'repeat_send_client.log'}
+    :return: List of the handlers added
+    """
+    redirect_output()
+    formatter = logging.Formatter(logging.BASIC_FORMAT)
+    handlers  = [logging.StreamHandler()]
+    handlers[0].addFilter(lambda record: current_script() not in log_files)
+    for script, path in log_files.items():
+        handler = logging.FileHandler(path, mode='w')
+        handler.addFilter(lambda record, script=script: current_script() == script)
+        handlers.append(handler)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    return handlers
+
+def exit_code(exc):
+    """Provides the process exit status for a SystemExit."""
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    print(exc.code, file=sys.stderr)
+    return 1
+
+
+class Scenario():
+    """
+    A run of a script in its own thread and event loop.
+
+    :param command: Function that reads the script's command line arguments,
+                    and provides the coroutine to run
+    :param sink: Function that receives output text; called from the
+                 scenario thread
+    :param done: Function that receives (exit status, startup seconds,
+                 run seconds) at the end; called from the scenario thread
+    :param string script: Name of the script, for current_script()
+    """
+    _local = threading.local()
+
+    def __init__(self, command, argv, sink, done, script=None):
+        self.command   = command
+        self.argv      = argv
+        self.sink      = sink
+        self.done      = done
+        self.script    = script
+        self.received  = time.monotonic()
+        self._loop     = None
+        self._task     = None
+        self._cancelled = False
+        self._lock     = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def cancel(self):
+        """Cancels the scenario's coroutine; safe from any thread."""
+        with self._lock:
+            self._cancelled = True
+            if self._task:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def _run(self):
+        # in case sys.stdout was replaced since the daemon started
+        redirect_output()
+        ThreadOutput.set_sink(self.sink)
+        Scenario._local.script = self.script
+        loop    = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        started = None
+        code    = 0
+        try:
+            coro = self.command(self.argv)
+            with self._lock:
+                self._loop = loop
+                self._task = loop.create_task(coro)
+                if self._cancelled:
+                    self._task.cancel()
+            started = time.monotonic()
+            loop.run_until_complete(self._task)
+        except SystemExit as e:
+            code = exit_code(e)
+        except asyncio.CancelledError:
+            code = 1
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            loop.close()
+            ended = time.monotonic()
+            started = started or ended
+            ThreadOutput.set_sink(None)
+            Scenario._local.script = None
+        self.done(code, started - self.received, ended - started)
+
+
+class ScenarioDaemon():
+    """
+    Serves scenario requests on a Unix socket, with the running event loop.
+
+    :param scenarios: Dictionary of script name to command function, like
+                      {'block1_client.py': block1_client.command}
+    """
+
+    def __init__(self, scenarios):
+        self.scenarios = scenarios
+        self._server   = None
+        redirect_output()
+
+    async def start(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = await asyncio.start_unix_server(self._handle, path)
+
+    def close(self):
+        if self._server:
+            self._server.close()
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            request = json.loads(await reader.readline())
+        except ValueError:
+            writer.close()
+            return
+
+        def send(frame):
+            if not writer.is_closing():
+                writer.write(json.dumps(frame).encode() + b'\n')
+
+        command = self.scenarios.get(request.get('script'))
+        error   = None
+        if command is None:
+            error = 'Unknown scenario: {0}\n'.format(request.get('script'))
+        elif request.get('cwd', os.getcwd()) != os.getcwd():
+            error = 'Working directory must be {0}\n'.format(os.getcwd())
+        if error:
+            send({'out': error})
+            send({'exit': 2, 'startup': 0, 'run': 0})
+            writer.close()
+            return
+
+        finished = loop.create_future()
+        def done(*result):
+            loop.call_soon_threadsafe(finished.set_result, result)
+
+        scenario = Scenario(command, request.get('argv', []),
+                            lambda text: loop.call_soon_threadsafe(send, {'out': text}),
+                            done, request['script'])
+        scenario.start()
+
+        # the client closes its end if it exits before the scenario
+        closed = asyncio.ensure_future(reader.read())
+        await asyncio.wait([finished, closed], return_when=asyncio.FIRST_COMPLETED)
+        if not finished.done():
+            scenario.cancel()
+            await finished
+        closed.cancel()
+
+        code, startup, run = finished.result()
+        logging.info('Scenario {0} exit {1}; startup {2:.1f} ms, run {3:.1f} ms'.format(
+                     request['script'], code, startup * 1000, run * 1000))
+        try:
+            send({'exit': code, 'startup': startup, 'run': run})
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+
+async def load_scenarios():
+    """Imports the client scripts, configures logging for them, and loads the
+       aiocoap transports.
+
+    :return: Dictionary of script name to command function
+    """
+    import block1_client
+    import block2_client
+    import observe_client
+    import repeat_send_client
+    from aiocoap import Context
+
+    setup_logging({'repeat_send_client.py': repeat_send_client.logfile})
+
+    context = await Context.create_client_context()
+    await context.shutdown()
+
+    return {'block1_client.py': block1_client.command,
+            'block2_client.py': block2_client.command,
+            'observe_client.py': observe_client.command,
+            'repeat_send_client.py': repeat_send_client.command}
+
+async def main(path):
+    daemon = ScenarioDaemon(await load_scenarios())
+    await daemon.start(path)
+    print('Daemon ready', flush=True)
+
+    # serve until killed
+    try:
+        await asyncio.get_event_loop().create_future()
+    finally:
+        daemon.close()
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-s', dest='socket', required=True,
+                        help='path for the Unix socket')
+
+    args = parser.parse_args()
+
+    # before logging is configured, so log output also reaches the scenario
+    redirect_output()
+    asyncio.get_event_loop().run_until_complete(main(args.socket))
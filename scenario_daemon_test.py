@@ -0,0 +1,145 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests the scenario daemon and runner with Python scenarios in place of the
+aiocoap client scripts. Does not require RIOT or aiocoap.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import pytest
+import socket
+import threading
+from argparse import ArgumentParser
+
+from run_scenario import run
+from scenario_daemon import ScenarioDaemon, restore_output, setup_logging
+
+#
+# fixtures and utility functions
+#
+
+cancelled = threading.Event()
+
+def echo_command(argv):
+    parser = ArgumentParser()
+    parser.add_argument('-m', dest='message', required=True)
+    args = parser.parse_args(argv)
+
+    async def echo():
+        await asyncio.sleep(0)
+        print(args.message, flush=True)
+    return echo()
+
+def sleep_command(argv):
+    async def sleep():
+        print('sleeping', flush=True)
+        try:
+            await asyncio.sleep(30)
+        finally:
+            cancelled.set()
+    return sleep()
+
+def log_command(argv):
+    async def log():
+        logging.getLogger('scenario').warning(argv[0])
+    return log()
+
+@pytest.fixture
+def daemon(tmp_path):
+    """Runs a ScenarioDaemon in a thread with its own event loop.
+
+    :return: path for the daemon's socket
+    """
+    path    = str(tmp_path / 'scenario.sock')
+    loop    = asyncio.new_event_loop()
+    daemon  = ScenarioDaemon({'echo.py': echo_command, 'sleep.py': sleep_command,
+                               'log.py': log_command, 'filelog.py': log_command})
+    started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(daemon.start(path))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait(2)
+    yield path
+
+    # teardown
+    loop.call_soon_threadsafe(daemon.close)
+    loop.call_soon_threadsafe(loop.stop)
+    restore_output()
+
+#
+# tests
+#
+
+def test_run(daemon):
+    """Output and exit status arrive as from the script itself, and
+       concurrent scenarios keep their output separate."""
+    outputs = [io.StringIO() for i in range(4)]
+    err     = io.StringIO()
+    codes   = []
+    threads = [threading.Thread(target=lambda i=i: codes.append(
+                   run(daemon, 'echo.py', ['-m', 'hello {0}'.format(i)], outputs[i], err)))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert codes == [0] * 4
+    assert [out.getvalue() for out in outputs] == ['hello {0}\n'.format(i)
+                                                   for i in range(4)]
+    assert err.getvalue().count('Scenario echo.py: startup') == 4
+
+def test_errors(daemon):
+    """Bad arguments exit with status 2 like argparse; an unknown script or
+       working directory is refused."""
+    out = io.StringIO()
+    assert run(daemon, 'echo.py', [], out, io.StringIO()) == 2
+    assert 'required' in out.getvalue()
+    assert run(daemon, 'unknown.py', [], io.StringIO(), io.StringIO()) == 2
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(daemon)
+        sock.sendall(json.dumps({'script': 'echo.py', 'argv': ['-m', 'x'],
+                                 'cwd': '/'}).encode() + b'\n')
+        frames = [json.loads(line) for line in sock.makefile('rb')]
+    assert frames[-1]['exit'] == 2
+
+def test_cancel(daemon):
+    """Closing the connection cancels the scenario."""
+    cancelled.clear()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(daemon)
+        sock.sendall(json.dumps({'script': 'sleep.py', 'argv': [],
+                                 'cwd': os.getcwd()}).encode() + b'\n')
+        assert json.loads(sock.makefile('rb').readline()) == {'out': 'sleeping'}
+    assert cancelled.wait(5)
+
+def test_logging(daemon, tmp_path):
+    """A scenario logs to its output, or to the log file for its script."""
+    path     = str(tmp_path / 'filelog.log')
+    handlers = setup_logging({'filelog.py': path})
+    try:
+        out, err = io.StringIO(), io.StringIO()
+        assert run(daemon, 'log.py', ['to output'], out, err) == 0
+        assert run(daemon, 'filelog.py', ['to file'], out, err) == 0
+    finally:
+        for handler in handlers:
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+
+    assert out.getvalue() == 'WARNING:scenario:to output\n'
+    with open(path) as f:
+        assert f.read() == 'WARNING:scenario:to file\n'
@@ -18,3 +18,47 @@ export PYTHONPATH="${SOSCOAP_BASE}:${AIOCOAP_BASE}"
 
 # UDP or DTLS, used by proto_params dictionary in conftest.py
 export TRANSPORT_PROTOCOL="UDP"
+
+# Set to 0 to start a fresh RIOT host for every test, rather than reuse hosts
+# across tests. See HostPool in conftest.py.
+export RIOT_HOST_POOL="1"
+
+# Ceiling on time to wait for a host to become ready, in seconds. See
+# readiness.py.
+export READY_TIMEOUT="10"
+
+# Directory for cached native RIOT app builds, or 0 to start apps with
+# 'make term'. See riot_build.py.
+export RIOT_BUILD_CACHE="${HOME}/.cache/riot-coap-pytest"
+
+# Directory for host output logs, or 0 to disable capture. See
+# host_capture.py.
+export HOST_LOG_DIR="host_logs"
+
+# Seconds a host has to stop after SIGTERM at teardown, before SIGKILL. See
+# host_reaper.py.
+export REAP_GRACE="1"
+
+# Set to 'standin' to run block tests against standin_server.py rather than a
+# RIOT block server app. STANDIN_ARGS are additional arguments for it. See
+# start_block_standin() in conftest.py.
+export BLOCK_SERVER="riot"
+export STANDIN_ARGS=""
+
+# Seed for random impairments by the impair_proxy fixture. See
+# impair_proxy.py.
+export IMPAIR_SEED="0"
+
+# Set to 0 to run the aiocoap client scripts directly, rather than in
+# scenario_daemon.py. See client_cmd() in conftest.py.
+export SCENARIO_DAEMON="1"
+
+# Set below 1 to compress protocol time, like 0.1 for RD lifetimes and CoAP
+# retransmission timeouts ten times shorter. See riot_time in conftest.py.
+export TIME_SCALE="1"
+
+# Set to a directory to capture the packets of each test to a pcap file there,
+# and PCAP_IFACES for interfaces other than the SUT's tap. Requires the
+# CAP_NET_RAW capability. See packet_capture() in conftest.py.
+export PCAP_DIR="0"
+export PCAP_IFACES=""
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+"""
+Stand-in for a RIOT CoAP server, so client scripts and benchmarks may run
+without RIOT. Serves over UDP at PORT, and with -k also over DTLS at PORT + 1,
+like proto_port() in conftest.py. DTLS requires aiocoap's tinydtls support,
+from the DTLSSocket package.
+
+Resources:
+
+/cli/stats  Like the gcoap example; responds with the count of requests it
+            has served, as text. Observable; each GET without the Observe
+            option notifies observers
+/sha256     Like gcoap-block-server and nanocoap_server; accepts a Block1
+            POST and responds with the SHA256 digest of the payload, as
+            upper case hex text
+/riot/ver   Like gcoap-block-server and nanocoap_server; responds to GET with
+            a version sentence, with Block2 if requested or larger than the
+            max block size. The sentence repeats to fill SIZE bytes if given,
+            or the size in a 'size=N' query, like /riot/ver?size=65536, so a
+            benchmark may sweep body sizes.
+
+For blockwise transfers the server limits block size to MAX_BLOCK, like the
+buffer size of a RIOT app, and the client must follow the smaller size.
+
+Prints 'Server ready' when listening.
+
+Usage:
+    usage: standin_server.py [-a ADDR] [-p PORT] [-k PSK] [-u IDENTITY]
+                             [-m MAX_BLOCK] [-v SIZE]
+    usage: standin_server.py -h
+
+    optional arguments:
+      -h, --help    show this help message and exit
+      -a ADDR       address to bind; ::1 by default
+      -p PORT       UDP port to bind; 5683 by default
+      -k PSK        also serve DTLS with this pre-shared key
+      -u IDENTITY   DTLS PSK client identity; Client_identity by default
+      -m MAX_BLOCK  max block size, 16 to 1024; 1024 by default
+      -v SIZE       size of /riot/ver body, in bytes
+
+Example:
+
+$ PYTHONPATH="/home/kbee/src/aiocoap" ./standin_server.py -a ::1 -p 5683 -k secretPSK
+Server ready
+"""
+
+import asyncio
+import hashlib
+import logging
+from argparse import ArgumentParser
+
+import aiocoap.resource as resource
+from aiocoap import *
+from aiocoap import optiontypes
+from aiocoap.credentials import CredentialsMap
+
+logging.basicConfig(level=logging.INFO)
+
+class StatsResource(resource.ObservableResource):
+    """
+    Handle GET for the count of requests served, like gcoap /cli/stats.
+    Observable; an Observe registration or cancellation does not count, so
+    each plain GET sends one notification to every observer.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    async def render_get(self, request):
+        if request.opt.observe is None:
+            self.count += 1
+            # notify after this response is sent
+            asyncio.get_event_loop().call_soon(self.updated_state)
+        msg = Message(payload=str(self.count).encode('ascii'))
+        msg.opt.content_format = 0
+        return msg
+
+
+class Sha256Resource(resource.Resource):
+    """
+    Handle Block1 POST, and respond with the SHA256 digest of the payload.
+    Tracks a transfer per client endpoint. Writes each block in place into a
+    reassembly buffer, preallocated from the Size1 option when the client
+    provides it, and hashes the block from the buffer as it arrives.
+    """
+
+    def __init__(self, max_block):
+        super().__init__()
+        self.max_block = max_block
+        # key: remote endpoint, value: (buffer, digest, next offset)
+        self._transfers = {}
+
+    async def needs_blockwise_assembly(self, request):
+        # handles each block itself, rather than aiocoap's reassembly
+        return False
+
+    async def render_post(self, request):
+        block = request.opt.block1
+        if block is None:
+            return self._changed(hashlib.sha256(request.payload))
+
+        key    = request.remote
+        offset = block.start
+        if block.block_number == 0:
+            size = request.opt.size1 or len(request.payload)
+            self._transfers[key] = (bytearray(size), hashlib.sha256(), 0)
+        elif key not in self._transfers or self._transfers[key][2] != offset:
+            return Message(code=REQUEST_ENTITY_INCOMPLETE)
+        buf, digest, _ = self._transfers[key]
+
+        end = offset + len(request.payload)
+        if end > len(buf):
+            buf.extend(bytes(end - len(buf)))
+        view = memoryview(buf)
+        view[offset:end] = request.payload
+        digest.update(view[offset:end])
+        view.release()
+
+        if block.more:
+            self._transfers[key] = (buf, digest, end)
+            size_exp = min(block.size_exponent, self.max_block.bit_length() - 5)
+            response = Message(code=CONTINUE)
+            response.opt.block1 = optiontypes.BlockOption.BlockwiseTuple(
+                                      block.block_number, True, size_exp)
+            return response
+
+        del self._transfers[key]
+        response = self._changed(digest)
+        response.opt.block1 = block
+        return response
+
+    def _changed(self, digest):
+        response = Message(code=CHANGED, payload=digest.hexdigest().upper().encode('ascii'))
+        response.opt.content_format = 0
+        return response
+
+
+class VersionResource(resource.Resource):
+    """Handle GET for a version sentence, with Block2."""
+    SENTENCE = b'This is RIOT (Version: standin) running on a native board with a native MCU.'
+
+    def __init__(self, max_block, size=None):
+        super().__init__()
+        self.max_block = max_block
+        self.body = self._make_body(size)
+        # bodies for a size query, by size
+        self._bodies = {}
+
+    def _make_body(self, size):
+        body = self.SENTENCE
+        if size:
+            body = (body + b' ') * (size // (len(body) + 1) + 1)
+        return body[:size] if size else body
+
+    def _get_body(self, request):
+        """Provides the body for the size query in the request, if any."""
+        for arg in request.opt.uri_query:
+            name, _, value = arg.partition('=')
+            if name == 'size' and value.isdigit():
+                size = int(value)
+                if size not in self._bodies:
+                    self._bodies[size] = self._make_body(size)
+                return self._bodies[size]
+        return self.body
+
+    async def needs_blockwise_assembly(self, request):
+        # responds with each block itself, limited to max_block
+        return False
+
+    async def render_get(self, request):
+        block    = request.opt.block2
+        body     = self._get_body(request)
+        size_exp = self.max_block.bit_length() - 5
+        if block is not None:
+            size_exp = min(size_exp, block.size_exponent)
+        size = 2 ** (size_exp + 4)
+        num  = block.block_number if block is not None else 0
+        if block is not None and block.size_exponent > size_exp:
+            # client asked for larger blocks; renumber for the smaller size
+            num = block.start // size
+        if block is None and len(body) <= size:
+            response = Message(payload=body)
+        else:
+            start = num * size
+            if start >= len(body) and start:
+                return Message(code=BAD_OPTION)
+            response = Message(payload=body[start:start + size])
+            response.opt.block2 = optiontypes.BlockOption.BlockwiseTuple(
+                                      num, start + size < len(body), size_exp)
+            response.opt.size2 = len(body)
+        response.opt.content_format = 0
+        return response
+
+
+def build_site(max_block=1024, ver_size=None):
+    """Provides the resources for the stand-in server."""
+    root = resource.Site()
+    root.add_resource(('.well-known', 'core'),
+                      resource.WKCResource(root.get_resources_as_linkheader))
+    root.add_resource(('cli', 'stats'), StatsResource())
+    root.add_resource(('sha256',), Sha256Resource(max_block))
+    root.add_resource(('riot', 'ver'), VersionResource(max_block, ver_size))
+    return root
+
+async def main(addr, port, psk=None, identity='Client_identity', max_block=1024,
+               ver_size=None):
+    credentials = CredentialsMap()
+    if psk:
+        # aiocoap keys server credentials by ':' and client identity
+        credentials.load_from_dict({':' + identity: {'dtls': {
+                                        'psk': {'ascii': psk},
+                                        'client-identity': {'ascii': identity}}}})
+    context = await Context.create_server_context(build_site(max_block, ver_size),
+                                                  bind=(addr, port),
+                                                  server_credentials=credentials)
+    print('Server ready', flush=True)
+
+    # serve until killed
+    await asyncio.get_running_loop().create_future()
+
+if __name__ == "__main__":
+    # read command line
+    parser = ArgumentParser()
+    parser.add_argument('-a', dest='addr', default='::1',
+                        help='address to bind')
+    parser.add_argument('-p', dest='port', type=int, default=5683,
+                        help='UDP port to bind')
+    parser.add_argument('-k', dest='psk',
+                        help='also serve DTLS with this pre-shared key')
+    parser.add_argument('-u', dest='identity', default='Client_identity',
+                        help='DTLS PSK client identity')
+    parser.add_argument('-m', dest='max_block', type=int, default=1024,
+                        help='max block size, 16 to 1024')
+    parser.add_argument('-v', dest='ver_size', type=int,
+                        help='size of /riot/ver body, in bytes')
+
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(main(args.addr, args.port, args.psk,
+                                                     args.identity, args.max_block,
+                                                     args.ver_size))
@@ -0,0 +1,57 @@
+# Copyright (c) 2018 Ken Bannister. All rights reserved.
+#
+# This file is subject to the terms and conditions of the GNU Lesser
+# General Public License v2.1. See the file LICENSE in the top level
+# directory for more details.
+
+"""
+Tests blockwise transfers with standin_server.py, which must follow the max
+block size like a RIOT block server. Does not require RIOT.
+"""
+
+import hashlib
+import pytest
+
+from block_bench import BlockClient, make_payload
+from conftest import standin_addr
+
+#
+# fixtures and utility functions
+#
+
+# 64 byte max blocks, and a 300 byte /riot/ver body
+small_blocks = pytest.mark.parametrize('standin_server', ['-m 64 -v 300'], indirect=True)
+
+@pytest.fixture
+def block_client(standin_server):
+    """Provides a BlockClient for the stand-in server."""
+    client = BlockClient(*standin_addr())
+    yield client
+
+    # teardown
+    client.close()
+
+#
+# tests
+#
+
+@small_blocks
+@pytest.mark.parametrize('size,block_size', [(100, 32), (1000, 64), (1000, 256)])
+def test_block1(block_client, size, block_size):
+    """Block1 POST of several blocks; the client follows the max block
+       size."""
+    payload  = make_payload(size)
+    transfer = block_client.block1('/sha256', payload, block_size)
+
+    assert transfer.response.payload.decode() == hashlib.sha256(payload).hexdigest().upper()
+    assert transfer.block_size == min(block_size, 64)
+
+@small_blocks
+def test_block2(block_client):
+    """Block2 GET of several blocks, limited to the max block size."""
+    transfer = block_client.block2('/riot/ver', 256)
+
+    assert transfer.payload_size == 300
+    assert transfer.response.payload.startswith(b'This is RIOT (Version: standin)')
+    assert transfer.block_size == 64
+    assert transfer.messages == 2 * 5